@@ -1,20 +1,31 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-import io
-
-# 🆕 استيراد أداة الاتصال بـ Google Sheets
-from streamlit_gsheets import GSheetsConnection 
+import math
+import hashlib
+import sqlite3
+import time
+import uuid
+
+import metrics
+
+# 🆕 دوال الوصول إلى البيانات (المخزن المحلي ومزامنته مع Google Sheets)
+from data_access import (
+    DEDUCTION_AMOUNT, EXPORT_COLUMNS, SPREADSHEET_NAME, archive_closed_periods, get_activity_series,
+    check_driver_import, get_all_drivers_details, get_client, get_driver_activity, get_driver_dashboard, get_driver_index,
+    get_driver_info,
+    get_history_page, get_mirror, get_reconciliation, get_refresher, get_sheet_data, get_store, get_totals, get_writer,
+    import_drivers, load_archived_period, record_delivery_batch, search_driver, suggest_drivers, update_balance,
+    update_drivers_bulk,
+)
+from bulk_ops import DRIVER_FIELD_ALIASES, EDITABLE_DRIVER_COLUMNS, diff_driver_edits, import_formats
+from ledger_export import EXPORT_FORMATS, available_formats, export_transactions
+from sheets_client import SheetsQuotaError
 
 # --- إعدادات التطبيق ---
-DEDUCTION_AMOUNT = 15.0  # المبلغ المخصوم لكل توصيلة (أوقية)
 ADMIN_KEY = "jak2831" # المفتاح السري للإدارة
 IMAGE_PATH = "logo.png" # اسم ملف الشعار الثابت
-
-# 🚨 إعدادات Google Sheets (يجب أن تتطابق مع ملفك ومفتاحك)
-SPREADSHEET_NAME = "1TDc87MdWy-xWLjCFAnBgqVP8InJqOiovv25ap-jRP0I" 
-CONN_NAME = "gcp_service_account" # اسم الاتصال في secrets.toml
 # -----------------------------
 
 # 🆕 دالة مساعدة لتشغيل صوت تنبيه
@@ -36,64 +47,31 @@ def play_sound(sound_file):
     except Exception:
         pass
 
-# --- دوال التعامل مع Google Sheets ---
+# --- دوال الواجهة ---
 
-# 🆕 دالة للحصول على الاتصال (يتم تخزينها مؤقتاً لتسريع الأداء)
-@st.cache_resource(ttl=3600) 
-def get_connection():
-    # التأكد من أن المفتاح السري موجود قبل المحاولة
-    if CONN_NAME not in st.secrets:
-        st.error(f"خطأ: مفتاح الاتصال '{CONN_NAME}' غير موجود في ملف secrets.toml.")
-        st.stop()
-    return st.connection(CONN_NAME, type=GSheetsConnection)
-
-# 🆕 دالة قراءة ورقة معينة
-@st.cache_data(ttl=5) # تحديث البيانات من Sheet كل 5 ثواني
-def get_sheet_data(sheet_name):
-    conn = get_connection()
-    df = conn.read(spreadsheet=SPREADSHEET_NAME, worksheet=sheet_name)
-    # تنظيف البيانات وتجهيزها
-    if df.empty:
-        # إذا كانت الورقة فارغة، أعد DataFrame فارغاً بالأعمدة الصحيحة
-        if sheet_name == "drivers":
-            return pd.DataFrame(columns=['driver_id', 'name', 'bike_plate', 'whatsapp', 'notes', 'is_active', 'balance'])
-        elif sheet_name == "transactions":
-            return pd.DataFrame(columns=['driver_name', 'amount', 'type', 'timestamp'])
-
-    # تحويل الأنواع الأساسية
-    if 'driver_id' in df.columns:
-        df['driver_id'] = df['driver_id'].astype(str)
-    if 'is_active' in df.columns:
-        df['is_active'] = df['is_active'].astype(bool)
-    if 'balance' in df.columns:
-        # محاولة تحويل الرصيد إلى رقم، واستبدال الأخطاء بصفر
-        df['balance'] = pd.to_numeric(df['balance'], errors='coerce').fillna(0.0) 
-    if 'amount' in df.columns:
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
-        
-    return df
-
-# 🚨 تم استبدال init_db بالتحقق من الاتصال
+# 🚨 تم استبدال init_db بالتحقق من الاتصال وتحميل المخزن المحلي
 def init_db():
     try:
-        get_sheet_data("drivers")
+        get_store()
+        get_mirror()
+        get_writer()
+        get_refresher()
     except Exception as e:
         st.error(f"خطأ في الاتصال بـ Google Sheets: الرجاء التأكد من اسم الملف '{SPREADSHEET_NAME}' ووجود ورقتي 'drivers' و 'transactions'.")
         st.error(f"تفاصيل الخطأ: {e}")
         st.stop()
 
-# 🆕 دالة لإضافة مندوب جديد (تكتب في Sheet)
+# 🆕 دالة لإضافة مندوب جديد (تكتب في المخزن المحلي ثم في Sheet)
+@metrics.timed("operation_seconds", operation="add_driver")
 def add_driver(driver_id, name, bike_plate, whatsapp, notes, is_active):
-    drivers_df = get_sheet_data("drivers")
-    
-    # 2. التحقق من التكرار
-    if driver_id in drivers_df['driver_id'].values:
+    # 1. التحقق من التكرار عبر الفهرس
+    if driver_id in get_driver_index():
         st.error("رقم الترقيم (ID) هذا موجود مسبقاً. 🚨")
         play_sound("error.mp3") 
         return
         
-    # 3. إنشاء الصف الجديد
-    new_driver = pd.DataFrame([{
+    # 2. إنشاء الصف الجديد
+    new_driver = {
         "driver_id": driver_id, 
         "name": name, 
         "bike_plate": bike_plate, 
@@ -101,187 +79,318 @@ def add_driver(driver_id, name, bike_plate, whatsapp, notes, is_active):
         "notes": notes, 
         "is_active": is_active, 
         "balance": 0.0
-    }])
+    }
     
-    # 4. دمج وحفظ البيانات الجديدة
-    updated_df = pd.concat([drivers_df, new_driver], ignore_index=True)
-    conn = get_connection()
-    conn.write(spreadsheet=SPREADSHEET_NAME, worksheet="drivers", data=updated_df)
+    # 3. الحفظ (الترقيم فريد أيضاً في المخزن المحلي تحسباً لإضافتين متزامنتين)
+    try:
+        get_store().insert_driver(new_driver)
+    except sqlite3.IntegrityError:
+        st.error("رقم الترقيم (ID) هذا موجود مسبقاً. 🚨")
+        play_sound("error.mp3") 
+        return
+    get_mirror().append("drivers", [new_driver])
     
-    st.cache_data.clear() # مسح ذاكرة التخزين المؤقت للبيانات
     st.success(f"تمت إضافة المندوب '{name}' بنجاح! 🔔")
     play_sound("success.mp3") 
 
-# 🆕 دالة البحث (تقرأ من Sheet)
-def search_driver(search_term):
-    drivers_df = get_sheet_data("drivers")
-    # البحث باستخدام driver_id أو whatsapp
-    result = drivers_df[
-        (drivers_df['driver_id'] == search_term) | 
-        (drivers_df['whatsapp'] == search_term)
-    ]
-    if not result.empty:
-        # إرجاع أول نتيجة مطابقة كقاموس
-        row = result.iloc[0]
-        return {"driver_id": row['driver_id'], "name": row['name'], "balance": float(row['balance']), "is_active": bool(row['is_active'])}
-    return None
-
-# 🆕 دالة جلب معلومات المندوب (تقرأ من Sheet)
-def get_driver_info(driver_id):
-    drivers_df = get_sheet_data("drivers")
-    result = drivers_df[drivers_df['driver_id'] == driver_id]
-    if not result.empty:
-        row = result.iloc[0]
-        return {"name": row['name'], "balance": float(row['balance']), "is_active": bool(row['is_active'])} 
-    return None
-
-# 🆕 دالة تحديث التفاصيل (تكتب في Sheet)
+# 🆕 دالة تحديث التفاصيل (تكتب في المخزن المحلي ثم في Sheet)
 def update_driver_details(driver_id, name, bike_plate, whatsapp, notes, is_active):
-    conn = get_connection()
-    drivers_df = get_sheet_data("drivers")
-    
-    # تحديد الصف المراد تعديله
-    idx = drivers_df[drivers_df['driver_id'] == driver_id].index
+    updated = get_store().update_driver(driver_id, {
+        "name": name,
+        "bike_plate": bike_plate,
+        "whatsapp": whatsapp,
+        "notes": notes,
+        "is_active": is_active,
+    })
     
-    if not idx.empty:
-        # تطبيق التعديلات
-        drivers_df.loc[idx, 'name'] = name
-        drivers_df.loc[idx, 'bike_plate'] = bike_plate
-        drivers_df.loc[idx, 'whatsapp'] = whatsapp
-        drivers_df.loc[idx, 'notes'] = notes
-        drivers_df.loc[idx, 'is_active'] = is_active
-        
-        # إعادة كتابة الجدول بالكامل
-        conn.write(spreadsheet=SPREADSHEET_NAME, worksheet="drivers", data=drivers_df)
-        st.cache_data.clear()
+    if updated:
+        get_mirror().update_driver(driver_id, ["name", "bike_plate", "whatsapp", "notes", "is_active"])
         st.success(f"تم تحديث بيانات المندوب {name} بنجاح.")
 
-# 🆕 دالة تحديث الرصيد (تكتب في Sheet)
-def update_balance(driver_id, amount, trans_type):
-    conn = get_connection()
-    
-    # 1. تحديث جدول drivers (تعديل الرصيد)
-    drivers_df = get_sheet_data("drivers")
-    
-    # التأكد من وجود المندوب
-    idx = drivers_df[drivers_df['driver_id'] == driver_id].index
-    if idx.empty: return 0.0
-
-    driver_row = drivers_df[drivers_df['driver_id'] == driver_id].iloc[0]
-    
-    # حساب الرصيد الجديد
-    current_balance = float(driver_row['balance'])
-    name = driver_row['name']
-    new_balance = current_balance + amount
-    
-    # تعديل القيمة في DataFrame
-    drivers_df.loc[idx, 'balance'] = new_balance
-    
-    # إعادة كتابة جدول drivers بالكامل
-    conn.write(spreadsheet=SPREADSHEET_NAME, worksheet="drivers", data=drivers_df)
+# 🆕 أسماء أعمدة المندوبين في جداول الاستيراد والتعديل الجماعي
+DRIVER_COLUMN_LABELS = {
+    'line': 'السطر',
+    'driver_id': 'الترقيم',
+    'name': 'الاسم',
+    'bike_plate': 'رقم اللوحة',
+    'whatsapp': 'واتساب',
+    'notes': 'ملاحظات',
+    'is_active': 'مفعل',
+    'reason': 'السبب',
+}
+
+# 🆕 دالة استيراد مندوبين من ملف CSV أو Excel (تحقق واحد لكل الصفوف، ثم إضافة واحدة)
+def show_driver_import():
+    formats = import_formats()
+    # المفتاح يتغير بعد كل استيراد ناجح حتى يُفرغ حقل الملف
+    upload_key = f"driver_import_{st.session_state.setdefault('driver_import_round', 0)}"
+    uploaded = st.file_uploader("ملف المندوبين", type=formats, key=upload_key)
+    columns = "، ".join(f"`{names[0]}` أو `{next(n for n in names if not n.isascii())}`" for names in DRIVER_FIELD_ALIASES.values())
+    st.caption(f"الأعمدة المقبولة: {columns}. الترقيم والاسم مطلوبان، والرصيد يبدأ من صفر.")
+    if "xlsx" not in formats:
+        st.caption("لاستيراد ملفات Excel يجب تثبيت مكتبة openpyxl، أو احفظ الملف بصيغة CSV.")
+    if uploaded is None:
+        return
     
-    # 2. تحديث جدول transactions (تسجيل الحركة)
-    transactions_df = get_sheet_data("transactions")
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    new_transaction = pd.DataFrame([{
-        "driver_name": f"{name} (ID:{driver_id})", 
-        "amount": amount, 
-        "type": trans_type, 
-        "timestamp": timestamp
-    }])
+    try:
+        accepted, rejected = check_driver_import(uploaded.name, uploaded.getvalue())
+    except Exception as e:
+        st.error(f"تعذرت قراءة الملف: {e}")
+        return
     
-    # دمج وكتابة سجل الحركات
-    updated_transactions = pd.concat([transactions_df, new_transaction], ignore_index=True)
-    conn.write(spreadsheet=SPREADSHEET_NAME, worksheet="transactions", data=updated_transactions)
+    st.info(f"صفوف صالحة: {len(accepted)} | صفوف مرفوضة: {len(rejected)}")
+    skip_rejected = False
+    if not rejected.empty:
+        st.dataframe(rejected.rename(columns=DRIVER_COLUMN_LABELS), use_container_width=True, hide_index=True)
+        skip_rejected = st.checkbox("استيراد الصفوف الصالحة فقط وتجاهل المرفوضة", key=f"{upload_key}_skip")
+    
+    can_import = not accepted.empty and (rejected.empty or skip_rejected)
+    if st.button(f"استيراد {len(accepted)} مندوب", key=f"{upload_key}_btn", type="primary", disabled=not can_import):
+        if import_drivers(accepted):
+            st.session_state['driver_import_round'] += 1
+            st.session_state['driver_import_feedback'] = f"تم استيراد {len(accepted)} مندوب بنجاح! 🔔"
+            st.rerun()
+        else:
+            st.error("أُضيف أحد الترقيمات أثناء الاستيراد، ولم يُضف أي مندوب. أعد المحاولة.")
+            play_sound("error.mp3")
+
+# 🆕 دالة التعديل الجماعي: جدول قابل للتعديل مع تفعيل/تعطيل كل المندوبين المعروضين (كتابة واحدة عند الحفظ)
+def show_bulk_edit():
+    drivers = get_sheet_data("drivers")
+    view = drivers[['driver_id'] + EDITABLE_DRIVER_COLUMNS].astype({'is_active': 'boolean'}).fillna({'is_active': False})
+    filter_term = st.text_input("تصفية بالترقيم أو الاسم أو اللوحة أو الواتساب", key="bulk_edit_filter").strip()
+    if filter_term:
+        matches = pd.Series(False, index=view.index)
+        for col in ['driver_id', 'name', 'bike_plate', 'whatsapp']:
+            matches |= view[col].str.contains(filter_term, case=False, regex=False).fillna(False)
+        view = view[matches]
+    view = view.reset_index(drop=True)
+    st.caption(f"المندوبون المعروضون: {len(view)}")
+    
+    # المفتاح يتغير بعد كل حفظ حتى يبدأ الجدول من البيانات المحفوظة
+    edit_round = st.session_state.setdefault('bulk_edit_round', 0)
+    edited = st.data_editor(
+        view, key=f"bulk_editor_{edit_round}", disabled=['driver_id'], hide_index=True, use_container_width=True,
+        column_config={col: label for col, label in DRIVER_COLUMN_LABELS.items() if col in view.columns},
+    )
+    
+    col_on, col_off, col_save = st.columns(3)
+    updates = None
+    with col_on:
+        if st.button("تفعيل كل المعروضين", key="bulk_activate", disabled=view.empty):
+            updates = {d: {'is_active': True} for d in view.loc[~view['is_active'], 'driver_id']}
+    with col_off:
+        if st.button("تعطيل كل المعروضين", key="bulk_deactivate", disabled=view.empty):
+            updates = {d: {'is_active': False} for d in view.loc[view['is_active'], 'driver_id']}
+    with col_save:
+        if st.button("حفظ التعديلات", key="bulk_save", type="primary", disabled=view.empty):
+            updates, rejected = diff_driver_edits(view, edited)
+            if not rejected.empty:
+                st.error(f"لا يمكن حفظ {len(rejected)} صف، ولم يُحفظ أي تعديل:")
+                st.dataframe(rejected.rename(columns=DRIVER_COLUMN_LABELS), use_container_width=True, hide_index=True)
+                play_sound("error.mp3")
+                return
+    if updates is None:
+        return
+    if not updates:
+        st.info("لا توجد تعديلات للحفظ.")
+        return
     
-    st.cache_data.clear() # مسح ذاكرة التخزين المؤقت بعد التحديث
-    return new_balance
+    updated = update_drivers_bulk(updates)
+    st.session_state['bulk_edit_round'] += 1
+    st.session_state['driver_import_feedback'] = f"تم تحديث بيانات {len(updated)} مندوب بنجاح. 🔔"
+    st.rerun()
+
+# 🆕 دالة عرض السجل صفحة صفحة مع تصفية اختيارية حسب الفترة (تعيد عدد الحركات المطابقة والفترة)
+def show_history_pages(key, driver_id=None):
+    col_from, col_to, col_size = st.columns(3)
+    with col_from:
+        start = st.date_input("من تاريخ", value=None, key=f"{key}_from")
+    with col_to:
+        end = st.date_input("إلى تاريخ", value=None, key=f"{key}_to")
+    with col_size:
+        page_size = st.selectbox("عدد الحركات في الصفحة", [25, 50, 100, 200], index=1, key=f"{key}_size")
+    
+    page = st.session_state.get(f"{key}_page", 1)
+    df, total = get_history_page(driver_id, start, end, page, page_size)
+    pages = max(1, math.ceil(total / page_size))
+    if page > pages:
+        # تغيرت التصفية فأصبحت الصفحة المطلوبة خارج النطاق
+        page = pages
+        st.session_state[f"{key}_page"] = page
+        df, total = get_history_page(driver_id, start, end, page, page_size)
+    
+    if total:
+        st.dataframe(df, use_container_width=True, hide_index=True)
+    st.number_input("الصفحة", min_value=1, step=1, key=f"{key}_page")
+    st.caption(f"الصفحة {page} من {pages} — {total} حركة")
+    return total, start, end
+
+# 🆕 زر تصدير السجل: الملف لا يُولّد إلا عند الضغط، ويُكتب على دفعات (بنفس تصفية الفترة المعروضة)
+def show_export_button(key, file_prefix, driver_id=None, start=None, end=None):
+    col_format, col_download = st.columns([1, 2])
+    with col_format:
+        fmt = st.selectbox("صيغة الملف", available_formats(), format_func=lambda f: EXPORT_FORMATS[f][0], key=f"{key}_format")
+    label, mime, extension = EXPORT_FORMATS[fmt]
+    store = get_store()
+    with col_download:
+        st.download_button(
+            label=f"تحميل السجل كملف {label}",
+            data=lambda: export_transactions(store, fmt, driver_id, start, end, EXPORT_COLUMNS),
+            file_name=f"{file_prefix}_{datetime.now().strftime('%Y%m%d')}.{extension}",
+            mime=mime,
+            key=f"{key}_download",
+        )
+
+# 🆕 رسالة نتيجة محفوظة في الجلسة (تضعها دوال on_click وتُعرض مرة واحدة في الجزء الذي يخصها)
+def show_feedback(key):
+    feedback = st.session_state.pop(key, None)
+    if feedback:
+        kind, text, sound = feedback
+        (st.success if kind == "success" else st.error)(text)
+        if sound:
+            play_sound(sound)
+
+# 🆕 بيانات المندوب المحدد في واجهة العمليات: تُجلب مرة في كل تشغيل كامل للصفحة أو عند البحث،
+# ثم تُحدّث من نتيجة كل عملية دون إعادة جلبها
+def load_selected_driver():
+    selected_id = st.session_state['search_result_id']
+    info = get_driver_info(selected_id) if selected_id else None
+    st.session_state['selected_driver'] = dict(info, driver_id=selected_id) if info else None
+
+# 🆕 نتائج البحث المقترحة (بالاسم أو اللوحة أو بداية الترقيم أو آخر أرقام الواتساب) لاختيار مندوب منها.
+# الاختيار يُحفظ في f"{key}_suggestion" وتُستدعى on_pick(key) عند الضغط على زر التحديد
+def suggestion_label(driver):
+    details = [driver['driver_id']]
+    if pd.notna(driver['bike_plate']) and driver['bike_plate']:
+        details.append(f"لوحة {driver['bike_plate']}")
+    if pd.notna(driver['whatsapp']) and driver['whatsapp']:
+        details.append(f"واتساب {driver['whatsapp']}")
+    return f"{driver['name']} ({' | '.join(details)})"
+
+def show_driver_suggestions(key, search_term, on_pick):
+    if not search_term or not search_term.strip():
+        return
+    suggestions = suggest_drivers(search_term)
+    if not suggestions:
+        st.caption("لا توجد نتائج مطابقة.")
+        return
+    labels = {d['driver_id']: suggestion_label(d) for d in suggestions}
+    if list(labels) == [st.session_state['search_result_id']]:
+        return
+    col_pick, col_pick_button = st.columns([3, 1])
+    with col_pick:
+        st.selectbox("نتائج مطابقة", list(labels), format_func=labels.get, key=f"{key}_suggestion")
+    with col_pick_button:
+        st.button("تحديد المقترح", key=f"{key}_pick", on_click=on_pick, args=(key,))
+
+def pick_suggested_driver(key):
+    st.session_state['search_result_id'] = st.session_state[f"{key}_suggestion"]
+
+def select_operations_driver():
+    set_operations_driver(search_driver(st.session_state['search_op_input']))
+
+def pick_operations_driver(key):
+    driver_id = st.session_state[f"{key}_suggestion"]
+    info = get_driver_info(driver_id)
+    set_operations_driver(dict(info, driver_id=driver_id) if info else None)
+
+def set_operations_driver(driver_data):
+    if driver_data:
+        st.session_state['search_result_id'] = driver_data['driver_id']
+        st.session_state['search_op_feedback'] = ("success", f"تم تحديد المندوب: {driver_data['name']}", None)
+    else:
+        st.session_state['search_result_id'] = None
+        st.session_state['search_op_feedback'] = ("error", "لم يتم العثور على مندوب واحد مطابق للبحث، اختر من النتائج المطابقة إن وجدت.", None)
+    st.session_state['selected_driver'] = driver_data
+
+# op_key يُولّد مع كل رسم للزر: ضغطتان على نفس الزر المعروض عملية واحدة
+def record_selected_delivery(op_key):
+    driver = st.session_state['selected_driver']
+    # الكاتب يرفض الخصم إذا لم يكفِ الرصيد الفعلي (لا الرصيد المعروض)
+    result, new_bal = update_balance(driver['driver_id'], -DEDUCTION_AMOUNT, "خصم توصيلة", op_key=op_key)
+    if result == "applied":
+        driver['balance'] = new_bal
+        st.session_state['operation_feedback'] = ("success", f"تم تسجيل التوصيلة! الرصيد المتبقي: {new_bal:.2f} أوقية 🔔", "success.mp3")
+    elif result == "rejected":
+        driver['balance'] = new_bal
+        st.session_state['operation_feedback'] = ("error", "عفواً، الرصيد غير كافي لإجراء التوصيلة. يرجى الشحن أولاً. 🚨", "error.mp3")
+    elif result == "inactive":
+        # عُطل الحساب من جلسة أخرى بعد تحديده هنا
+        driver['is_active'] = False
+        st.session_state['operation_feedback'] = ("error", "عفواً، حساب هذا المندوب معطل ولا يمكن تسجيل توصيلات له. 🚨", "error.mp3")
+    else:
+        st.session_state['operation_feedback'] = (
+            "error", f"لم يعد المندوب {driver['driver_id']} موجوداً في السجل، ابحث عنه من جديد.", "error.mp3")
+
+def charge_selected_driver(op_key):
+    driver = st.session_state['selected_driver']
+    result, new_bal = update_balance(driver['driver_id'], st.session_state['charge_amount'], "شحن رصيد", op_key=op_key)
+    if result == "applied":
+        driver['balance'] = new_bal
+        st.session_state['operation_feedback'] = ("success", f"تم الشحن بنجاح! الرصيد الجديد: {new_bal:.2f} أوقية 🔔", "success.mp3")
+    else:
+        st.session_state['operation_feedback'] = (
+            "error", f"لم يعد المندوب {driver['driver_id']} موجوداً في السجل، ابحث عنه من جديد.", "error.mp3")
+
+# 🆕 مفتاح منع تكرار دفعة التوصيلات: يتغير مع كل تعديل للقائمة أو الملف
+def new_batch_key():
+    st.session_state['batch_key'] = uuid.uuid4().hex
+
+# 🆕 أجزاء واجهة العمليات (st.fragment): ضغطة زر داخل الجزء تعيد تشغيله وحده لا الصفحة كلها
+# (البحث يعيد رسم جزء البحث وبطاقة المندوب، والتوصيلة أو الشحن يعيدان رسم بطاقة المندوب فقط)
+@st.fragment
+@metrics.timed("fragment_rerun_seconds", fragment="driver_search")
+def driver_search_panel():
+    st.subheader("1. تحديد المندوب")
+    col_search, col_button = st.columns([3, 1])
+    with col_search:
+        st.text_input("ابحث بالترقيم (ID) أو رقم الواتساب أو الاسم أو اللوحة", key="search_op_input")
+    with col_button:
+        st.button("بحث وتحديد", key="search_op_btn", type="primary", on_click=select_operations_driver)
+    show_feedback('search_op_feedback')
+    show_driver_suggestions("search_op", st.session_state['search_op_input'], pick_operations_driver)
+    selected_driver_panel()
+
+@st.fragment
+@metrics.timed("fragment_rerun_seconds", fragment="selected_driver")
+def selected_driver_panel():
+    info = st.session_state.get('selected_driver')
+    if not info:
+        if st.session_state['search_result_id']:
+            st.error("حدث خطأ في جلب بيانات المندوب المحدد.")
+        else:
+            st.info("يرجى البحث عن المندوب بترقيمه أو رقم الواتساب أو اسمه أو لوحته لتسجيل عملية.")
+        return
 
-# 🆕 دالة جلب عدد التوصيلات (تقرأ من Sheet)
-def get_deliveries_count_per_driver():
-    transactions_df = get_sheet_data("transactions")
-    if transactions_df.empty: return pd.DataFrame(columns=['driver_id', 'عدد التوصيلات'])
+    st.subheader(f"2. تفاصيل ورصيد المندوب: {info['name']}")
+    balance = info['balance']
+    is_active = info['is_active']
 
-    # استخلاص الـ driver_id من driver_name
-    transactions_df['driver_id'] = transactions_df['driver_name'].str.extract(r'ID:(\w+)\)')
-    
-    deliveries_count = transactions_df[transactions_df['type'] == 'خصم توصيلة'] \
-        .groupby('driver_id') \
-        .size() \
-        .reset_index(name='عدد التوصيلات')
-        
-    return deliveries_count
+    status_text = "🟢 مفعل" if is_active else "🔴 معطل"
+    status_color = "green" if is_active else "red"
 
-# 🆕 دالة جلب الإجماليات (تقرأ من Sheet)
-def get_totals():
-    drivers_df = get_sheet_data("drivers")
-    transactions_df = get_sheet_data("transactions")
-    
-    total_balance = drivers_df['balance'].sum()
-    
-    total_charged = transactions_df[transactions_df['type'] == 'شحن رصيد']['amount'].sum()
-    
-    total_deducted_negative = transactions_df[transactions_df['type'] == 'خصم توصيلة']['amount'].sum()
-    total_deducted = abs(total_deducted_negative)
-    total_deliveries = transactions_df[transactions_df['type'] == 'خصم توصيلة'].shape[0]
-    
-    return total_balance, total_charged, total_deducted, total_deliveries
-
-# 🆕 دالة جلب السجل (تقرأ من Sheet)
-def get_history(driver_id=None):
-    transactions_df = get_sheet_data("transactions")
-    if transactions_df.empty:
-         return pd.DataFrame(columns=['المندوب', 'العملية', 'المبلغ', 'التوقيت'])
-         
-    # تنظيف الأعمدة
-    df_history = transactions_df.rename(columns={
-        'driver_name': 'المندوب', 
-        'amount': 'المبلغ', 
-        'type': 'العملية', 
-        'timestamp': 'التوقيت'
-    })
-    
-    if driver_id:
-        # تصفية حسب ID
-        df_history = df_history[df_history['المندوب'].str.contains(f'ID:{driver_id}')]
-        # إزالة عمود المندوب في حالة التصفية
-        df_history = df_history.drop(columns=['المندوب'])
-        
-    return df_history.sort_values(by='التوقيت', ascending=False)
+    st.markdown(f"**الرصيد الحالي:** **<span style='color:green; font-size: 1.5em;'>{balance:.2f} أوقية</span>** | **الحالة:** <span style='color:{status_color}; font-size: 1.2em;'>{status_text}</span>", unsafe_allow_html=True)
+    show_feedback('operation_feedback')
+    st.divider()
 
-# 🆕 دالة جلب تفاصيل الكل (تقرأ من Sheet)
-def get_all_drivers_details():
-    df = get_sheet_data("drivers")
-    if df.empty: return pd.DataFrame()
-    
-    deliveries_count_df = get_deliveries_count_per_driver()
-    
-    if not deliveries_count_df.empty:
-        df = pd.merge(df, deliveries_count_df, on='driver_id', how='left').fillna({'عدد التوصيلات': 0})
-        df['عدد التوصيلات'] = df['عدد التوصيلات'].astype(int)
-    else:
-        df['عدد التوصيلات'] = 0
-        
-    df['الحالة'] = df['is_active'].apply(lambda x: 'مفعل' if x == True else 'معطل')
-    
-    df.rename(columns={
-        'driver_id': 'الترقيم',
-        'name': 'الاسم',
-        'bike_plate': 'رقم اللوحة',
-        'whatsapp': 'واتساب',
-        'balance': 'الرصيد',
-        'notes': 'ملاحظات'
-    }, inplace=True)
-    
-    df.insert(0, 'ت', range(1, 1 + len(df)))
-    
-    cols = ['ت', 'الترقيم', 'الاسم', 'رقم اللوحة', 'واتساب', 'الرصيد', 'عدد التوصيلات', 'الحالة', 'ملاحظات']
-    return df[cols]
+    if not is_active:
+         st.warning("تنبيه: هذا المندوب **معطل** ولا يمكنه إجراء عمليات توصيل حتى يتم تفعيله من قائمة الإدارة.")
+
+    tab1, tab2 = st.tabs(["✅ إتمام توصيلة", "💰 شحن رصيد"])
+
+    with tab1:
+        st.markdown(f"سيتم خصم **{DEDUCTION_AMOUNT} أوقية** من الرصيد.")
+        st.button("تسجيل توصيلة ناجحة", key="deduct_button", type="primary", disabled=not is_active, on_click=record_selected_delivery, args=(uuid.uuid4().hex,))
+
+    with tab2:
+        st.number_input("المبلغ المراد شحنه (أوقية)", min_value=-99999.0, step=10.0, key="charge_amount")
+        st.button("تأكيد الشحن", key="charge_button", on_click=charge_selected_driver, args=(uuid.uuid4().hex,))
 
 # ----------------------------------------------------------------------------------
 # 🌐 واجهة التطبيق (لا يوجد تغيير كبير هنا، فقط استخدام الدوال الجديدة)
 # ----------------------------------------------------------------------------------
+rerun_started = time.perf_counter() # 🆕 لقياس زمن إعادة تشغيل الصفحة
 st.set_page_config(page_title="نظام إدارة التوصيل", layout="wide", page_icon="🚚")
 st.title("🚚 نظام رصيد المندوبين (Google Sheets)")
 
@@ -305,10 +414,21 @@ if os.path.exists(IMAGE_PATH):
 
 st.sidebar.header("لوحة التحكم")
 
+# 🆕 تنبيه عند فشل التحديث الدوري (البيانات المعروضة من آخر نسخة ناجحة)
+refresh_status = get_refresher().status
+if refresh_status['last_error']:
+    last_good = datetime.fromtimestamp(refresh_status['last_success']).strftime("%H:%M:%S") if refresh_status['last_success'] else "التحميل الأول"
+    st.sidebar.warning(f"تعذر تحديث البيانات من Google Sheets؛ المعروض من آخر نسخة ناجحة ({last_good}).")
+
+# 🆕 تنبيه المسؤول بالترقيم المكرر في ورقة drivers (يُعتمد أول صف لكل ترقيم)
+duplicate_ids = get_store().duplicate_driver_ids
+if st.session_state['admin_mode'] and duplicate_ids:
+    st.sidebar.warning(f"ترقيم مكرر في ورقة المندوبين (اعتُمد أول صف لكل منها): {'، '.join(duplicate_ids)}")
+
 if st.session_state['admin_mode']:
     # وضع المسؤول (Admin)
     st.sidebar.markdown("**وضع المسؤول (ADMIN)**")
-    menu_options = ["واجهة العمليات (الإدارة)", "إدارة المندوبين (إضافة/تعديل)", "التقارير وسجل العمليات", "إعدادات التطبيق (الشعار)", "الخروج من وضع المسؤول"]
+    menu_options = ["واجهة العمليات (الإدارة)", "إدارة المندوبين (إضافة/تعديل)", "التقارير وسجل العمليات", "إعدادات التطبيق (الشعار)", "التشخيص والأداء", "الخروج من وضع المسؤول"]
     current_menu = st.sidebar.radio("القائمة", menu_options)
     if current_menu == "الخروج من وضع المسؤول":
         st.session_state['admin_mode'] = False
@@ -318,7 +438,8 @@ if st.session_state['admin_mode']:
 elif st.session_state['logged_in_driver_id']:
     # وضع المندوب (Driver)
     driver_id = st.session_state['logged_in_driver_id']
-    driver_info = get_driver_info(driver_id)
+    # 🆕 لوحة المندوب تُجلب مرة واحدة وتُستخدم في الشريط الجانبي والصفحة
+    driver_info = get_driver_dashboard(driver_id)
     if driver_info:
         st.sidebar.markdown(f"**مرحباً، {driver_info['name']}**")
         st.sidebar.button("خروج (Logout)", on_click=lambda: st.session_state.update(logged_in_driver_id=None, admin_mode=False, search_result_id=None))
@@ -348,7 +469,7 @@ else:
 if current_menu == "واجهة المندوب":
     if st.session_state['logged_in_driver_id']:
         driver_id = st.session_state['logged_in_driver_id']
-        driver_data = get_driver_info(driver_id)
+        driver_data = driver_info  # من الشريط الجانبي في نفس التشغيل
         
         if driver_data:
             st.header(f"أهلاً بك يا {driver_data['name']}!")
@@ -360,14 +481,18 @@ if current_menu == "واجهة المندوب":
             
             if is_active:
                 st.markdown("### رصيدك الحالي")
-                st.metric(label="الرصيد المتوفر", value=f"{driver_data['balance']:.2f} أوقية", delta_color="off")
+                col_balance, col_deliveries = st.columns(2)
+                col_balance.metric(label="الرصيد المتوفر", value=f"{driver_data['balance']:.2f} أوقية", delta_color="off")
+                col_deliveries.metric(label="عدد التوصيلات", value=driver_data['deliveries'])
                 st.divider()
                 st.markdown("### سجل حركاتك الأخيرة")
-                history_df = get_history(driver_id)
-                if not history_df.empty:
-                    st.dataframe(history_df, use_container_width=True)
-                else:
+                if driver_data['recent'].empty:
                     st.info("لا توجد حركات مسجلة لك بعد.")
+                else:
+                    st.dataframe(driver_data['recent'], use_container_width=True, hide_index=True)
+                    # 🆕 السجل الكامل (بالصفحات والفترة) عند الطلب فقط: المحتوى داخل expander يُنفذ مع كل تشغيل
+                    if st.toggle("عرض السجل الكامل", key="my_history_full"):
+                        show_history_pages("my_history", driver_id)
             else:
                 st.error("عفواً، حسابك معطل. لا يمكنك إجراء أي عمليات. يرجى مراجعة الإدارة.")
                 
@@ -385,7 +510,7 @@ if current_menu == "واجهة المندوب":
                 st.error("الرجاء إدخال ترقيمك.")
                 return
             
-            info = get_driver_info(driver_id_input)
+            info = get_driver_dashboard(driver_id_input)
             if info:
                 st.session_state['logged_in_driver_id'] = driver_id_input
                 st.success(f"تم تسجيل الدخول بنجاح! مرحباً بك يا {info['name']}.")
@@ -401,75 +526,53 @@ if current_menu == "واجهة المندوب":
 elif current_menu == "واجهة العمليات (الإدارة)":
     st.header("تسجيل العمليات (شحن/خصم)")
     
-    st.subheader("1. تحديد المندوب")
-    
-    # --- منطق البحث ---
-    col_search, col_button = st.columns([3, 1])
-    with col_search:
-        search_term_op = st.text_input("ابحث بترقيم المندوب (ID) أو رقم الواتساب", key="search_op_input")
-    with col_button:
-        if st.button("بحث وتحديد", key="search_op_btn", type="primary"):
-            driver_data = search_driver(search_term_op)
-            if driver_data:
-                st.session_state['search_result_id'] = driver_data['driver_id']
-                st.success(f"تم تحديد المندوب: {driver_data['name']}")
+    # 🆕 البحث وبطاقة المندوب أجزاء تُعاد وحدها؛ التشغيل الكامل للصفحة يجلب بيانات المندوب المحدد من جديد
+    load_selected_driver()
+    driver_search_panel()
+
+    # --- تسجيل دفعة توصيلات (نهاية الوردية) ---
+    st.divider()
+    with st.expander("📋 تسجيل دفعة توصيلات (نهاية الوردية)"):
+        st.markdown(f"أدخل ترقيماً واحداً في كل سطر، مع عدد التوصيلات اختيارياً (مثال: `J0002,3`). يُخصم **{DEDUCTION_AMOUNT} أوقية** لكل توصيلة.")
+        batch_text = st.text_area("قائمة الترقيمات", key="batch_text", height=200, on_change=new_batch_key)
+        batch_file = st.file_uploader("أو ارفع ملف CSV (الترقيم، العدد)", type=["csv", "txt"], key="batch_file", on_change=new_batch_key)
+        if st.button("التحقق وتسجيل الدفعة", key="batch_button", type="primary"):
+            if batch_file is not None:
+                batch_text = batch_file.getvalue().decode("utf-8-sig")
+            if batch_text and batch_text.strip():
+                # نفس الدفعة دون تعديل = نفس المفتاح: الضغط مرة أخرى لا يخصم مرتين
+                if 'batch_key' not in st.session_state:
+                    new_batch_key()
+                op_key = f"batch:{st.session_state['batch_key']}:{hashlib.sha1(batch_text.encode('utf-8')).hexdigest()}"
+                accepted, rejected = record_delivery_batch(batch_text, op_key=op_key)
+                if not accepted.empty:
+                    st.success(f"تم تسجيل {int(accepted['count'].sum())} توصيلة لـ {len(accepted)} مندوب (إجمالي الخصم: {abs(accepted['amount'].sum()):.2f} أوقية) 🔔")
+                    play_sound("success.mp3")
+                    st.dataframe(accepted.rename(columns={
+                        'driver_id': 'الترقيم',
+                        'name': 'الاسم',
+                        'count': 'عدد التوصيلات',
+                        'amount': 'المبلغ',
+                        'balance_after': 'الرصيد المتبقي'
+                    }), use_container_width=True)
+                if not rejected.empty:
+                    st.error(f"تم رفض {len(rejected)} سطر:")
+                    play_sound("error.mp3")
+                    st.dataframe(rejected.rename(columns={
+                        'line': 'السطر',
+                        'driver_id': 'الترقيم',
+                        'count': 'العدد',
+                        'reason': 'السبب'
+                    }), use_container_width=True)
             else:
-                st.error("لم يتم العثور على المندوب بالترقيم أو رقم الواتساب المدخل.")
-                st.session_state['search_result_id'] = None
-    # -------------------
-    
-    selected_id = st.session_state['search_result_id']
-    
-    if selected_id:
-        info = get_driver_info(selected_id)
-        if info:
-            st.subheader(f"2. تفاصيل ورصيد المندوب: {info['name']}")
-            balance = info['balance']
-            is_active = info['is_active']
-            
-            status_text = "🟢 مفعل" if is_active else "🔴 معطل"
-            status_color = "green" if is_active else "red"
-            
-            st.markdown(f"**الرصيد الحالي:** **<span style='color:green; font-size: 1.5em;'>{balance:.2f} أوقية</span>** | **الحالة:** <span style='color:{status_color}; font-size: 1.2em;'>{status_text}</span>", unsafe_allow_html=True)
-            st.divider()
-            
-            if not is_active:
-                 st.warning("تنبيه: هذا المندوب **معطل** ولا يمكنه إجراء عمليات توصيل حتى يتم تفعيله من قائمة الإدارة.")
-
-            tab1, tab2 = st.tabs(["✅ إتمام توصيلة", "💰 شحن رصيد"])
-            
-            with tab1:
-                st.markdown(f"سيتم خصم **{DEDUCTION_AMOUNT} أوقية** من الرصيد.")
-                if st.button("تسجيل توصيلة ناجحة", key="deduct_button", type="primary", disabled=not is_active):
-                    if balance >= DEDUCTION_AMOUNT:
-                        new_bal = update_balance(selected_id, -DEDUCTION_AMOUNT, "خصم توصيلة")
-                        st.success(f"تم تسجيل التوصيلة! الرصيد المتبقي: {new_bal:.2f} أوقية 🔔")
-                        play_sound("success.mp3") 
-                        st.session_state['search_result_id'] = None 
-                        st.rerun()
-                    else:
-                        st.error("عفواً، الرصيد غير كافي لإجراء التوصيلة. يرجى الشحن أولاً. 🚨")
-                        play_sound("error.mp3") 
-            
-            with tab2:
-                amount_to_add = st.number_input("المبلغ المراد شحنه (أوقية)", min_value=-99999.0, step=10.0, key="charge_amount")
-                if st.button("تأكيد الشحن", key="charge_button"):
-                    new_bal = update_balance(selected_id, amount_to_add, "شحن رصيد")
-                    st.success(f"تم الشحن بنجاح! الرصيد الجديد: {new_bal:.2f} أوقية 🔔")
-                    play_sound("success.mp3") 
-                    st.session_state['search_result_id'] = None 
-                    st.rerun()
-        else:
-            st.error("حدث خطأ في جلب بيانات المندوب المحدد.")
-    else:
-        st.info("يرجى البحث عن المندوب باستخدام ترقيمه أو رقم الواتساب لتسجيل عملية.")
+                st.error("الرجاء إدخال قائمة الترقيمات أو رفع ملف.")
 
 # ----------------------------------------------------------------------------------
 # 4. إدارة المندوبين (إضافة/تعديل)
 # ----------------------------------------------------------------------------------
 elif current_menu == "إدارة المندوبين (إضافة/تعديل)":
     st.header("إدارة بيانات المندوبين")
-    tab_add, tab_edit, tab_view = st.tabs(["إضافة مندوب", "تعديل بيانات", "عرض الكل"])
+    tab_add, tab_edit, tab_bulk, tab_view = st.tabs(["إضافة مندوب", "تعديل بيانات", "استيراد وتعديل جماعي", "عرض الكل"])
     
     with tab_add:
         st.subheader("تسجيل مندوب جديد")
@@ -498,7 +601,7 @@ elif current_menu == "إدارة المندوبين (إضافة/تعديل)":
         # --- منطق البحث هنا ---
         col_search_edit, col_button_edit = st.columns([3, 1])
         with col_search_edit:
-            search_term_edit = st.text_input("ابحث بترقيم المندوب (ID) أو رقم الواتساب للتعديل", key="search_edit_input")
+            search_term_edit = st.text_input("ابحث بالترقيم (ID) أو رقم الواتساب أو الاسم أو اللوحة للتعديل", key="search_edit_input")
         with col_button_edit:
             if st.button("بحث وتحديد", key="search_edit_btn", type="primary"):
                 driver_data = search_driver(search_term_edit)
@@ -508,6 +611,7 @@ elif current_menu == "إدارة المندوبين (إضافة/تعديل)":
                 else:
                     st.error("لم يتم العثور على المندوب.")
                     st.session_state['search_result_id'] = None
+        show_driver_suggestions("search_edit", search_term_edit, pick_suggested_driver)
         # ----------------------
         
         selected_id = st.session_state['search_result_id']
@@ -517,9 +621,8 @@ elif current_menu == "إدارة المندوبين (إضافة/تعديل)":
             if info:
                 st.markdown(f"**بيانات المندوب الحالي: {info['name']}**")
                 
-                # جلب البيانات التفصيلية من DataFrame
-                drivers_df = get_sheet_data("drivers")
-                driver_row = drivers_df[drivers_df['الترقيم'] == selected_id].iloc[0]
+                # جلب البيانات التفصيلية من فهرس المندوبين
+                driver_row = get_driver_index().get(selected_id)
                 
                 with st.form("edit_driver_form"):
                     col1_edit, col2_edit = st.columns(2)
@@ -541,6 +644,17 @@ elif current_menu == "إدارة المندوبين (إضافة/تعديل)":
         else:
             st.info("يرجى استخدام شريط البحث أعلاه لتحديد المندوب المراد تعديله.")
 
+    with tab_bulk:
+        feedback = st.session_state.pop('driver_import_feedback', None)
+        if feedback:
+            st.success(feedback)
+            play_sound("success.mp3")
+        st.subheader("استيراد مندوبين من ملف")
+        show_driver_import()
+        st.divider()
+        st.subheader("تعديل جماعي")
+        show_bulk_edit()
+
     with tab_view:
         st.subheader("عرض بيانات جميع المندوبين")
         all_details = get_all_drivers_details()
@@ -555,7 +669,7 @@ elif current_menu == "إدارة المندوبين (إضافة/تعديل)":
 elif current_menu == "التقارير وسجل العمليات":
     st.header("سجل الحركات المالية والتقارير")
     
-    report_type = st.radio("نوع التقرير", ["التقارير الإجمالية", "سجل جميع العمليات", "سجل مندوب معين"], horizontal=True)
+    report_type = st.radio("نوع التقرير", ["التقارير الإجمالية", "تحليلات التوصيل", "سجل جميع العمليات", "سجل مندوب معين", "مطابقة الأرصدة"], horizontal=True)
     
     if report_type == "التقارير الإجمالية":
         st.subheader("ملخص إجمالي للنظام")
@@ -579,18 +693,90 @@ elif current_menu == "التقارير وسجل العمليات":
             st.metric(label="عدد التوصيلات الإجمالي", value=f"{total_deliveries}", delta_color="off")
             st.caption("مجموع عدد التوصيلات الناجحة المسجلة في النظام.")
         
+        if st.button("إعادة حساب الإجماليات من السجل", help="تُحدّث الإجماليات تلقائياً مع كل عملية؛ استخدم هذا الزر فقط بعد تعديل السجل يدوياً."):
+            get_store().rebuild_aggregates()
+            st.rerun()
+        
+        # --- أرشفة الفترات المغلقة ---
+        with st.expander("🗄️ أرشفة الفترات المغلقة"):
+            st.markdown("تُنقل حركات الفترات المغلقة من ورقة `transactions` إلى ورقة أرشيف لكل فترة (مثل `transactions_2025-11`)، مع سطر ملخص لكل مندوب ونوع عملية في ورقة `period_summaries`، فتبقى الإجماليات وعدد التوصيلات صحيحة دون قراءة الأرشيف.")
+            store = get_store()
+            # محتوى expander يُنفذ مع كل عرض للصفحة: الفترات الجاهزة تُحسب عند الطلب فقط
+            if st.toggle("عرض الفترات الجاهزة للأرشفة", key="show_archivable"):
+                archivable = store.archivable_periods()
+                if archivable:
+                    st.caption("فترات جاهزة للأرشفة: " + "، ".join(f"{p} ({n} حركة)" for p, n in archivable.items()))
+                    if st.button("أرشفة الفترات المغلقة", type="primary"):
+                        archived = archive_closed_periods()
+                        st.success(f"تمت أرشفة {sum(archived.values())} حركة من {len(archived)} فترة. 🔔")
+                        st.rerun()
+                else:
+                    st.caption("لا توجد فترات مغلقة في الورقة الحالية.")
+            
+            periods = store.archive_periods()
+            if not periods.empty:
+                st.dataframe(periods.rename(columns={
+                    'period': 'الفترة',
+                    'rows': 'عدد الحركات',
+                    'archived_at': 'تاريخ الأرشفة',
+                    'synced': 'منسوخة إلى Sheets',
+                    'loaded': 'محمّلة محلياً'
+                }), use_container_width=True, hide_index=True)
+                not_loaded = periods.loc[~periods['loaded'], 'period'].tolist()
+                if not_loaded:
+                    col_period, col_load = st.columns([2, 1])
+                    with col_period:
+                        period_to_load = st.selectbox("تحميل أرشيف فترة (لعرضها في السجل وتصديرها)", not_loaded)
+                    with col_load:
+                        if st.button("تحميل الأرشيف"):
+                            try:
+                                loaded_rows = load_archived_period(period_to_load)
+                            except SheetsQuotaError as e:
+                                st.error(str(e))
+                            else:
+                                st.success(f"تم تحميل {loaded_rows} حركة من أرشيف {period_to_load}.")
+                                st.rerun()
+        
+    # 🆕 تحليلات حسب الزمن: من جداول التجميع (ساعة/يوم) فلا يُعاد تجميع السجل كله مع كل عرض
+    elif report_type == "تحليلات التوصيل":
+        st.subheader("التوصيلات والمبالغ حسب الفترة")
+        today = datetime.now().date()
+        col_from, col_to, col_freq = st.columns(3)
+        with col_from:
+            analytics_start = st.date_input("من تاريخ", value=today - timedelta(days=29), key="analytics_from")
+        with col_to:
+            analytics_end = st.date_input("إلى تاريخ", value=today, key="analytics_to")
+        with col_freq:
+            freq = st.selectbox("التجميع حسب", ["D", "W", "h"], format_func={"h": "الساعة", "D": "اليوم", "W": "الأسبوع"}.get, key="analytics_freq")
+        
+        series = get_activity_series(analytics_start, analytics_end, freq)
+        if series.empty:
+            st.info("لا توجد حركات في هذه الفترة.")
+        else:
+            col_deliveries, col_deducted, col_charged = st.columns(3)
+            with col_deliveries:
+                st.metric(label="عدد التوصيلات", value=f"{int(series['عدد التوصيلات'].sum())}")
+            with col_deducted:
+                st.metric(label="المبالغ المخصومة", value=f"{series['المبالغ المخصومة'].sum():.2f} أوقية")
+            with col_charged:
+                st.metric(label="المبالغ المشحونة", value=f"{series['المبالغ المشحونة'].sum():.2f} أوقية")
+            
+            st.markdown("#### عدد التوصيلات")
+            st.bar_chart(series['عدد التوصيلات'])
+            st.markdown("#### المبالغ المشحونة والمخصومة (أوقية)")
+            st.line_chart(series[['المبالغ المشحونة', 'المبالغ المخصومة']])
+            
+            st.markdown("#### نشاط المندوبين في الفترة")
+            activity = get_driver_activity(analytics_start, analytics_end)
+            st.bar_chart(activity.head(20).set_index('الترقيم')['عدد التوصيلات'])
+            st.dataframe(activity, use_container_width=True, hide_index=True)
+        st.caption("تشمل التحليلات السجل الحالي وأرشيف الفترات المحمّلة محلياً فقط.")
+        
     elif report_type == "سجل جميع العمليات":
         st.subheader("جميع حركات الشحن والخصم")
-        df = get_history(driver_id=None)
-        if not df.empty:
-            st.dataframe(df, use_container_width=True)
-            csv = df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="تحميل السجل كملف CSV",
-                data=csv,
-                file_name=f"سجل_العمليات_الكامل_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv",
-            )
+        total, start, end = show_history_pages("all_history")
+        if total:
+            show_export_button("all_history", "سجل_العمليات_الكامل", start=start, end=end)
         else:
             st.info("لا توجد حركات مسجلة بعد.")
             
@@ -600,7 +786,7 @@ elif current_menu == "التقارير وسجل العمليات":
         # --- منطق البحث هنا ---
         col_search_hist, col_button_hist = st.columns([3, 1])
         with col_search_hist:
-            search_term_hist = st.text_input("ابحث بترقيم المندوب (ID) أو رقم الواتساب", key="search_hist_input")
+            search_term_hist = st.text_input("ابحث بالترقيم (ID) أو رقم الواتساب أو الاسم أو اللوحة", key="search_hist_input")
         with col_button_hist:
             if st.button("بحث وعرض السجل", key="search_hist_btn", type="primary"):
                 driver_data = search_driver(search_term_hist)
@@ -610,6 +796,7 @@ elif current_menu == "التقارير وسجل العمليات":
                 else:
                     st.error("لم يتم العثور على المندوب.")
                     st.session_state['search_result_id'] = None
+        show_driver_suggestions("search_hist", search_term_hist, pick_suggested_driver)
         # ----------------------
         
         selected_id = st.session_state['search_result_id']
@@ -619,17 +806,9 @@ elif current_menu == "التقارير وسجل العمليات":
             if driver_info:
                 driver_name = driver_info['name']
                 st.markdown(f"**سجل حركات المندوب: {driver_name} (ID: {selected_id})**")
-                df = get_history(driver_id=selected_id)
-                
-                if not df.empty:
-                    st.dataframe(df, use_container_width=True)
-                    csv = df.to_csv(index=False).encode('utf-8')
-                    st.download_button(
-                        label="تحميل السجل كملف CSV",
-                        data=csv,
-                        file_name=f"سجل_المندوب_{selected_id}_{datetime.now().strftime('%Y%m%d')}.csv",
-                        mime="text/csv",
-                    )
+                total, start, end = show_history_pages("driver_history", selected_id)
+                if total:
+                    show_export_button("driver_history", f"سجل_المندوب_{selected_id}", selected_id, start, end)
                 else:
                     st.info("لا توجد حركات مسجلة لهذا المندوب.")
             else:
@@ -637,6 +816,44 @@ elif current_menu == "التقارير وسجل العمليات":
         else:
             st.info("يرجى استخدام شريط البحث أعلاه لتحديد المندوب المطلوب.")
 
+    elif report_type == "مطابقة الأرصدة":
+        st.subheader("مطابقة أرصدة المندوبين مع سجل الحركات")
+        st.markdown("يُعاد حساب رصيد كل مندوب من سجل الحركات ويُقارن برصيده المسجل. الفحص السريع يبدأ من آخر لقطة أرصدة محفوظة ويعيد فقط الحركات التي بعدها.")
+        
+        col_quick, col_full, col_snapshot = st.columns(3)
+        with col_quick:
+            run_quick = st.button("فحص سريع (من آخر لقطة)", type="primary")
+        with col_full:
+            run_full = st.button("فحص كامل (من السجل كله)")
+        with col_snapshot:
+            if st.button("حفظ لقطة أرصدة الآن", help="تُحفظ اللقطات تلقائياً أيضاً كل عدد معين من الحركات."):
+                get_store().take_balance_snapshot()
+                st.success("تم حفظ لقطة الأرصدة.")
+        
+        if run_quick or run_full:
+            mismatches, summary = get_reconciliation(full=run_full)
+            if summary['mode'] == 'snapshot':
+                st.caption(f"من اللقطة رقم {summary['snapshot_id']} ({summary['snapshot_at']}) — أُعيد حساب {summary['replayed']} حركة.")
+            else:
+                st.caption(f"من السجل كله — {summary['replayed']} حركة.")
+            
+            col_checked, col_mismatch, col_unknown, col_diff = st.columns(4)
+            with col_checked:
+                st.metric(label="المندوبون المفحوصون", value=f"{summary['drivers']}")
+            with col_mismatch:
+                st.metric(label="أرصدة غير مطابقة", value=f"{summary['mismatches']}")
+            with col_unknown:
+                st.metric(label="مندوبون غير موجودين في السجل", value=f"{summary['unknown_drivers']}")
+            with col_diff:
+                st.metric(label="مجموع الفروقات", value=f"{summary['total_difference']:.2f} أوقية")
+            
+            if summary['unattributed_transactions']:
+                st.warning(f"توجد {summary['unattributed_transactions']} حركة بدون ترقيم مندوب، ولا تدخل في المطابقة.")
+            if mismatches.empty:
+                st.success("✅ كل الأرصدة مطابقة لسجل الحركات.")
+            else:
+                st.error("توجد أرصدة لا تطابق سجل الحركات:")
+                st.dataframe(mismatches, use_container_width=True, hide_index=True)
 
 # ----------------------------------------------------------------------------------
 # 6. إعدادات التطبيق (الشعار)
@@ -664,4 +881,73 @@ elif current_menu == "إعدادات التطبيق (الشعار)":
             st.rerun() 
 
         except Exception as e:
-            st.error(f"حدث خطأ أثناء حفظ الملف: {e}")
\ No newline at end of file
+            st.error(f"حدث خطأ أثناء حفظ الملف: {e}")
+# ----------------------------------------------------------------------------------
+# 7. التشخيص والأداء (للمسؤول فقط)
+# ----------------------------------------------------------------------------------
+elif current_menu == "التشخيص والأداء":
+    st.header("التشخيص والأداء")
+    st.markdown("أزمنة وعدادات العملية الحالية منذ تشغيلها (أو منذ آخر تصفير)، لمعرفة مصدر البطء: طلبات Google Sheets، أو الذاكرة المؤقتة، أو معالجة البيانات.")
+    
+    registry = metrics.REGISTRY
+    cache_hits = registry.counter_value("frame_cache_total", result="hit")
+    cache_misses = registry.counter_value("frame_cache_total", result="miss")
+    timings = registry.timings_frame()
+    sheets_timings = timings[timings['metric'] == 'sheets_request_seconds']
+    sheets_errors = sheets_timings.loc[sheets_timings['labels'].str.contains('status="error"'), 'count'].sum()
+    pending = get_mirror().pending
+    pending_count = len(pending['rewrites']) + sum(pending['appends'].values()) + pending['driver_updates']
+    
+    col_requests, col_errors, col_cache, col_pending = st.columns(4)
+    with col_requests:
+        st.metric(label="طلبات Google Sheets", value=f"{int(sheets_timings['count'].sum())}")
+    with col_errors:
+        st.metric(label="طلبات فاشلة", value=f"{int(sheets_errors)}")
+    with col_cache:
+        hit_rate = cache_hits / (cache_hits + cache_misses) * 100 if cache_hits + cache_misses else 0.0
+        st.metric(label="نسبة إصابة الذاكرة المؤقتة", value=f"{hit_rate:.1f}%")
+    with col_pending:
+        st.metric(label="عمليات بانتظار النسخ إلى Sheets", value=f"{pending_count}")
+    
+    # 🆕 حصة طلبات Google Sheets في الدقيقة الحالية
+    col_read_budget, col_write_budget, col_retries = st.columns(3)
+    budget = get_client().budget
+    with col_read_budget:
+        st.metric(label="المتبقي من حصة القراءة (دقيقة)", value=f"{budget['read'][0]} / {budget['read'][1]}")
+    with col_write_budget:
+        st.metric(label="المتبقي من حصة الكتابة (دقيقة)", value=f"{budget['write'][0]} / {budget['write'][1]}")
+    with col_retries:
+        st.metric(label="إعادات بسبب تجاوز الحصة (429)", value=f"{int(registry.counter_value('sheets_retries_total'))}")
+    
+    if refresh_status['interval'] > 0:
+        last_refresh = datetime.fromtimestamp(refresh_status['last_success']).strftime("%Y-%m-%d %H:%M:%S") if refresh_status['last_success'] else "لم يحدث بعد"
+        st.caption(f"التحديث الدوري من Google Sheets كل {refresh_status['interval']:.0f} ثانية — آخر قراءة ناجحة: {last_refresh}.")
+    # 🆕 الملف المحلي المشترك بين عدة نسخ من التطبيق (JAK_SHARED_CACHE)
+    if get_store().shared:
+        role = "القائد (يقرأ من Google Sheets لكل النسخ)" if refresh_status['leader'] else "تابع (يقرأ من الملف المشترك)"
+        st.caption(f"ملف بيانات مشترك بين عدة نسخ — هذه النسخة: {role} — نسخ أخرى لم تكمل نسخ كتاباتها: {sum(w > m for w, m, _ in get_store().foreign_backlog().values())}.")
+    # 🆕 العمليات المؤكدة محلياً (مكتوبة على القرص) التي لم تصل إلى Sheets بعد
+    st.caption(f"عمليات في دفتر اليومية لم تُنسخ إلى Sheets: {get_store().journal_pending} — ضغطات مكررة تم تجاهلها: {int(registry.counter_value('journal_duplicates_total'))}.")
+    
+    st.subheader("الأزمنة (ملي ثانية)")
+    if timings.empty:
+        st.info("لا توجد قياسات بعد.")
+    else:
+        st.dataframe(timings.round(2), use_container_width=True, hide_index=True)
+    
+    st.subheader("العدادات")
+    st.dataframe(registry.counters_frame(), use_container_width=True, hide_index=True)
+    
+    col_download, col_reset = st.columns(2)
+    with col_download:
+        st.download_button("تحميل القياسات بصيغة Prometheus", data=registry.render(), file_name="metrics.prom", mime="text/plain")
+        if metrics.METRICS_FILE:
+            st.caption(f"تُكتب القياسات أيضاً في الملف `{metrics.METRICS_FILE}` كل {metrics.WRITE_INTERVAL:.0f} ثانية.")
+    with col_reset:
+        if st.button("تصفير القياسات"):
+            registry.reset()
+            st.rerun()
+
+# 🆕 زمن إعادة تشغيل الصفحة (لا يشمل التشغيلات التي انتهت بـ st.rerun أو st.stop)
+metrics.observe("page_rerun_seconds", time.perf_counter() - rerun_started, page=current_menu)
+metrics.REGISTRY.maybe_write_file()
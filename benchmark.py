@@ -0,0 +1,144 @@
+"""قياس أداء دوال البيانات دون Google Sheets (اتصال بديل في الذاكرة).
+
+مثال:
+    python benchmark.py --sizes 1000 10000 100000 --latency 0.2 --output bench_output.txt
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# قاعدة مؤقتة مستقلة عن ملف التطبيق (يجب ضبطها قبل استيراد المخزن)
+_WORKDIR = tempfile.mkdtemp(prefix="jak-bench-")
+os.environ["JAK_DB_PATH"] = os.path.join(_WORKDIR, "bench.db")
+
+import data_access  # noqa: E402
+from fake_sheets import FakeGSheetsConnection, synthetic_sheets  # noqa: E402
+
+# --- إعدادات القياس ---
+DEFAULT_SIZES = [1000, 10000, 100000]  # عدد صفوف سجل الحركات في كل تجربة
+ROWS_PER_DRIVER = 20  # متوسط حركات كل مندوب في البيانات المولّدة
+DEFAULT_REPEAT = 50  # عدد مرات تشغيل كل عملية
+FLUSH_TIMEOUT = 120.0  # ثواني انتظار إفراغ طابور الكتابة إلى Sheets
+# -----------------------------
+
+COLUMNS = ["العملية", "n", "متوسط ms", "p50 ms", "p95 ms", "قراءات", "كتابات", "KB مقروءة", "KB مكتوبة"]
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _measure(name, conn, func, repeat):
+    """يشغّل func عدة مرات ويعيد صف النتائج، مع طلبات Sheets التي تسببت بها (بعد إفراغ الطابور)."""
+    conn.stats.reset()
+    samples = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - t0) * 1000)
+    data_access.get_mirror().flush(FLUSH_TIMEOUT)
+    calls = conn.stats.snapshot()
+    return [
+        name, repeat,
+        statistics.fmean(samples), _percentile(samples, 0.5), _percentile(samples, 0.95),
+        calls["reads"], calls["writes"],
+        calls["bytes_read"] / 1024, calls["bytes_written"] / 1024,
+    ]
+
+
+def _reset_resources(db_path, conn):
+    """مخزن وكاتب جديدان لكل حجم، متصلان بالاتصال البديل."""
+    for resource in (data_access.get_writer, data_access.get_mirror, data_access.get_store,
+                     data_access.get_client, data_access.build_driver_index,
+                     data_access.build_driver_search):
+        resource.clear()
+    data_access.DB_PATH = db_path
+    data_access.get_connection = lambda: conn
+
+
+def run_size(size, latency, repeat, seed):
+    n_drivers = max(10, size // ROWS_PER_DRIVER)
+    conn = FakeGSheetsConnection(synthetic_sheets(n_drivers, size, seed=seed), latency=latency)
+    _reset_resources(os.path.join(_WORKDIR, f"bench-{size}.db"), conn)
+
+    rng = random.Random(seed)
+    driver_ids = list(conn.frame("drivers")["driver_id"])
+    whatsapps = list(conn.frame("drivers")["whatsapp"])
+    pick = lambda _: rng.choice(driver_ids)  # noqa: E731
+
+    rows = [_measure("hydrate (تشغيل بارد)", conn, lambda _: data_access.get_store(), 1)]
+    data_access.get_writer()
+    store = data_access.get_store()
+
+    rows += [
+        _measure("get_sheet_data بارد", conn, lambda _: store.read_sheet("transactions"), max(1, repeat // 10)),
+        _measure("get_sheet_data دافئ", conn, lambda _: data_access.get_sheet_data("transactions"), repeat),
+        _measure("search_driver (ترقيم)", conn, lambda _: data_access.search_driver(pick(_)), repeat),
+        _measure("search_driver (واتساب)", conn, lambda _: data_access.search_driver(rng.choice(whatsapps)), repeat),
+        _measure("suggest_drivers (نهاية واتساب)", conn,
+                 lambda _: data_access.suggest_drivers(str(rng.choice(whatsapps))[-4:]), repeat),
+        _measure("suggest_drivers (اسم بخطأ إملائي)", conn,
+                 lambda _: data_access.suggest_drivers(f"مندب {rng.randint(1, len(driver_ids))}"), repeat),
+        _measure("update_balance شحن", conn,
+                 lambda _: data_access.update_balance(pick(_), 100.0, "شحن رصيد"), repeat),
+        _measure("update_balance خصم", conn,
+                 lambda _: data_access.update_balance(pick(_), -data_access.DEDUCTION_AMOUNT, "خصم توصيلة"), repeat),
+        _measure("get_sheet_data بعد كتابة", conn, lambda _: data_access.get_sheet_data("transactions"), repeat),
+        _measure("get_totals", conn, lambda _: data_access.get_totals(), repeat),
+        _measure("get_history (الكل)", conn, lambda _: data_access.get_history(), max(1, repeat // 10)),
+        _measure("get_history (مندوب)", conn, lambda _: data_access.get_history(pick(_)), repeat),
+        _measure("get_history_page", conn, lambda _: data_access.get_history_page(page=1), repeat),
+        _measure("get_history_page (مندوب)", conn, lambda _: data_access.get_history_page(pick(_)), repeat),
+        _measure("get_all_drivers_details", conn, lambda _: data_access.get_all_drivers_details(), repeat),
+    ]
+    return n_drivers, rows
+
+
+def format_table(rows):
+    cells = [COLUMNS] + [
+        [r[0], str(r[1])] + [f"{v:.2f}" for v in r[2:5]] + [str(r[5]), str(r[6])] + [f"{v:.1f}" for v in r[7:]]
+        for r in rows
+    ]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(COLUMNS))]
+    lines = ["  ".join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(row, widths)))
+             for row in cells]
+    lines.insert(1, "-" * len(lines[0]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أداء دوال البيانات باتصال Sheets بديل في الذاكرة.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="أحجام سجل الحركات")
+    parser.add_argument("--latency", type=float, default=0.0, help="تأخير كل طلب Sheets بالثواني")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="مرات تشغيل كل عملية")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ملف تُحفظ فيه النتائج إضافة إلى الطباعة")
+    args = parser.parse_args(argv)
+
+    # تحذيرات Streamlit عن تشغيل الذاكرة المؤقتة خارج التطبيق غير مهمة هنا
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    report = []
+    for size in args.sizes:
+        n_drivers, rows = run_size(size, args.latency, args.repeat, args.seed)
+        report.append(f"== {size} حركة، {n_drivers} مندوب، تأخير {args.latency * 1000:.0f}ms ==")
+        report.append(format_table(rows))
+        report.append("")
+        print("\n".join(report[-3:]), flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("\n".join(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
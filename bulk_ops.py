@@ -0,0 +1,240 @@
+import io
+import re
+
+import pandas as pd
+
+from schema import from_minor, to_minor
+
+# --- إعدادات العمليات المجمعة ---
+BATCH_SEPARATORS = r"[,;\t ]+"  # فواصل مقبولة بين الترقيم والعدد في السطر الواحد
+HEADER_TOKENS = {"driver_id", "id", "الترقيم"}  # أسماء أعمدة تُتجاهل إذا جاءت في السطر الأول
+INVALID_ID_CHARS = r"[()\s]"  # الترقيم لا يحتوي مسافات أو أقواساً (تُستخدم في driver_name للسجل)
+# أسماء الأعمدة المقبولة في ملف استيراد المندوبين (بالإنجليزية أو العربية)
+DRIVER_FIELD_ALIASES = {
+    "driver_id": ["driver_id", "id", "الترقيم", "ترقيم المندوب"],
+    "name": ["name", "الاسم", "اسم المندوب"],
+    "bike_plate": ["bike_plate", "plate", "اللوحة", "رقم اللوحة"],
+    "whatsapp": ["whatsapp", "واتساب", "الواتساب", "رقم الواتساب"],
+    "notes": ["notes", "ملاحظات"],
+    "is_active": ["is_active", "active", "مفعل", "الحالة"],
+}
+ACTIVE_VALUES = {"true": True, "1": True, "yes": True, "نعم": True, "مفعل": True,
+                 "false": False, "0": False, "no": False, "لا": False, "معطل": False}
+# -----------------------------
+
+# أسباب الرفض (تظهر في تقرير الدفعة)
+REJECT_BAD_COUNT = "عدد التوصيلات غير صالح"
+REJECT_UNKNOWN = "ترقيم غير موجود"
+REJECT_INACTIVE = "الحساب معطل"
+REJECT_BALANCE = "الرصيد غير كافٍ"
+REJECT_MISSING_ID = "الترقيم فارغ"
+REJECT_BAD_ID = "الترقيم يحتوي مسافات أو أقواساً"
+REJECT_MISSING_NAME = "الاسم فارغ"
+REJECT_DUPLICATE_IN_FILE = "الترقيم مكرر في الملف"
+REJECT_EXISTS = "الترقيم موجود مسبقاً"
+REJECT_BAD_STATUS = "قيمة التفعيل غير مفهومة"
+EDITABLE_DRIVER_COLUMNS = ["name", "bike_plate", "whatsapp", "notes", "is_active"]
+
+
+def parse_delivery_batch(text):
+    """يحول نصاً ملصوقاً أو محتوى CSV إلى جدول (driver_id، count، line).
+
+    كل سطر يحتوي ترقيماً واحداً، مع عدد توصيلات اختياري (الافتراضي 1).
+    """
+    rows = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        parts = [p for p in re.split(BATCH_SEPARATORS, line.strip()) if p]
+        if not parts:
+            continue
+        if not rows and parts[0].lower() in HEADER_TOKENS:
+            continue
+        count = parts[1] if len(parts) > 1 else "1"
+        rows.append({"line": line_no, "driver_id": parts[0], "count": count})
+    df = pd.DataFrame(rows, columns=["line", "driver_id", "count"])
+    df["count"] = pd.to_numeric(df["count"], errors="coerce")
+    return df
+
+
+def validate_delivery_batch(batch_df, drivers_df, deduction_amount):
+    """يتحقق من كل أسطر الدفعة دفعة واحدة مقابل أرصدة المندوبين وحالتهم.
+
+    drivers_df: إطار المندوبين المضغوط (الأرصدة بأجزاء المئة في balance_minor).
+    الأسطر المكررة لنفس المندوب تُجمع قبل التحقق من الرصيد. يعيد (المقبول، المرفوض):
+    المقبول: driver_id، name، count، amount، balance_after.
+    المرفوض: line، driver_id، count، reason.
+    """
+    batch = batch_df.copy()
+    batch["driver_id"] = batch["driver_id"].astype(drivers_df["driver_id"].dtype)
+    bad_count = batch["count"].isna() | (batch["count"] < 1) | (batch["count"] % 1 != 0)
+    deduction_minor = to_minor(deduction_amount)
+
+    merged = batch.merge(
+        drivers_df[["driver_id", "name", "is_active", "balance_minor"]], on="driver_id", how="left"
+    )
+    unknown = merged["name"].isna().to_numpy() & ~bad_count.values
+    inactive = ~unknown & ~bad_count.values & merged["is_active"].eq(False).to_numpy(dtype=bool, na_value=False)
+
+    # التحقق من الرصيد بعد جمع كل أسطر المندوب الصالحة
+    candidate = ~(bad_count.values | unknown | inactive)
+    totals = merged[candidate].groupby("driver_id", observed=True)["count"].transform("sum")
+    short = pd.Series(False, index=merged.index)
+    short[candidate] = merged.loc[candidate, "balance_minor"] < totals * deduction_minor
+
+    merged["reason"] = None
+    merged.loc[bad_count.values, "reason"] = REJECT_BAD_COUNT
+    merged.loc[unknown, "reason"] = REJECT_UNKNOWN
+    merged.loc[inactive, "reason"] = REJECT_INACTIVE
+    merged.loc[short, "reason"] = REJECT_BALANCE
+
+    rejected = merged.loc[merged["reason"].notna(), ["line", "driver_id", "count", "reason"]]
+    accepted = (
+        merged[merged["reason"].isna()]
+        .groupby("driver_id", sort=False)
+        .agg(name=("name", "first"), count=("count", "sum"), balance_minor=("balance_minor", "first"))
+        .reset_index()
+    )
+    accepted["count"] = accepted["count"].astype(int)
+    accepted["amount"] = from_minor(-accepted["count"] * deduction_minor)
+    accepted["balance_after"] = from_minor(accepted["balance_minor"] - accepted["count"] * deduction_minor)
+    return accepted.drop(columns=["balance_minor"]), rejected.reset_index(drop=True)
+
+
+def settle_delivery_batch(accepted, rejected, results, deduction_amount):
+    """يطابق جدول المقبول مع ما طبقه الكاتب فعلاً.
+
+    قد يرفض الكاتب بعض التوصيلات إذا تغير الرصيد أو عُطل الحساب بين التحقق والتطبيق (عملية
+    متزامنة من مسؤول آخر)؛ تنتقل هذه إلى جدول المرفوض ويُحدّث الرصيد المتبقي من الرصيد الفعلي.
+    """
+    applied = {}
+    final_balance = {}
+    disabled = set()
+    # النتائج بترتيب الحركات: توصيلات كل سطر مقبول متتالية بعددها
+    for driver_id, (balance, transaction, status) in zip(accepted["driver_id"].repeat(accepted["count"]), results):
+        if transaction:
+            applied[driver_id] = applied.get(driver_id, 0) + 1
+            final_balance[driver_id] = balance
+        elif status == "inactive":
+            disabled.add(driver_id)
+
+    accepted = accepted.copy()
+    applied_count = accepted["driver_id"].map(applied).fillna(0).astype(int)
+    missing = accepted["count"] - applied_count
+    if missing.any():
+        late = pd.DataFrame({
+            "line": None,
+            "driver_id": accepted.loc[missing > 0, "driver_id"],
+            "count": missing[missing > 0],
+        })
+        late["reason"] = [REJECT_INACTIVE if d in disabled else REJECT_BALANCE for d in late["driver_id"]]
+        rejected = pd.concat([rejected, late], ignore_index=True)
+
+    accepted["count"] = applied_count
+    accepted = accepted[accepted["count"] > 0].copy()
+    accepted["amount"] = -accepted["count"] * deduction_amount
+    accepted["balance_after"] = accepted["driver_id"].map(final_balance)
+    return accepted.reset_index(drop=True), rejected
+
+
+def import_formats():
+    """امتدادات ملفات استيراد المندوبين المقبولة (Excel يتطلب مكتبة openpyxl)."""
+    formats = ["csv", "txt"]
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return formats
+    return formats + ["xlsx"]
+
+
+def read_driver_file(file_name, data):
+    """يقرأ ملف CSV أو Excel كجدول نصوص (دون تحويل الأرقام، حتى لا تفقد أرقام الواتساب أصفارها)."""
+    if file_name.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(io.BytesIO(data), dtype=str, keep_default_na=False)
+    # الفاصل يُكتشف تلقائياً (فاصلة أو فاصلة منقوطة أو Tab)
+    return pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, sep=None, engine="python",
+                       encoding="utf-8-sig")
+
+
+def parse_driver_import(df):
+    """يوحد أعمدة ملف الاستيراد إلى أسماء أعمدة المندوبين، ويضيف رقم السطر في الملف (line).
+
+    القيم نصوص منظفة من المسافات، والخلايا الفارغة NA.
+    """
+    aliases = {alias.lower(): col for col, names in DRIVER_FIELD_ALIASES.items() for alias in names}
+    df = df.rename(columns=lambda c: aliases.get(str(c).strip().lower(), c))
+    out = pd.DataFrame({"line": range(2, len(df) + 2)}, index=df.index)
+    for col in DRIVER_FIELD_ALIASES:
+        values = df[col].astype("string").str.strip() if col in df.columns else pd.Series(pd.NA, index=df.index, dtype="string")
+        out[col] = values.mask(values == "")
+    # أرقام قرأها Excel كأعداد عشرية
+    out["whatsapp"] = out["whatsapp"].str.replace(r"\.0+$", "", regex=True)
+    return out.reset_index(drop=True)
+
+
+def validate_driver_import(import_df, drivers_df):
+    """يتحقق من كل صفوف ملف الاستيراد دفعة واحدة، ويعيد (المقبول، المرفوض).
+
+    المقبول: صفوف بأعمدة المندوبين جاهزة للإضافة (الرصيد صفر، والتفعيل افتراضياً نعم).
+    المرفوض: line، driver_id، name، reason (كل أسباب رفض الصف مفصولة بفاصلة).
+    """
+    ids = import_df["driver_id"]
+    missing_id = ids.isna().to_numpy()
+    status_text = import_df["is_active"].str.lower()
+    status = status_text.map(ACTIVE_VALUES)
+    checks = [
+        (missing_id, REJECT_MISSING_ID),
+        (ids.str.contains(INVALID_ID_CHARS, regex=True).fillna(False).to_numpy(dtype=bool), REJECT_BAD_ID),
+        (import_df["name"].isna().to_numpy(), REJECT_MISSING_NAME),
+        (ids.duplicated(keep=False).to_numpy() & ~missing_id, REJECT_DUPLICATE_IN_FILE),
+        (ids.isin(drivers_df["driver_id"].astype(str)).to_numpy() & ~missing_id, REJECT_EXISTS),
+        (status_text.notna().to_numpy() & status.isna().to_numpy(), REJECT_BAD_STATUS),
+    ]
+    reason = _join_reasons(checks, len(import_df))
+
+    rejected = import_df.loc[reason.notna().to_numpy(), ["line", "driver_id", "name"]].assign(
+        reason=reason.dropna().to_numpy()
+    )
+    accepted = import_df[reason.isna().to_numpy()].drop(columns=["line"]).copy()
+    accepted["is_active"] = status[reason.isna().to_numpy()].fillna(True).astype(bool)
+    accepted["balance"] = 0.0
+    return accepted.reset_index(drop=True), rejected.reset_index(drop=True)
+
+
+def diff_driver_edits(original, edited):
+    """يقارن جدول المندوبين قبل التعديل الجماعي وبعده (نفس الصفوف بنفس الترتيب).
+
+    يعيد (التعديلات {driver_id: {العمود: القيمة الجديدة}}، المرفوض: driver_id، reason).
+    """
+    changed = pd.DataFrame(False, index=original.index, columns=EDITABLE_DRIVER_COLUMNS)
+    for col in EDITABLE_DRIVER_COLUMNS:
+        before, after = original[col], edited[col]
+        if col == "is_active":
+            changed[col] = before.fillna(False).astype(bool).to_numpy() != after.fillna(False).astype(bool).to_numpy()
+        else:
+            changed[col] = _text(before).to_numpy() != _text(after).to_numpy()
+    rows = changed.any(axis=1).to_numpy()
+    missing_name = _text(edited["name"]).eq("").to_numpy() & rows
+    reason = _join_reasons([(missing_name, REJECT_MISSING_NAME)], len(edited))
+
+    updates = {}
+    for i in (rows & reason.isna().to_numpy()).nonzero()[0]:
+        fields = {}
+        for col in EDITABLE_DRIVER_COLUMNS:
+            if changed[col].iat[i]:
+                value = edited[col].iat[i]
+                fields[col] = bool(value) if col == "is_active" else (None if pd.isna(value) else str(value).strip())
+        updates[str(edited["driver_id"].iat[i])] = fields
+    rejected = pd.DataFrame({"driver_id": edited["driver_id"][reason.notna().to_numpy()], "reason": reason.dropna()})
+    return updates, rejected.reset_index(drop=True)
+
+
+def _text(values):
+    return values.astype("string").fillna("").str.strip()
+
+
+def _join_reasons(checks, n):
+    """يجمع أسباب الرفض [(قناع، السبب)] لكل صف في نص واحد، أو NA إذا لم يُرفض الصف."""
+    reason = pd.Series("", index=range(n), dtype="string")
+    for mask, text in checks:
+        reason[mask] = reason[mask] + "، " + text
+    reason = reason.str.removeprefix("، ")
+    return reason.mask(reason == "")
@@ -0,0 +1,52 @@
+"""بيانات وأدوات مشتركة للاختبارات: أوراق صغيرة في FakeGSheetsConnection ومخزن SQLite مؤقت."""
+import pandas as pd
+import pytest
+
+import sheets_sync
+from fake_sheets import FakeGSheetsConnection
+from ledger_store import DRIVER_COLUMNS, TRANSACTION_COLUMNS, LedgerStore
+from ledger_writer import LedgerWriter
+from sheets_client import SheetsClient
+
+
+def small_sheets():
+    """ثلاثة مندوبين (الثالث معطل) وأرصدتهم تساوي مجموع حركاتهم."""
+    drivers = pd.DataFrame([
+        ["J1", "مندوب 1", "1111AB01", "22222222", "", True, 85.0],
+        ["J2", "مندوب 2", "2222AB02", "33333333", "", True, 10.0],
+        ["J3", "مندوب 3", "3333AB03", "44444444", "", False, 50.0],
+    ], columns=DRIVER_COLUMNS)
+    transactions = pd.DataFrame([
+        ["مندوب 1 (ID:J1)", 100.0, "شحن رصيد", "2025-01-05 10:00:00", "J1"],
+        ["مندوب 2 (ID:J2)", 10.0, "شحن رصيد", "2025-01-06 10:00:00", "J2"],
+        ["مندوب 3 (ID:J3)", 50.0, "شحن رصيد", "2025-01-07 10:00:00", "J3"],
+        ["مندوب 1 (ID:J1)", -15.0, "خصم توصيلة", "2025-02-01 12:00:00", "J1"],
+    ], columns=TRANSACTION_COLUMNS)
+    return {"drivers": drivers, "transactions": transactions}
+
+
+@pytest.fixture
+def conn():
+    return FakeGSheetsConnection(small_sheets())
+
+
+@pytest.fixture
+def client(conn):
+    return SheetsClient(conn, "test", read_quota=1000, write_quota=1000)
+
+
+@pytest.fixture
+def store(tmp_path, client):
+    store = LedgerStore(str(tmp_path / "ledger.db"))
+    sheets_sync.hydrate(store, client)
+    return store
+
+
+@pytest.fixture
+def mirror(store, client):
+    return sheets_sync.SheetsMirror(store, client)
+
+
+@pytest.fixture
+def writer(store, mirror):
+    return LedgerWriter(store, mirror)
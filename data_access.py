@@ -0,0 +1,362 @@
+import streamlit as st
+import pandas as pd
+import sqlite3
+
+# 🆕 استيراد أداة الاتصال بـ Google Sheets
+from streamlit_gsheets import GSheetsConnection 
+
+# 🆕 المخزن المحلي ومزامنته مع Google Sheets
+import metrics
+import schema
+import sheets_sync
+from bulk_ops import (
+    EDITABLE_DRIVER_COLUMNS, parse_delivery_batch, parse_driver_import, read_driver_file, settle_delivery_batch,
+    validate_delivery_batch, validate_driver_import,
+)
+from driver_index import SEARCH_LIMIT, DriverIndex, DriverSearch, normalize_whatsapp
+from ledger_store import DB_PATH, HISTORY_PAGE_SIZE, LedgerStore
+from ledger_writer import LedgerWriter
+from sheets_client import SheetsClient
+
+# 🆕 دوال الوصول إلى البيانات (بدون واجهة): يستخدمها app.py وأدوات القياس.
+# يمكن استبدال get_connection باتصال بديل لتشغيلها دون Google Sheets.
+
+# --- إعدادات البيانات ---
+DEDUCTION_AMOUNT = 15.0  # المبلغ المخصوم لكل توصيلة (أوقية)
+
+# 🚨 إعدادات Google Sheets (يجب أن تتطابق مع ملفك ومفتاحك)
+SPREADSHEET_NAME = "1TDc87MdWy-xWLjCFAnBgqVP8InJqOiovv25ap-jRP0I" 
+CONN_NAME = "gcp_service_account" # اسم الاتصال في secrets.toml
+# -----------------------------
+
+# --- دوال التعامل مع Google Sheets ---
+
+# 🆕 دالة للحصول على الاتصال (يتم تخزينها مؤقتاً لتسريع الأداء)
+@st.cache_resource(ttl=3600) 
+def get_connection():
+    # التأكد من أن المفتاح السري موجود قبل المحاولة
+    if CONN_NAME not in st.secrets:
+        st.error(f"خطأ: مفتاح الاتصال '{CONN_NAME}' غير موجود في ملف secrets.toml.")
+        st.stop()
+    return st.connection(CONN_NAME, type=GSheetsConnection)
+
+# 🆕 طبقة الطلبات إلى الملف (دمج القراءات المتطابقة، القراءة المجمعة، حصة الدقيقة وإعادة المحاولة)
+@st.cache_resource
+def get_client():
+    return SheetsClient(get_connection(), SPREADSHEET_NAME)
+
+# 🆕 المخزن المحلي (SQLite) الذي تُخدم منه كل القراءات، مع نسخ الكتابات إلى Sheet في الخلفية
+@st.cache_resource
+def get_store():
+    store = LedgerStore(DB_PATH)
+    sheets_sync.hydrate(store, get_client())
+    return store
+
+@st.cache_resource
+def get_mirror():
+    mirror = sheets_sync.SheetsMirror(get_store(), get_client())
+    sheets_sync.schedule_migrations(get_store(), mirror)
+    return mirror
+
+# 🆕 الكاتب الوحيد لتعديلات الأرصدة (طابور مشترك بين كل الجلسات)
+@st.cache_resource
+def get_writer():
+    return LedgerWriter(get_store(), get_mirror())
+
+# 🆕 التحديث الدوري من Google Sheets (خيط واحد للعملية كلها بدلاً من قراءة كل جلسة عند انتهاء الذاكرة المؤقتة)
+@st.cache_resource
+def get_refresher():
+    return sheets_sync.SheetsRefresher(get_store(), get_client(), get_mirror())
+
+# 🆕 دالة قراءة ورقة معينة (من المخزن المحلي بدلاً من الشبكة)
+# الإطار مخزن حسب اسم الورقة ورقم نسختها: الكتابة تغيّر نسخة الورقة المعنية فقط
+# وتُطبق عليها التعديل مباشرة، فلا تُمسح ذاكرة باقي الجلسات. الإطار مشترك: لا تعدّله.
+# الأنواع مضغوطة (schema.py): المبالغ أعداد صحيحة بأجزاء المئة في amount_minor و balance_minor.
+def get_sheet_data(sheet_name):
+    return get_store().frame(sheet_name)
+
+# 🆕 فهرس المندوبين (بالترقيم ورقم الواتساب): يُبنى مرة لكل نسخة بيانات ويُشارك بين الجلسات
+@st.cache_resource(max_entries=2)
+def build_driver_index(version):
+    with metrics.timer("index_build_seconds"):
+        return DriverIndex(get_store().read_sheet("drivers"), version)
+
+def get_driver_index():
+    return build_driver_index(get_store().data_version("drivers"))
+
+# 🆕 فهرس البحث المقترح (الاسم وبداية الترقيم واللوحة ونهاية الواتساب): لا يحتوي الأرصدة،
+# فيُبنى مرة لكل نسخة من بيانات المندوبين لا مع كل توصيلة
+@st.cache_resource(max_entries=2)
+def build_driver_search(version):
+    with metrics.timer("index_build_seconds", index="search"):
+        return DriverSearch(get_store().frame("drivers"), version)
+
+def get_driver_search():
+    return build_driver_search(get_store().profile_version())
+
+# 🆕 دالة البحث (من فهرس المندوبين)
+@metrics.timed("operation_seconds", operation="search_driver")
+def search_driver(search_term):
+    # البحث باستخدام driver_id أو whatsapp، ثم بالبحث المقترح إذا كانت نتيجته مندوباً واحداً فقط
+    row = get_driver_index().find(search_term.strip() if search_term else search_term)
+    if row is None and search_term:
+        matches = get_driver_search().search(search_term, limit=2)
+        if len(matches) == 1:
+            row = get_driver_index().get(matches[0])
+    metrics.inc("search_total", result="found" if row else "not_found")
+    if row:
+        return {"driver_id": row['driver_id'], "name": row['name'], "balance": float(row['balance']), "is_active": bool(row['is_active'])}
+    return None
+
+# 🆕 البحث المقترح أثناء الكتابة: المندوبون المطابقون مرتبين (الترقيم، الواتساب، اللوحة، الاسم، الاسم التقريبي)
+@metrics.timed("operation_seconds", operation="suggest_drivers")
+def suggest_drivers(search_term, limit=SEARCH_LIMIT):
+    index = get_driver_index()
+    rows = [index.get(driver_id) for driver_id in get_driver_search().search(search_term or "", limit)]
+    return [
+        {"driver_id": row['driver_id'], "name": row['name'], "bike_plate": row['bike_plate'], "whatsapp": normalize_whatsapp(row['whatsapp']),
+         "balance": float(row['balance']), "is_active": bool(row['is_active'])}
+        for row in rows if row
+    ]
+
+# 🆕 دالة جلب معلومات المندوب (من فهرس المندوبين)
+def get_driver_info(driver_id):
+    row = get_driver_index().get(driver_id)
+    if row:
+        return {"name": row['name'], "balance": float(row['balance']), "is_active": bool(row['is_active'])} 
+    return None
+
+# 🆕 دالة تحديث الرصيد (عبر الكاتب الوحيد للأرصدة)
+# تعيد (النتيجة، الرصيد): applied مع الرصيد الجديد، أو rejected مع الرصيد الحالي إذا رُفض الخصم
+# لعدم كفاية رصيده الفعلي، أو inactive إذا رُفض لأن الحساب معطل، أو not_found مع None إذا لم يوجد المندوب
+@metrics.timed("operation_seconds", operation="update_balance")
+# op_key مفتاح منع التكرار: إعادة الطلب بنفس المفتاح (ضغطة مزدوجة) تعيد نفس النتيجة دون خصم ثانٍ
+def update_balance(driver_id, amount, trans_type, op_key=None):
+    # خصم التوصيلة يُرفض إذا لم يكفِ الرصيد الفعلي أو كان الحساب معطلاً لحظة التطبيق (لا المعروض)
+    is_delivery = trans_type == "خصم توصيلة"
+    [(balance, _, result)] = get_writer().apply(
+        [(driver_id, amount, trans_type, is_delivery, is_delivery)], op_key=op_key)
+    metrics.inc("balance_updates_total", type=trans_type, result=result)
+    return result, balance
+
+# 🆕 دالة تسجيل دفعة توصيلات (تحقق واحد لكل الأسطر ثم كتابة واحدة في السجل)
+@metrics.timed("operation_seconds", operation="record_delivery_batch")
+def record_delivery_batch(batch_text, op_key=None):
+    batch_df = parse_delivery_batch(batch_text)
+    accepted, rejected = validate_delivery_batch(batch_df, get_sheet_data("drivers"), DEDUCTION_AMOUNT)
+    if accepted.empty:
+        return accepted, rejected
+    
+    # كل توصيلة حركة مستقلة في السجل (حتى يبقى عدد التوصيلات صحيحاً)
+    changes = [
+        (driver_id, -DEDUCTION_AMOUNT, "خصم توصيلة", True, True)
+        for driver_id, count in zip(accepted['driver_id'], accepted['count'])
+        for _ in range(count)
+    ]
+    results = get_writer().apply(changes, op_key=op_key)
+    return settle_delivery_batch(accepted, rejected, results, DEDUCTION_AMOUNT)
+
+# 🆕 دالة قراءة ملف استيراد المندوبين والتحقق منه (دون كتابة): تعيد (المقبول، المرفوض)
+def check_driver_import(file_name, data):
+    import_df = parse_driver_import(read_driver_file(file_name, data))
+    return validate_driver_import(import_df, get_sheet_data("drivers"))
+
+# 🆕 دالة إضافة مجموعة مندوبين مقبولين (كتابة واحدة في المخزن ثم طلب إلحاق واحد في Sheet)
+# تعيد False إذا أُضيف أحد الترقيمات بعد التحقق (ولا يُضاف أي مندوب عندها)
+@metrics.timed("operation_seconds", operation="import_drivers")
+def import_drivers(accepted):
+    rows = accepted.to_dict("records")
+    try:
+        get_store().insert_drivers(rows)
+    except sqlite3.IntegrityError:
+        return False
+    get_mirror().append("drivers", rows)
+    metrics.inc("drivers_imported_total", len(rows))
+    return True
+
+# 🆕 دالة حفظ التعديل الجماعي {driver_id: {العمود: القيمة}} (كتابة واحدة، والخلايا تُجمع في طلب واحد للـ Sheet)
+# تعيد ترقيمات المندوبين الذين عُدّلوا فعلاً
+@metrics.timed("operation_seconds", operation="update_drivers_bulk")
+def update_drivers_bulk(updates):
+    updated = get_store().update_drivers(updates)
+    mirror = get_mirror()
+    for driver_id in updated:
+        mirror.update_driver(driver_id, [col for col in updates[driver_id] if col in EDITABLE_DRIVER_COLUMNS])
+    return updated
+
+# 🆕 دالة جلب عدد التوصيلات (تجميع حسب عمود driver_id في المخزن المحلي)
+def get_deliveries_count_per_driver():
+    deliveries_count = get_store().deliveries_per_driver('خصم توصيلة')
+    return deliveries_count.rename(columns={'count': 'عدد التوصيلات'})
+
+# 🆕 دالة جلب الإجماليات (من المجاميع المحفوظة التي تُحدّث مع كل حركة)
+def get_totals():
+    store = get_store()
+    ledger_totals = store.ledger_totals()
+    
+    total_balance = store.total_balance()
+    
+    total_charged, _ = ledger_totals.get('شحن رصيد', (0.0, 0))
+    
+    total_deducted_negative, total_deliveries = ledger_totals.get('خصم توصيلة', (0.0, 0))
+    total_deducted = abs(total_deducted_negative)
+    
+    return total_balance, total_charged, total_deducted, total_deliveries
+
+# 🆕 تحليلات التوصيل حسب الزمن (من جداول التجميع الزمني التي تُحدّث مع كل حركة، لا من السجل)
+ANALYTICS_FREQUENCIES = {"h": "h", "D": "D", "W": "W-MON"}  # دقة السلسلة: ساعة، يوم، أسبوع (يبدأ الاثنين)
+ACTIVITY_COLUMNS = ['عدد التوصيلات', 'المبالغ المخصومة', 'المبالغ المشحونة', 'عدد عمليات الشحن']
+
+def get_activity_series(start=None, end=None, freq="D"):
+    rows = get_store().hourly_rollups(start, end)
+    if rows.empty:
+        return pd.DataFrame(columns=ACTIVITY_COLUMNS)
+    deliveries = rows['type'] == 'خصم توصيلة'
+    charges = rows['type'] == 'شحن رصيد'
+    hours = pd.to_datetime(rows['hour'], format='%Y-%m-%d %H', errors='coerce')
+    bucket = hours.dt.to_period(freq).dt.start_time
+    series = pd.DataFrame({
+        'عدد التوصيلات': rows['count'].where(deliveries, 0),
+        'المبالغ المخصومة': rows['total'].where(deliveries, 0.0).abs(),
+        'المبالغ المشحونة': rows['total'].where(charges, 0.0),
+        'عدد عمليات الشحن': rows['count'].where(charges, 0),
+    }).groupby(bucket).sum()
+    # الفترات الخالية من الحركات تظهر أصفاراً في الرسم بدلاً من أن تختفي
+    full_range = pd.date_range(series.index.min(), series.index.max(), freq=ANALYTICS_FREQUENCIES[freq])
+    return series.reindex(full_range, fill_value=0).rename_axis('الفترة')
+
+def get_driver_activity(start=None, end=None):
+    rows = get_store().driver_rollups(start, end)
+    columns = ['الترقيم', 'الاسم', 'عدد التوصيلات', 'المبالغ المخصومة', 'المبالغ المشحونة', 'أيام النشاط']
+    if rows.empty:
+        return pd.DataFrame(columns=columns)
+    deliveries = rows[rows['type'] == 'خصم توصيلة'].set_index('driver_id')
+    charges = rows[rows['type'] == 'شحن رصيد'].set_index('driver_id')
+    activity = pd.DataFrame(index=pd.Index(rows['driver_id'].unique(), name='driver_id'))
+    activity['عدد التوصيلات'] = deliveries['count'].reindex(activity.index, fill_value=0)
+    activity['المبالغ المخصومة'] = deliveries['total'].abs().reindex(activity.index, fill_value=0.0)
+    activity['المبالغ المشحونة'] = charges['total'].reindex(activity.index, fill_value=0.0)
+    activity['أيام النشاط'] = deliveries['days'].reindex(activity.index, fill_value=0)
+    activity = activity.reset_index()
+    names = get_sheet_data("drivers")[['driver_id', 'name']].astype(object)
+    activity = activity.merge(names, on='driver_id', how='left')
+    activity = activity.rename(columns={'driver_id': 'الترقيم', 'name': 'الاسم'})
+    return activity[columns].sort_values(['عدد التوصيلات', 'المبالغ المشحونة'], ascending=False, ignore_index=True)
+
+# 🆕 دالة مطابقة أرصدة المندوبين مع سجل الحركات (من آخر لقطة أرصدة، أو من السجل كله)
+@metrics.timed("operation_seconds", operation="reconcile_balances")
+def get_reconciliation(full=False):
+    mismatches, summary = get_store().reconcile_balances(use_snapshot=not full)
+    mismatches['status'] = mismatches['status'].map({'mismatch': 'فرق في الرصيد', 'unknown_driver': 'مندوب غير موجود'})
+    return mismatches.rename(columns={
+        'driver_id': 'الترقيم',
+        'name': 'الاسم',
+        'balance': 'الرصيد المسجل',
+        'ledger_balance': 'الرصيد حسب السجل',
+        'difference': 'الفرق',
+        'status': 'الحالة'
+    }), summary
+
+# 🆕 أرشفة الفترات المغلقة: تُنقل حركاتها من الورقة الحالية إلى ورقة أرشيف لكل فترة،
+# وتبقى الإجماليات وعدد التوصيلات صحيحة من ملخص الفترات دون قراءة الأرشيف
+@metrics.timed("operation_seconds", operation="archive_closed_periods")
+def archive_closed_periods():
+    store = get_store()
+    loaded = store.archive_periods().set_index('period')['loaded']
+    archived = {}
+    for period in store.archivable_periods():
+        if period in loaded.index and not loaded[period]:
+            # حركات متأخرة لفترة أُرشفت سابقاً: ورقة أرشيفها تُعاد كتابتها كاملة، فتُحمّل أولاً
+            load_archived_period(period)
+        archived[period] = store.archive_period(period)
+        get_mirror().archive(period)
+    return archived
+
+# 🆕 دالة تحميل حركات فترة مؤرشفة من ورقتها (لعرضها في السجل وتصديرها)
+def load_archived_period(period):
+    return sheets_sync.load_archive(get_store(), get_client(), period)
+
+HISTORY_COLUMNS = {
+    'driver_name': 'المندوب', 
+    'amount': 'المبلغ', 
+    'type': 'العملية', 
+    'timestamp': 'التوقيت'
+}
+EXPORT_COLUMNS = {**HISTORY_COLUMNS, 'driver_id': 'الترقيم'}
+
+# 🆕 دالة جلب صفحة واحدة من السجل (الأحدث أولاً، عبر فهرس التوقيت أو المندوب)
+def get_history_page(driver_id=None, start=None, end=None, page=1, page_size=HISTORY_PAGE_SIZE):
+    df, total = get_store().history_page(driver_id, start, end, page, page_size)
+    df_history = df.drop(columns=['driver_id']).rename(columns=HISTORY_COLUMNS)
+    if driver_id:
+        df_history = df_history.drop(columns=['المندوب'])
+    return df_history, total
+
+# 🆕 لوحة المندوب (الرصيد والحالة وعدد التوصيلات وآخر الحركات) من ملخص يُحدّث مع كل حركة:
+# صفحة المندوب لا تمر بالسجل ولا بفهرس المندوبين (الذي يُعاد بناؤه مع كل تغيير في الأرصدة)
+def get_driver_dashboard(driver_id):
+    dashboard = get_store().driver_dashboard(driver_id)
+    if dashboard is None:
+        return None
+    recent = pd.DataFrame(list(dashboard['recent']), columns=['amount', 'type', 'timestamp']).rename(columns=HISTORY_COLUMNS)
+    return {
+        "name": dashboard['name'],
+        "balance": dashboard['balance'],
+        "is_active": dashboard['is_active'],
+        "deliveries": dashboard['counts'].get('خصم توصيلة', 0),
+        "recent": recent,
+    }
+
+# 🆕 دالة جلب السجل (تقرأ من المخزن المحلي)
+def get_history(driver_id=None):
+    if driver_id:
+        # حركات المندوب فقط عبر فهرس driver_id (مرتبة مسبقاً، الأحدث أولاً)
+        transactions_df = get_store().read_driver_transactions(driver_id)
+    else:
+        transactions_df = get_sheet_data("transactions")
+    if transactions_df.empty:
+         return pd.DataFrame(columns=['المندوب', 'العملية', 'المبلغ', 'التوقيت'])
+         
+    if not driver_id:
+        # الإطار المضغوط: المبالغ بأجزاء المئة والتوقيت datetime64 (الترتيب زمني لا نصي)
+        transactions_df = transactions_df.assign(amount=schema.from_minor(transactions_df['amount_minor']))
+        transactions_df = transactions_df[list(HISTORY_COLUMNS) + ['driver_id']]
+    
+    # تنظيف الأعمدة
+    df_history = transactions_df.drop(columns=['driver_id']).rename(columns=HISTORY_COLUMNS)
+    
+    if driver_id:
+        # إزالة عمود المندوب في حالة التصفية
+        return df_history.drop(columns=['المندوب'])
+        
+    return df_history.sort_values(by='التوقيت', ascending=False)
+
+# 🆕 دالة جلب تفاصيل الكل (تقرأ من المخزن المحلي)
+def get_all_drivers_details():
+    df = get_sheet_data("drivers").copy() # نسخة خاصة لأن الإطار المخزن مشترك
+    if df.empty: return pd.DataFrame()
+    df['balance'] = schema.from_minor(df.pop('balance_minor'))
+    
+    deliveries_count_df = get_deliveries_count_per_driver()
+    
+    if not deliveries_count_df.empty:
+        df = pd.merge(df, deliveries_count_df, on='driver_id', how='left').fillna({'عدد التوصيلات': 0})
+        df['عدد التوصيلات'] = df['عدد التوصيلات'].astype(int)
+    else:
+        df['عدد التوصيلات'] = 0
+        
+    df['الحالة'] = df['is_active'].apply(lambda x: 'مفعل' if x == True else 'معطل')
+    
+    df.rename(columns={
+        'driver_id': 'الترقيم',
+        'name': 'الاسم',
+        'bike_plate': 'رقم اللوحة',
+        'whatsapp': 'واتساب',
+        'balance': 'الرصيد',
+        'notes': 'ملاحظات'
+    }, inplace=True)
+    
+    df.insert(0, 'ت', range(1, 1 + len(df)))
+    
+    cols = ['ت', 'الترقيم', 'الاسم', 'رقم اللوحة', 'واتساب', 'الرصيد', 'عدد التوصيلات', 'الحالة', 'ملاحظات']
+    return df[cols]
@@ -0,0 +1,198 @@
+import re
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+# --- إعدادات الفهرس ---
+COUNTRY_CODE = "222"  # رمز موريتانيا الدولي (يُحذف من بداية أرقام الواتساب)
+LOCAL_NUMBER_LENGTH = 8  # طول الرقم المحلي بدون رمز الدولة
+SEARCH_LIMIT = 10  # أقصى عدد لنتائج البحث المقترحة
+FUZZY_MIN_SHARED = 0.5  # أدنى نسبة من ثلاثيات البحث يجب أن توجد في الاسم لقبوله في البحث التقريبي
+# -----------------------------
+
+# 🆕 توحيد الكتابة العربية للبحث: حذف التشكيل والتطويل، وتوحيد أشكال الألف والياء والتاء المربوطة،
+# وتحويل الأرقام العربية والفارسية إلى أرقام لاتينية
+_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_LETTERS = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه",
+    **{chr(0x0660 + d): str(d) for d in range(10)},
+    **{chr(0x06F0 + d): str(d) for d in range(10)},
+})
+_SEPARATORS = re.compile(r"[\s\-_.,/()]+")
+
+
+def normalize_text(value):
+    """يوحد نصاً للبحث: أحرف صغيرة، بدون تشكيل، ومسافة واحدة بين الكلمات."""
+    if value is None or value != value:
+        return ""
+    text = _DIACRITICS.sub("", str(value)).translate(_LETTERS).lower()
+    return _SEPARATORS.sub(" ", text).strip()
+
+
+def normalize_series(values):
+    """النسخة الموجهة من normalize_text لعمود كامل (القيم الفارغة نص فارغ)."""
+    text = values.astype("string").fillna("")
+    text = text.str.replace(_DIACRITICS, "", regex=True).str.translate(_LETTERS).str.lower()
+    return text.str.replace(_SEPARATORS, " ", regex=True).str.strip()
+
+
+def _sorted_keys(keys):
+    return sorted((key, pos) for pos, key in enumerate(keys) if key)
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def normalize_whatsapp(value):
+    """يوحد رقم الواتساب: أرقام فقط، بدون الكسر العشري أو رمز الدولة."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if value != value:
+            return ""
+        value = int(value)
+    digits = re.sub(r"\D", "", re.sub(r"\.0+$", "", str(value).strip().translate(_LETTERS)))
+    for prefix in ("00" + COUNTRY_CODE, COUNTRY_CODE):
+        if digits.startswith(prefix) and len(digits) > LOCAL_NUMBER_LENGTH:
+            digits = digits[len(prefix):]
+            break
+    return digits
+
+
+class DriverIndex:
+    """فهرس في الذاكرة للمندوبين بالترقيم ورقم الواتساب (بحث في O(1)).
+
+    يُبنى مرة واحدة لكل نسخة من بيانات drivers ويُشارك بين كل الجلسات.
+    """
+
+    def __init__(self, drivers_df, version=None):
+        self.version = version
+        self._by_id = {}
+        self._by_whatsapp = {}
+        for driver in drivers_df.to_dict('records'):
+            driver_id = str(driver['driver_id'])
+            self._by_id.setdefault(driver_id, driver)
+            whatsapp = normalize_whatsapp(driver.get('whatsapp'))
+            if whatsapp:
+                # عند تكرار الرقم نحتفظ بأول مندوب (نفس ترتيب الورقة)
+                self._by_whatsapp.setdefault(whatsapp, driver)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, driver_id):
+        return str(driver_id) in self._by_id
+
+    def get(self, driver_id):
+        """يعيد سجل المندوب بالترقيم أو None."""
+        if driver_id is None:
+            return None
+        return self._by_id.get(str(driver_id).strip())
+
+    def find(self, search_term):
+        """يبحث بالترقيم أولاً ثم برقم الواتساب، ويعيد سجل المندوب أو None."""
+        if not search_term:
+            return None
+        driver = self.get(search_term)
+        if driver is None:
+            driver = self._by_whatsapp.get(normalize_whatsapp(search_term))
+        return driver
+
+    def whatsapp_owner(self, whatsapp):
+        """يعيد ترقيم المندوب المسجل بهذا الرقم أو None."""
+        driver = self._by_whatsapp.get(normalize_whatsapp(whatsapp))
+        return driver['driver_id'] if driver else None
+
+
+class DriverSearch:
+    """فهرس البحث المقترح: بداية الترقيم واللوحة وكلمات الاسم، ونهاية رقم الواتساب،
+    وثلاثيات أحرف الأسماء للبحث التقريبي. يعيد ترقيمات المندوبين مرتبة.
+
+    لا يحتوي على الأرصدة، فيُبنى مرة لكل نسخة من بيانات المندوبين (profile_version) فقط.
+    """
+
+    def __init__(self, drivers_df, version=None):
+        self.version = version
+        drivers_df = drivers_df[~drivers_df['driver_id'].astype(str).duplicated()]
+        self._ids = drivers_df['driver_id'].astype(str).tolist()  # الموضع = ترتيب المندوب في الورقة
+        names = normalize_series(drivers_df['name']).tolist()
+        self._prefixes = {  # [(المفتاح، الموضع)] مرتبة للبحث بالبداية
+            "id": _sorted_keys(normalize_series(drivers_df['driver_id']).str.replace(" ", "")),
+            "plate": _sorted_keys(normalize_series(drivers_df['bike_plate']).str.replace(" ", "")),
+            # نهاية الرقم = بداية الرقم المعكوس
+            "whatsapp": _sorted_keys(normalize_whatsapp(w)[::-1] for w in drivers_df['whatsapp'].tolist()),
+            # كل كلمة من الاسم وما بعدها: "محمد ولد" تطابق "سيدي محمد ولد أحمد"
+            "name": sorted(
+                (" ".join(words[i:]), pos)
+                for pos, words in enumerate(name.split() for name in names)
+                for i in range(len(words))
+            ),
+        }
+        self._build_trigrams(names)
+
+    def _build_trigrams(self, names):
+        """{ثلاثية: مصفوفة مواضع الأسماء التي تحتويها} وعدد ثلاثيات كل اسم."""
+        grams = pd.Series([sorted(_trigrams(name)) if name else [] for name in names], dtype=object)
+        self._gram_counts = grams.str.len().to_numpy(dtype=np.int32)
+        pairs = grams.explode().dropna()
+        codes, uniques = pd.factorize(pairs.to_numpy())
+        order = np.argsort(codes, kind='stable')
+        positions = pairs.index.to_numpy(dtype=np.int32)[order]
+        bounds = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+        self._grams = dict(zip(uniques, np.split(positions, bounds)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def search(self, search_term, limit=SEARCH_LIMIT):
+        """يعيد ترقيمات المندوبين المطابقين مرتبة: بداية الترقيم، ثم نهاية الواتساب، ثم بداية اللوحة،
+        ثم بداية كلمة من الاسم، ثم الأسماء القريبة. المطابقة التامة تأتي أولاً في كل مجموعة."""
+        text = normalize_text(search_term)
+        if not text or limit <= 0:
+            return []
+        compact = text.replace(" ", "")
+        found = {}  # {الموضع: None} بترتيب الإضافة
+        self._collect("id", compact, found, limit)
+        if compact.isdigit():
+            self._collect("whatsapp", normalize_whatsapp(compact)[::-1], found, limit)
+        self._collect("plate", compact, found, limit)
+        self._collect("name", text, found, limit)
+        if len(found) < limit and len(compact) >= 3:
+            self._collect_fuzzy(text, found, limit)
+        return [self._ids[pos] for pos in found]
+
+    def _collect(self, kind, prefix, found, limit):
+        """يضيف المواضع التي يبدأ مفتاحها بـ prefix (الأقصر ثم الأبجدي أولاً) حتى limit."""
+        keys = self._prefixes[kind]
+        matches = []
+        for i in range(bisect_left(keys, (prefix, -1)), len(keys)):
+            key, pos = keys[i]
+            if not key.startswith(prefix) or len(found) + len(matches) >= limit * 4:
+                break
+            matches.append((len(key), key, pos))
+        for _, _, pos in sorted(matches):
+            if len(found) >= limit:
+                return
+            found.setdefault(pos, None)
+
+    def _collect_fuzzy(self, text, found, limit):
+        """يضيف الأسماء الأقرب حسب ثلاثيات الأحرف المشتركة (يتحمل خطأ حرف أو حرفين)."""
+        query = _trigrams(text)
+        postings = [self._grams[g] for g in query if g in self._grams]
+        if not postings:
+            return
+        shared = np.bincount(np.concatenate(postings), minlength=len(self._ids))
+        # القبول بنسبة ثلاثيات البحث الموجودة في الاسم، والترتيب بالتشابه (يفضل الأسماء الأقصر)
+        similarity = shared / (len(query) + self._gram_counts - shared)
+        similarity[shared < FUZZY_MIN_SHARED * len(query)] = 0
+        if found:
+            similarity[list(found)] = 0
+        count = min(limit - len(found), int(np.count_nonzero(similarity)))
+        if count <= 0:
+            return
+        best = np.argpartition(-similarity, count - 1)[:count]
+        for pos in sorted(best.tolist(), key=lambda p: (-similarity[p], p)):
+            found[pos] = None
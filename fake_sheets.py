@@ -0,0 +1,305 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from multiprocessing.managers import BaseManager
+
+import pandas as pd
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_to_rowcol
+
+from ledger_store import DRIVER_COLUMNS, TRANSACTION_COLUMNS
+
+# 🆕 بديل في الذاكرة لـ GSheetsConnection لأدوات القياس واختبار الحمل (لا يتصل بـ Google)
+
+# --- إعدادات البديل ---
+DEFAULT_LATENCY = 0.0  # ثواني تأخير ثابتة لكل طلب (لمحاكاة زمن الشبكة)
+# -----------------------------
+
+
+class SheetsStats:
+    """عدادات الطلبات والبيانات المنقولة (آمنة بين الخيوط)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.reads = 0
+            self.writes = 0
+            self.bytes_read = 0
+            self.bytes_written = 0
+
+    def record(self, kind, nbytes):
+        with self._lock:
+            if kind == "read":
+                self.reads += 1
+                self.bytes_read += nbytes
+            else:
+                self.writes += 1
+                self.bytes_written += nbytes
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "reads": self.reads,
+                "writes": self.writes,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+
+
+class FakeGSheetsConnection:
+    """يحاكي واجهة GSheetsConnection المستخدمة في التطبيق (read و update والكتابة الجزئية).
+
+    latency: تأخير ثابت لكل طلب؛ bandwidth: بايت/ثانية اختياري يضاف تأخيره حسب حجم البيانات.
+    """
+
+    def __init__(self, sheets=None, latency=DEFAULT_LATENCY, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = SheetsStats()
+        self._lock = threading.RLock()
+        self._sheets = {}
+        for name, df in (sheets or {}).items():
+            self._store_frame(name, df)
+
+    # --- واجهة GSheetsConnection ---
+
+    def read(self, spreadsheet=None, worksheet=None, ttl=None, **options):
+        with self._lock:
+            sheet = self._sheet(worksheet)
+            df = pd.DataFrame([list(r) for r in sheet["rows"]], columns=sheet["header"])
+        self._transfer("read", len(df.to_csv(index=False).encode("utf-8")))
+        return df
+
+    def update(self, spreadsheet=None, worksheet=None, data=None, **options):
+        with self._lock:
+            self._sheet(worksheet)
+        self._transfer("write", len(data.to_csv(index=False).encode("utf-8")))
+        with self._lock:
+            self._store_frame(worksheet, data)
+        return data
+
+    @property
+    def client(self):
+        return self
+
+    def _select_worksheet(self, spreadsheet=None, worksheet=None, folder_id=None):
+        with self._lock:
+            self._sheet(worksheet)
+        return FakeWorksheet(self, worksheet)
+
+    def _open_spreadsheet(self, spreadsheet=None, folder_id=None):
+        return self
+
+    def values_batch_get(self, ranges, params=None):
+        """قراءة عدة أوراق في طلب واحد (مثل Spreadsheet.values_batch_get)."""
+        value_ranges = []
+        with self._lock:
+            for name in ranges:
+                title = name.strip("'").replace("''", "'")
+                sheet = self._sheet(title)
+                value_ranges.append({"range": name, "values": [list(sheet["header"])] + [list(r) for r in sheet["rows"]]})
+        self._transfer("read", len(json.dumps(value_ranges, ensure_ascii=False, default=str).encode("utf-8")))
+        return {"valueRanges": value_ranges}
+
+    def add_worksheet(self, title, rows=0, cols=0, **options):
+        self._transfer("write", 0)
+        with self._lock:
+            self._sheets.setdefault(title, {"header": [], "rows": []})
+        return FakeWorksheet(self, title)
+
+    # --- أدوات مساعدة ---
+
+    def frame(self, sheet_name):
+        """محتوى الورقة كما هو في البديل (دون احتساب طلب)."""
+        with self._lock:
+            sheet = self._sheet(sheet_name)
+            return pd.DataFrame([list(r) for r in sheet["rows"]], columns=sheet["header"])
+
+    @property
+    def worksheets(self):
+        with self._lock:
+            return list(self._sheets)
+
+    def _sheet(self, name):
+        """الورقة بالاسم، أو WorksheetNotFound مثل gspread."""
+        try:
+            return self._sheets[name]
+        except KeyError:
+            raise WorksheetNotFound(name) from None
+
+    def _store_frame(self, name, df):
+        self._sheets[name] = {
+            "header": [str(c) for c in df.columns],
+            "rows": [[_plain(v) for v in row] for row in df.itertuples(index=False, name=None)],
+        }
+
+    def _transfer(self, kind, nbytes):
+        self.stats.record(kind, nbytes)
+        delay = self.latency + (nbytes / self.bandwidth if self.bandwidth else 0.0)
+        if delay:
+            time.sleep(delay)
+
+
+class FakeWorksheet:
+    """يحاكي دوال gspread.Worksheet المستخدمة في الكتابة الجزئية."""
+
+    def __init__(self, conn, name):
+        self._conn = conn
+        self._name = name
+
+    def append_rows(self, values, value_input_option=None, **options):
+        self._conn._transfer("write", len(json.dumps(values, ensure_ascii=False, default=str).encode("utf-8")))
+        with self._conn._lock:
+            sheet = self._conn._sheet(self._name)
+            first_row = len(sheet["rows"]) + 2
+            sheet["rows"].extend(list(v) for v in values)
+        last_row = first_row + len(values) - 1
+        return {"updates": {"updatedRange": f"{self._name}!A{first_row}:Z{last_row}"}}
+
+    def batch_update(self, data, value_input_option=None, **options):
+        self._conn._transfer("write", len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")))
+        with self._conn._lock:
+            sheet = self._conn._sheet(self._name)
+            for item in data:
+                row, col = a1_to_rowcol(item["range"])
+                value = item["values"][0][0]
+                if row == 1:
+                    while len(sheet["header"]) < col:
+                        sheet["header"].append("")
+                    sheet["header"][col - 1] = value
+                    continue
+                while len(sheet["rows"]) < row - 1:
+                    sheet["rows"].append([None] * len(sheet["header"]))
+                target = sheet["rows"][row - 2]
+                while len(target) < col:
+                    target.append(None)
+                target[col - 1] = value
+
+
+class SheetsServer(FakeGSheetsConnection):
+    """البديل نفسه بدوال مسطحة تُستدعى من عمليات أخرى عبر SheetsManager (نسخة واحدة لكل العمليات)."""
+
+    def check_worksheet(self, worksheet):
+        with self._lock:
+            self._sheet(worksheet)
+
+    def add_sheet(self, title, rows=0, cols=0):
+        self.add_worksheet(title, rows, cols)
+
+    def append_rows_to(self, worksheet, values, **options):
+        return FakeWorksheet(self, worksheet).append_rows(values, **options)
+
+    def batch_update_in(self, worksheet, data, **options):
+        return FakeWorksheet(self, worksheet).batch_update(data, **options)
+
+    def stats_snapshot(self):
+        return self.stats.snapshot()
+
+    def reset_stats(self):
+        self.stats.reset()
+
+
+class SheetsManager(BaseManager):
+    """يشغّل SheetsServer في عملية مستقلة؛ كل طلب يُخدم في خيط، فتأخير الطلبات المتزامنة لا يتراكم."""
+
+
+SheetsManager.register("Sheets", SheetsServer, exposed=[
+    "read", "update", "values_batch_get", "frame", "check_worksheet", "add_sheet",
+    "append_rows_to", "batch_update_in", "stats_snapshot", "reset_stats",
+])
+
+
+class RemoteGSheetsConnection:
+    """واجهة GSheetsConnection نفسها فوق SheetsServer مشترك (وكيل من SheetsManager)."""
+
+    def __init__(self, remote):
+        self.remote = remote
+
+    def read(self, spreadsheet=None, worksheet=None, ttl=None, **options):
+        return self.remote.read(worksheet=worksheet)
+
+    def update(self, spreadsheet=None, worksheet=None, data=None, **options):
+        return self.remote.update(worksheet=worksheet, data=data)
+
+    @property
+    def client(self):
+        return self
+
+    def _select_worksheet(self, spreadsheet=None, worksheet=None, folder_id=None):
+        self.remote.check_worksheet(worksheet)
+        return RemoteWorksheet(self.remote, worksheet)
+
+    def _open_spreadsheet(self, spreadsheet=None, folder_id=None):
+        return self
+
+    def values_batch_get(self, ranges, params=None):
+        return self.remote.values_batch_get(ranges, params)
+
+    def add_worksheet(self, title, rows=0, cols=0, **options):
+        self.remote.add_sheet(title, rows, cols)
+        return RemoteWorksheet(self.remote, title)
+
+    def frame(self, sheet_name):
+        return self.remote.frame(sheet_name)
+
+
+class RemoteWorksheet:
+    """يحاكي دوال gspread.Worksheet فوق SheetsServer مشترك."""
+
+    def __init__(self, remote, name):
+        self._remote = remote
+        self._name = name
+
+    def append_rows(self, values, value_input_option=None, **options):
+        return self._remote.append_rows_to(self._name, values, value_input_option=value_input_option)
+
+    def batch_update(self, data, value_input_option=None, **options):
+        return self._remote.batch_update_in(self._name, data, value_input_option=value_input_option)
+
+
+def synthetic_sheets(n_drivers, n_transactions, seed=0, start=None):
+    """يولّد ورقتي drivers و transactions متسقتين (الرصيد = مجموع حركات المندوب)."""
+    rng = random.Random(seed)
+    start = start or datetime(2024, 1, 1)
+    drivers = pd.DataFrame({
+        "driver_id": [f"J{i:05d}" for i in range(1, n_drivers + 1)],
+        "name": [f"مندوب {i}" for i in range(1, n_drivers + 1)],
+        "bike_plate": [f"{rng.randint(1000, 9999)}AB{rng.randint(0, 99):02d}" for _ in range(n_drivers)],
+        "whatsapp": [str(rng.randint(20000000, 49999999)) for _ in range(n_drivers)],
+        "notes": "",
+        "is_active": [rng.random() > 0.05 for _ in range(n_drivers)],
+        "balance": 0.0,
+    })[DRIVER_COLUMNS]
+
+    balances = dict.fromkeys(drivers["driver_id"], 0.0)
+    names = dict(zip(drivers["driver_id"], drivers["name"]))
+    step = timedelta(days=365) / max(n_transactions, 1)
+    rows = []
+    for i in range(n_transactions):
+        driver_id = rng.choice(drivers["driver_id"].values)
+        if balances[driver_id] < 15.0:
+            amount, trans_type = float(rng.choice([50, 100, 200, 500])), "شحن رصيد"
+        else:
+            amount, trans_type = -15.0, "خصم توصيلة"
+        balances[driver_id] += amount
+        rows.append({
+            "driver_name": f"{names[driver_id]} (ID:{driver_id})",
+            "amount": amount,
+            "type": trans_type,
+            "timestamp": (start + step * i).strftime("%Y-%m-%d %H:%M:%S"),
+            "driver_id": driver_id,
+        })
+    drivers["balance"] = drivers["driver_id"].map(balances)
+    transactions = pd.DataFrame(rows, columns=TRANSACTION_COLUMNS)
+    return {"drivers": drivers, "transactions": transactions}
+
+
+def _plain(value):
+    if hasattr(value, "item"):
+        return value.item()
+    return value
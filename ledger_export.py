@@ -0,0 +1,78 @@
+import gzip
+import tempfile
+
+# --- إعدادات التصدير ---
+EXPORT_CHUNK_ROWS = 20000  # عدد الصفوف المقروءة والمكتوبة في كل دفعة
+# -----------------------------
+
+# الصيغة: (الاسم المعروض، نوع MIME، امتداد الملف)
+EXPORT_FORMATS = {
+    "csv": ("CSV", "text/csv", "csv"),
+    "csv.gz": ("CSV مضغوط (gzip)", "application/gzip", "csv.gz"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet", "parquet"),
+}
+
+
+def available_formats():
+    """صيغ التصدير المتاحة (Parquet يتطلب مكتبة pyarrow)."""
+    formats = ["csv", "csv.gz"]
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return formats
+    return formats + ["parquet"]
+
+
+def export_transactions(store, fmt, driver_id=None, start=None, end=None, columns=None):
+    """يولّد ملف تصدير للسجل دفعة بعد دفعة في ملف مؤقت على القرص، ويعيد محتواه (bytes).
+
+    Streamlit يحمّل الملف كاملاً في الذاكرة قبل إرساله ولا يقبل إلا bytes أو BytesIO أو ملفاً
+    للقراءة فقط، فالملف المؤقت يُقرأ مرة واحدة في النهاية (نسخة واحدة من الملف في الذاكرة).
+    columns: قاموس اختياري لإعادة تسمية الأعمدة في الملف.
+    """
+    with tempfile.TemporaryFile() as out:
+        _export(store, fmt, out, driver_id, start, end, columns)
+        out.seek(0)
+        return out.read()
+
+
+def _export(store, fmt, out, driver_id, start, end, columns):
+    chunks = store.iter_transactions(driver_id, start, end, EXPORT_CHUNK_ROWS)
+    if columns:
+        chunks = (chunk.rename(columns=columns) for chunk in chunks)
+
+    if fmt == "parquet":
+        _write_parquet(chunks, out)
+    elif fmt == "csv.gz":
+        with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+            _write_csv(chunks, gz)
+    else:
+        _write_csv(chunks, out)
+
+
+def _write_csv(chunks, out):
+    first = True
+    for chunk in chunks:
+        out.write(chunk.to_csv(index=False, header=first).encode("utf-8"))
+        first = False
+
+
+def _write_parquet(chunks, out):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                # المبالغ أرقام وباقي الأعمدة نصوص، حتى لا يختلف المخطط بين الدفعات
+                schema = pa.schema([
+                    (col, pa.float64() if chunk[col].dtype.kind == "f" else pa.string())
+                    for col in chunk.columns
+                ])
+                writer = pq.ParquetWriter(out, schema, compression="zstd")
+            chunk = chunk.astype({f.name: "string" for f in schema if f.type == pa.string()})
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
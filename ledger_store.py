@@ -0,0 +1,1494 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import metrics
+import schema
+
+# --- إعدادات المخزن المحلي ---
+DB_PATH = os.environ.get("JAK_DB_PATH", "delivery_app.db")  # ملف SQLite المحلي (يمكن تغييره بمتغير بيئة)
+HISTORY_PAGE_SIZE = 50  # عدد الحركات في صفحة السجل الواحدة
+DASHBOARD_RECENT = 10  # عدد آخر الحركات المحفوظة في لوحة كل مندوب
+SNAPSHOT_EVERY = 5000  # عدد الحركات الجديدة التي تُحفظ بعدها لقطة أرصدة جديدة
+SNAPSHOTS_KEPT = 3  # عدد لقطات الأرصدة المحتفظ بها
+RECONCILE_TOLERANCE = 0.005  # فرق الرصيد الذي يُعتبر تطابقاً (تقريب الكسور العشرية)
+SYNCHRONOUS = "FULL"  # كل معاملة تُكتب على القرص (fsync) قبل تأكيدها
+JOURNAL_RETENTION_DAYS = 7  # مدة بقاء العمليات المنسوخة في دفتر اليومية (نافذة رفض المفاتيح المكررة)
+# عدة عمليات من التطبيق (خلف موزع حمل على نفس الجهاز) تتشارك ملف SQLite نفسه: JAK_SHARED_CACHE=1
+SHARED_CACHE = os.environ.get("JAK_SHARED_CACHE", "0") == "1"
+BUSY_TIMEOUT = 30.0  # ثواني انتظار انتهاء كتابة عملية أخرى على الملف
+WRITER_TTL = 120.0  # ثواني بعد آخر كتابة أو نسخ تُعتبر بعدها العملية متوقفة (تُتبنى عملياتها المعلقة)
+
+# تقسيم السجل حسب الفترة: M شهر، Q ربع سنة، Y سنة
+PARTITION_PERIOD = os.environ.get("JAK_PARTITION_PERIOD", "M")
+ARCHIVE_KEEP_PERIODS = 1  # عدد الفترات المغلقة التي تبقى في الورقة الحالية مع الفترة الجارية
+ARCHIVE_SHEET_PREFIX = "transactions_"  # ورقة أرشيف لكل فترة، مثل transactions_2025-11
+SUMMARY_SHEET = "period_summaries"  # ملخص الفترات المؤرشفة (يكفي للإجماليات دون قراءة الأرشيف)
+SUMMARY_COLUMNS = ['period', 'driver_id', 'type', 'total', 'count']
+
+DRIVER_COLUMNS = ['driver_id', 'name', 'bike_plate', 'whatsapp', 'notes', 'is_active', 'balance']
+TRANSACTION_COLUMNS = ['driver_name', 'amount', 'type', 'timestamp', 'driver_id']
+SHEET_COLUMNS = {"drivers": DRIVER_COLUMNS, "transactions": TRANSACTION_COLUMNS}
+
+# استخراج الترقيم من الصيغة القديمة "الاسم (ID:J0001)" أو "الاسم (J0001)"
+DRIVER_ID_PATTERN = r'\((?:ID:)?\s*([^()]+?)\s*\)\s*$'
+# -----------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drivers
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  driver_id TEXT UNIQUE,
+                  name TEXT,
+                  bike_plate TEXT,
+                  whatsapp TEXT,
+                  notes TEXT,
+                  is_active BOOLEAN,
+                  balance REAL,
+                  sheet_row INTEGER);
+CREATE TABLE IF NOT EXISTS transactions
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  driver_name TEXT,
+                  amount REAL,
+                  type TEXT,
+                  timestamp TEXT,
+                  driver_id TEXT);
+CREATE TABLE IF NOT EXISTS meta
+                 (key TEXT PRIMARY KEY,
+                  value TEXT);
+CREATE TABLE IF NOT EXISTS ledger_totals
+                 (type TEXT PRIMARY KEY,
+                  total REAL NOT NULL DEFAULT 0,
+                  count INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS driver_totals
+                 (driver_id TEXT NOT NULL,
+                  type TEXT NOT NULL,
+                  total REAL NOT NULL DEFAULT 0,
+                  count INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (driver_id, type));
+CREATE TABLE IF NOT EXISTS balance_snapshots
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  created_at TEXT,
+                  last_transaction_id INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS snapshot_balances
+                 (snapshot_id INTEGER NOT NULL,
+                  driver_id TEXT NOT NULL,
+                  balance REAL NOT NULL,
+                  count INTEGER NOT NULL,
+                  PRIMARY KEY (snapshot_id, driver_id));
+CREATE TABLE IF NOT EXISTS archived_transactions
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  driver_name TEXT,
+                  amount REAL,
+                  type TEXT,
+                  timestamp TEXT,
+                  driver_id TEXT,
+                  period TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS period_summaries
+                 (period TEXT NOT NULL,
+                  driver_id TEXT NOT NULL DEFAULT '',
+                  type TEXT NOT NULL DEFAULT '',
+                  total REAL NOT NULL DEFAULT 0,
+                  count INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (period, driver_id, type));
+CREATE TABLE IF NOT EXISTS hourly_rollups
+                 (hour TEXT NOT NULL,
+                  type TEXT NOT NULL DEFAULT '',
+                  total REAL NOT NULL DEFAULT 0,
+                  count INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (hour, type));
+CREATE TABLE IF NOT EXISTS daily_driver_rollups
+                 (day TEXT NOT NULL,
+                  driver_id TEXT NOT NULL,
+                  type TEXT NOT NULL DEFAULT '',
+                  total REAL NOT NULL DEFAULT 0,
+                  count INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (day, driver_id, type));
+CREATE TABLE IF NOT EXISTS archive_periods
+                 (period TEXT PRIMARY KEY,
+                  rows INTEGER NOT NULL DEFAULT 0,
+                  archived_at TEXT,
+                  synced BOOLEAN NOT NULL DEFAULT 0,
+                  loaded BOOLEAN NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS journal
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  op_key TEXT UNIQUE,
+                  created_at TEXT NOT NULL,
+                  results TEXT NOT NULL,
+                  rows TEXT NOT NULL,
+                  sent BOOLEAN NOT NULL DEFAULT 0,
+                  synced BOOLEAN NOT NULL DEFAULT 0,
+                  owner TEXT);
+CREATE TABLE IF NOT EXISTS shared_versions
+                 (name TEXT PRIMARY KEY,
+                  version INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS leases
+                 (name TEXT PRIMARY KEY,
+                  owner TEXT NOT NULL,
+                  expires_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS sync_backlog
+                 (owner TEXT PRIMARY KEY,
+                  written INTEGER NOT NULL DEFAULT 0,
+                  mirrored INTEGER NOT NULL DEFAULT 0,
+                  reports INTEGER NOT NULL DEFAULT 0,
+                  expires_at REAL NOT NULL);
+"""
+
+# أعمدة أُضيفت بعد إنشاء ملف delivery_app.db الأصلي
+MIGRATIONS = {
+    "drivers": {"sheet_row": "INTEGER"},
+    "transactions": {"driver_id": "TEXT"},
+    "journal": {"owner": "TEXT"},
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_transactions_driver ON transactions (driver_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp);
+CREATE INDEX IF NOT EXISTS idx_archived_driver ON archived_transactions (driver_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_archived_timestamp ON archived_transactions (timestamp);
+CREATE INDEX IF NOT EXISTS idx_archived_period ON archived_transactions (period);
+CREATE INDEX IF NOT EXISTS idx_journal_synced ON journal (synced, seq);
+"""
+
+
+def period_of(timestamps, freq=None):
+    """يعيد فترة كل توقيت كنص (مثل 2025-11)، و None للتوقيت غير الصالح."""
+    parsed = pd.to_datetime(pd.Series(timestamps, dtype=object), errors='coerce')
+    periods = parsed.dt.to_period(freq or PARTITION_PERIOD).astype(str)
+    return periods.where(parsed.notna(), None)
+
+
+def archive_sheet_name(period):
+    return f"{ARCHIVE_SHEET_PREFIX}{period}"
+
+
+def empty_sheet(sheet_name):
+    """يعيد DataFrame فارغاً بأعمدة الورقة الصحيحة."""
+    return pd.DataFrame(columns=SHEET_COLUMNS[sheet_name])
+
+
+def normalize_sheet(sheet_name, df):
+    """ينظف بيانات ورقة قادمة من Google Sheets ويحول أنواعها الأساسية."""
+    if df is None or df.empty:
+        return empty_sheet(sheet_name)
+
+    # حذف الأعمدة والصفوف الفارغة التي تضيفها Google Sheets أحياناً
+    df = df.loc[:, [c for c in df.columns if not str(c).startswith('Unnamed')]]
+    data_columns = [c for c in df.columns if c != 'sheet_row']
+    df = df.dropna(how='all', subset=data_columns).reset_index(drop=True)
+    for col in SHEET_COLUMNS[sheet_name]:
+        if col not in df.columns:
+            df[col] = None
+
+    if sheet_name == "transactions":
+        # ترحيل الصفوف القديمة التي لا تحمل عمود driver_id
+        extracted = df['driver_name'].astype(str).str.extract(DRIVER_ID_PATTERN, expand=False)
+        df['driver_id'] = df['driver_id'].where(df['driver_id'].notna(), extracted)
+    if 'driver_id' in df.columns:
+        df['driver_id'] = df['driver_id'].where(df['driver_id'].isna(), df['driver_id'].astype(str))
+    if sheet_name == "drivers":
+        # ترقيم مكرر في الورقة: يُعتمد أول صف له كما كان البحث يفعل (duplicate_driver_ids للتنبيه)
+        repeated = df['driver_id'].notna() & df['driver_id'].duplicated()
+        df = df[~repeated].reset_index(drop=True)
+    if 'is_active' in df.columns:
+        df['is_active'] = df['is_active'].astype(bool)
+    if 'balance' in df.columns:
+        # محاولة تحويل الرصيد إلى رقم، واستبدال الأخطاء بصفر
+        df['balance'] = pd.to_numeric(df['balance'], errors='coerce').fillna(0.0)
+    if 'amount' in df.columns:
+        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
+
+    return df
+
+
+def duplicate_driver_ids(df):
+    """الترقيمات المكررة في ورقة drivers كما قُرئت (تُحذف صفوفها عدا الأول عند التحميل)."""
+    if df is None or 'driver_id' not in df.columns:
+        return []
+    ids = df['driver_id'].dropna().astype(str)
+    return sorted(ids[ids.duplicated()].unique())
+
+
+class LedgerStore:
+    """مخزن محلي (SQLite) لورقتي drivers و transactions تُخدم منه كل القراءات.
+
+    shared: الملف مشترك بين عدة عمليات. كل كتابة تنشر أرقام نسخ الأوراق في جدول shared_versions
+    ضمن معاملتها، وكل عملية تُسقط إطاراتها المخزنة لما تغير منها عند القراءة التالية، فتقرأ كل
+    العمليات نفس البيانات.
+    """
+
+    def __init__(self, db_path=DB_PATH, shared=SHARED_CACHE):
+        self.db_path = db_path
+        self.shared = shared
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"  # معرّف هذه العملية في الجداول المشتركة
+        self._lock = threading.RLock()
+        self._versions = {name: 0 for name in SHEET_COLUMNS}
+        self._profile_version = 0  # مثل نسخة drivers لكن لا تتغير مع الأرصدة
+        self._frames = {}  # {اسم الورقة: (رقم النسخة، DataFrame)}
+        self._dashboards = {}  # {driver_id: لوحة المندوب} تُعدّل مع كل حركة وتُسقط عند استبدال الجداول
+        self._shared_seen = {}  # {الورقة أو profile: آخر نسخة مشتركة معروفة لهذه العملية}
+        self._data_version = None  # PRAGMA data_version عند آخر مزامنة (يتغير بكتابة اتصال آخر فقط)
+        self._writes = 0  # عدد الكتابات التي تنتظر نسخها إلى Sheets منذ التشغيل
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+            self._conn.executescript(SCHEMA)
+            if shared:
+                # عمليتان تبدآن معاً: واحدة فقط تضيف الأعمدة وتبني المجاميع
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._migrate()
+            self._conn.commit()
+            self._sync_shared()
+
+    def _migrate(self):
+        """يضيف الأعمدة الجديدة إلى ملف قاعدة بيانات قديم."""
+        for table, columns in MIGRATIONS.items():
+            existing = {r['name'] for r in self._conn.execute(f"PRAGMA table_info({table})")}
+            for col, col_type in columns.items():
+                if col not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+        # أمر أمر (executescript ينهي المعاملة الجارية)
+        for statement in filter(str.strip, INDEXES.split(";")):
+            self._conn.execute(statement)
+        self._backfill_transaction_driver_ids()
+        if self.get_meta('aggregates_built') is None:
+            self._rebuild_aggregates()
+        if self.get_meta('rollups_built') is None:
+            self._rebuild_rollups()
+
+    def _backfill_transaction_driver_ids(self):
+        """ترحيل لمرة واحدة: يملأ driver_id للحركات القديمة من نص driver_name."""
+        pattern = re.compile(DRIVER_ID_PATTERN)
+        rows = self._conn.execute(
+            "SELECT id, driver_name FROM transactions WHERE driver_id IS NULL AND driver_name IS NOT NULL"
+        ).fetchall()
+        updates = []
+        for row in rows:
+            match = pattern.search(row['driver_name'])
+            if match:
+                updates.append((match.group(1), row['id']))
+        self._conn.executemany("UPDATE transactions SET driver_id = ? WHERE id = ?", updates)
+
+    # --- نسخ البيانات ---
+
+    def data_version(self, sheet_name):
+        """رقم يزداد مع كل تعديل على الجدول (يُستخدم لمفاتيح الذاكرة المؤقتة والفهارس)."""
+        with self._lock:
+            self._sync_shared()
+            return self._versions[sheet_name]
+
+    def profile_version(self):
+        """مثل data_version("drivers") لكن لا يتغير مع الأرصدة (يُستخدم لفهرس البحث)."""
+        with self._lock:
+            self._sync_shared()
+            return self._profile_version
+
+    def _bump(self, *names):
+        """يغيّر نسخة الأوراق (أو "profile") بعد كتابة، وينشرها للعمليات الأخرى ضمن نفس المعاملة."""
+        for name in names:
+            self._advance(name)
+            if self.shared:
+                self._conn.execute(
+                    "INSERT INTO shared_versions (name, version) VALUES (?, 1) "
+                    "ON CONFLICT (name) DO UPDATE SET version = version + 1",
+                    (name,),
+                )
+                self._shared_seen[name] = self._shared_seen.get(name, 0) + 1
+
+    def _advance(self, name):
+        if name == "profile":
+            self._profile_version += 1
+        else:
+            self._versions[name] += 1
+
+    def _sync_shared(self):
+        """يغيّر النسخة المحلية لكل ورقة عدّلتها عملية أخرى، فيُعاد بناء إطارها من الملف عند قراءته.
+
+        data_version لا يتغير إلا إذا كتب اتصال آخر، فالفحص في الحالة المعتادة طلب واحد رخيص.
+        """
+        if not self.shared:
+            return
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        for row in self._conn.execute("SELECT name, version FROM shared_versions").fetchall():
+            if self._shared_seen.get(row['name']) != row['version']:
+                self._shared_seen[row['name']] = row['version']
+                self._advance(row['name'])
+                if row['name'] in SHEET_COLUMNS:
+                    # لا يُعرف أي المندوبين تغيرت حركاتهم في العملية الأخرى
+                    self._dashboards.clear()
+                metrics.inc("shared_invalidations_total", sheet=row['name'])
+
+    @contextmanager
+    def _transaction(self):
+        """معاملة كتابة تحت قفل المخزن.
+
+        في الملف المشترك تحجز الكتابة من أول المعاملة (BEGIN IMMEDIATE)، حتى لا تقرأ عمليتان
+        نفس الرصيد ثم تكتب كل منهما فوق الأخرى، وتُزامن النسخ قبل تعديل الإطارات المخزنة.
+        """
+        with self._lock, self._conn:
+            if self.shared and not self._conn.in_transaction:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._sync_shared()
+            try:
+                yield
+            except BaseException:
+                # اللوحات عُدّلت قبل التراجع عن المعاملة
+                self._dashboards.clear()
+                raise
+
+    def _patch_frame(self, sheet_name, patch):
+        """يطبق تعديلاً معروفاً على النسخة المخزنة من الورقة بدلاً من إسقاطها.
+
+        يُستدعى قبل _bump: يُنتج إطاراً جديداً (النسخ عند الكتابة) للنسخة التالية،
+        فلا يتأثر من يقرأ الإطار القديم. إذا كانت النسخة المخزنة قديمة تُترك لتُقرأ من جديد.
+        """
+        cached = self._frames.get(sheet_name)
+        if cached is None or cached[0] != self._versions[sheet_name]:
+            return
+        self._frames[sheet_name] = (cached[0] + 1, patch(cached[1]))
+
+    # --- حالة المزامنة ---
+
+    def get_meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def hydrated(self):
+        """هل سبق تحميل نسخة كاملة من Google Sheets إلى هذا الملف؟"""
+        return self.get_meta('hydrated_at') is not None
+
+    # --- التحميل من Google Sheets ---
+
+    def replace_sheet(self, sheet_name, df):
+        """يستبدل محتوى جدول محلي بالكامل بمحتوى ورقة (يُستخدم عند التحميل الأولي)."""
+        prepared = self._sheet_rows(sheet_name, df)
+        with self._transaction():
+            self._replace_rows(sheet_name, *prepared)
+            self._record_duplicates({sheet_name: df})
+
+    def replace_sheets(self, frames, expected_versions=None):
+        """يستبدل عدة جداول من أوراقها دفعة واحدة (معاملة واحدة)، ويتخطى ما لم يتغير محتواه.
+
+        expected_versions: {الورقة: رقم النسخة قبل بدء القراءة}؛ إذا تغيرت نسخة أي منها
+        (كتابة محلية أثناء القراءة) لا يُستبدل شيء ويُعاد None. وإلا تُعاد أسماء الجداول المستبدلة.
+        """
+        versions = expected_versions or {name: self._versions[name] for name in frames}
+        prepared = {name: self._sheet_rows(name, df) for name, df in frames.items()}
+        # المقارنة خارج القفل (اتصال قراءة مستقل)، فلا تنتظرها الكتابات
+        changed = [name for name, rows in prepared.items() if not self._same_rows(name, *rows)]
+        with self._transaction():
+            if any(self._versions[n] != v for n, v in versions.items()):
+                return None
+            for name in changed:
+                self._replace_rows(name, *prepared[name])
+            self._record_duplicates(frames)
+        return changed
+
+    def _record_duplicates(self, frames):
+        if "drivers" in frames:
+            ids = duplicate_driver_ids(frames["drivers"])
+            self._set_meta('duplicate_driver_ids', json.dumps(ids, ensure_ascii=False))
+
+    @property
+    def duplicate_driver_ids(self):
+        """الترقيمات المكررة في آخر نسخة محملة من ورقة drivers."""
+        return json.loads(self.get_meta('duplicate_driver_ids', '[]'))
+
+    def _sheet_rows(self, sheet_name, df):
+        """يحول ورقة إلى (العناوين، الأعمدة، الصفوف) جاهزة للإدراج في الجدول المحلي."""
+        header = sheet_header_of(df)
+        if sheet_name == "drivers" and df is not None:
+            # رقم الصف في الورقة (الصف 1 للعناوين): قارئا الأوراق يحذفان الصفوف الفارغة ويبقيان
+            # موضع كل صف في الفهرس، فالصف الواقع بعد صف فارغ يأخذ رقمه الفعلي لا ترتيبه في الإطار
+            df = df.assign(sheet_row=df.index + 2)
+        df = normalize_sheet(sheet_name, df)
+        if sheet_name == "transactions":
+            # فترات أُرشفت محلياً ولم تُنسخ بعد: صفوفها في الورقة الحالية موجودة في الأرشيف المحلي
+            pending = self.archive_periods(synced=False)['period'].tolist()
+            if pending:
+                df = df[~period_of(df['timestamp']).isin(pending).values].reset_index(drop=True)
+        columns = SHEET_COLUMNS[sheet_name] + (['sheet_row'] if sheet_name == "drivers" else [])
+        if 'sheet_row' in columns and 'sheet_row' not in df.columns:
+            df['sheet_row'] = None
+        rows = [tuple(_to_sql(v) for v in r) for r in df[columns].itertuples(index=False, name=None)]
+        return header, columns, rows
+
+    def _replace_rows(self, sheet_name, header, columns, rows):
+        placeholders = ", ".join("?" for _ in columns)
+        self._conn.execute(f"DELETE FROM {sheet_name}")
+        self._conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (sheet_name,))
+        self._conn.executemany(
+            f"INSERT INTO {sheet_name} ({', '.join(columns)}) VALUES ({placeholders})", rows
+        )
+        self._set_sheet_header(sheet_name, header)
+        self._dashboards.clear()
+        if sheet_name == "transactions":
+            self._rebuild_aggregates()
+            # أرقام الحركات تبدأ من جديد، فلا تصلح اللقطات السابقة للإعادة الجزئية
+            self._clear_balance_snapshots()
+        else:
+            self._bump("profile")
+        self._bump(sheet_name)
+
+    def _same_rows(self, sheet_name, header, columns, rows):
+        """هل يطابق الجدول المحلي صفوف الورقة (مع تكرارها)؟
+
+        تُقارن في جدول مؤقت بنفس أنواع الأعمدة عبر اتصال قراءة مستقل (لا يحجز المخزن).
+        """
+        if header != self.sheet_header(sheet_name):
+            return False
+        cols = ", ".join(columns)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            if conn.execute(f"SELECT COUNT(*) FROM {sheet_name}").fetchone()[0] != len(rows):
+                return False
+            conn.execute(f"CREATE TEMP TABLE incoming AS SELECT {cols} FROM {sheet_name} WHERE 0")
+            conn.executemany(f"INSERT INTO temp.incoming VALUES ({', '.join('?' for _ in columns)})", rows)
+            differs = conn.execute(
+                f"SELECT 1 FROM (SELECT {cols}, COUNT(*) FROM main.{sheet_name} GROUP BY {cols} "
+                f"EXCEPT SELECT {cols}, COUNT(*) FROM temp.incoming GROUP BY {cols}) LIMIT 1"
+            ).fetchone()
+        finally:
+            conn.close()
+        return differs is None
+
+    def mark_hydrated(self):
+        with self._transaction():
+            self._set_meta('hydrated_at', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    # --- تخطيط الأوراق في Google Sheets ---
+
+    def sheet_header(self, sheet_name):
+        """ترتيب أعمدة الورقة كما هو في Google Sheets (أو None إذا كانت الورقة بلا عناوين)."""
+        value = self.get_meta(f'header:{sheet_name}')
+        return json.loads(value) if value else None
+
+    def _set_sheet_header(self, sheet_name, header):
+        if header:
+            self._set_meta(f'header:{sheet_name}', json.dumps(header, ensure_ascii=False))
+        else:
+            self._conn.execute("DELETE FROM meta WHERE key = ?", (f'header:{sheet_name}',))
+
+    def set_sheet_header(self, sheet_name, header):
+        with self._transaction():
+            self._set_sheet_header(sheet_name, header)
+
+    def driver_sheet_rows(self, driver_ids):
+        """يعيد {driver_id: (رقم الصف في الورقة، قيم الأعمدة)} للمندوبين المطلوبين."""
+        ids = list(driver_ids)
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT sheet_row, {', '.join(DRIVER_COLUMNS)} FROM drivers "
+                f"WHERE driver_id IN ({', '.join('?' for _ in ids)})",
+                ids,
+            ).fetchall()
+        return {r['driver_id']: (r['sheet_row'], _driver_dict(r)) for r in rows}
+
+    def reset_driver_sheet_rows(self):
+        """يعيد ترقيم صفوف المندوبين بعد إعادة كتابة الورقة كاملة بترتيب المخزن."""
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE drivers SET sheet_row = (SELECT COUNT(*) FROM drivers AS d WHERE d.id <= drivers.id) + 1"
+            )
+
+    def set_driver_sheet_row(self, driver_id, sheet_row):
+        with self._transaction():
+            self._conn.execute("UPDATE drivers SET sheet_row = ? WHERE driver_id = ?", (sheet_row, driver_id))
+
+    # --- القراءة ---
+
+    def frame(self, sheet_name):
+        """يعيد إطار الورقة المخزن للنسخة الحالية (مشترك بين الجلسات، للقراءة فقط).
+
+        الإطار بالأنواع المضغوطة في schema.py (مبالغ بأجزاء المئة، توقيت datetime64، أعمدة فئوية).
+        """
+        with self._lock:
+            self._sync_shared()
+            version = self._versions[sheet_name]
+            cached = self._frames.get(sheet_name)
+            if cached is not None and cached[0] == version:
+                metrics.inc("frame_cache_total", sheet=sheet_name, result="hit")
+                return cached[1]
+            metrics.inc("frame_cache_total", sheet=sheet_name, result="miss")
+            with metrics.timer("frame_build_seconds", sheet=sheet_name):
+                df = schema.typed(sheet_name, self.read_sheet(sheet_name))
+            self._frames[sheet_name] = (version, df)
+            return df
+
+    def read_sheet(self, sheet_name):
+        """يعيد محتوى الجدول المحلي بنفس ترتيب وأعمدة الورقة."""
+        columns = SHEET_COLUMNS[sheet_name]
+        with self._lock:
+            df = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {sheet_name} ORDER BY id", self._conn)
+        if df.empty:
+            return empty_sheet(sheet_name)
+        if sheet_name == "drivers":
+            df['is_active'] = df['is_active'].astype(bool)
+            df['balance'] = df['balance'].fillna(0.0)
+        else:
+            df['amount'] = df['amount'].fillna(0.0)
+        return df
+
+    def read_driver_transactions(self, driver_id):
+        """يعيد حركات مندوب واحد (الأحدث أولاً، مع المحمّل من الأرشيف) عبر فهرس driver_id."""
+        columns = ', '.join(TRANSACTION_COLUMNS)
+        with self._lock:
+            df = pd.read_sql_query(
+                f"SELECT {columns}, id FROM transactions WHERE driver_id = ? "
+                f"UNION ALL SELECT {columns}, id FROM archived_transactions WHERE driver_id = ? "
+                "ORDER BY timestamp DESC, id DESC",
+                self._conn,
+                params=(driver_id, driver_id),
+            ).drop(columns=['id'])
+        if df.empty:
+            return empty_sheet("transactions")
+        df['amount'] = df['amount'].fillna(0.0)
+        return df
+
+    def history_page(self, driver_id=None, start=None, end=None, page=1, page_size=HISTORY_PAGE_SIZE):
+        """يعيد صفحة واحدة من السجل (الأحدث أولاً) وعدد الحركات المطابقة للتصفية.
+
+        start و end تواريخ (datetime.date) شاملة؛ القراءة تمر بفهرس التوقيت أو فهرس
+        المندوب، فلا يُحمّل إلا صفوف الصفحة المعروضة.
+        """
+        conditions, params = _history_filter(driver_id, start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        offset = max(page - 1, 0) * page_size
+        with self._lock:
+            if conditions:
+                hot_total = self._conn.execute(f"SELECT COUNT(*) FROM transactions {where}", params).fetchone()[0]
+                archive_total = self._conn.execute(
+                    f"SELECT COUNT(*) FROM archived_transactions {where}", params
+                ).fetchone()[0]
+            else:
+                # بدون تصفية: العدد من المجاميع المحفوظة دون عدّ السجل
+                hot_total = self._conn.execute(
+                    "SELECT (SELECT COALESCE(SUM(count), 0) FROM ledger_totals)"
+                    " - (SELECT COALESCE(SUM(count), 0) FROM period_summaries)"
+                ).fetchone()[0]
+                archive_total = self._conn.execute(
+                    "SELECT COALESCE(SUM(rows), 0) FROM archive_periods WHERE loaded"
+                ).fetchone()[0]
+            # الفترات المؤرشفة أقدم من الحالية، فتأتي صفحاتها بعد صفحات الجدول الحالي
+            frames = []
+            if offset < hot_total:
+                frames.append(self._select_transactions("transactions", where, params, page_size, offset))
+            remaining = page_size - sum(len(f) for f in frames)
+            if remaining > 0 and archive_total:
+                frames.append(self._select_transactions(
+                    "archived_transactions", where, params, remaining, max(offset - hot_total, 0)
+                ))
+        total = hot_total + archive_total
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return empty_sheet("transactions"), total
+        df = pd.concat(frames, ignore_index=True)
+        df['amount'] = df['amount'].fillna(0.0)
+        return df, total
+
+    def _select_transactions(self, table, where, params, limit, offset):
+        return pd.read_sql_query(
+            f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM {table} {where} "
+            "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+            self._conn,
+            params=params + [limit, offset],
+        )
+
+    def iter_transactions(self, driver_id=None, start=None, end=None, chunk_size=10000):
+        """يولّد السجل (الأحدث أولاً، ثم المحمّل من الأرشيف) على دفعات من DataFrame دون تحميله كاملاً.
+
+        يستخدم اتصالاً مستقلاً للقراءة (لقطة ثابتة في وضع WAL) حتى لا يوقف الكتابة أثناء التصدير.
+        """
+        conditions, params = _history_filter(driver_id, start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("BEGIN")  # لقطة واحدة للجدولين
+            for table in ("transactions", "archived_transactions"):
+                yield from pd.read_sql_query(
+                    f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM {table} {where} "
+                    "ORDER BY timestamp DESC, id DESC",
+                    conn,
+                    params=params,
+                    chunksize=chunk_size,
+                )
+        finally:
+            conn.close()
+
+    def deliveries_per_driver(self, delivery_type):
+        """يعيد عدد الحركات من نوع معين لكل مندوب (من المجاميع المحفوظة)."""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT driver_id, count FROM driver_totals WHERE type = ? AND count > 0",
+                self._conn,
+                params=(delivery_type,),
+            )
+
+    def ledger_totals(self):
+        """يعيد {نوع العملية: (المجموع، العدد)} من المجاميع المحفوظة دون المرور بالسجل."""
+        with self._lock:
+            rows = self._conn.execute("SELECT type, total, count FROM ledger_totals").fetchall()
+        return {r['type']: (r['total'], r['count']) for r in rows}
+
+    def total_balance(self):
+        with self._lock:
+            return self._conn.execute("SELECT ROUND(COALESCE(SUM(balance), 0), 2) FROM drivers").fetchone()[0]
+
+    def get_driver(self, driver_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(DRIVER_COLUMNS)} FROM drivers WHERE driver_id = ?", (driver_id,)
+            ).fetchone()
+        return _driver_dict(row) if row else None
+
+    def driver_dashboard(self, driver_id):
+        """لوحة المندوب: بياناته ورصيده، و counts {نوع العملية: العدد}، و recent آخر DASHBOARD_RECENT حركة.
+
+        تُبنى عند أول طلب للمندوب ثم تُعدّل مع كل حركة له، فلا يمر عرضها بالسجل. يعيد None
+        إذا لم يوجد المندوب. اللوحة مشتركة بين الجلسات فلا تُعدّل.
+        """
+        with self._lock:
+            self._sync_shared()
+            dashboard = self._dashboards.get(driver_id)
+            if dashboard is not None:
+                metrics.inc("dashboard_cache_total", result="hit")
+                return dashboard
+            metrics.inc("dashboard_cache_total", result="miss")
+            driver = self.get_driver(driver_id)
+            if driver is None:
+                return None
+            counts = self._conn.execute(
+                "SELECT type, count FROM driver_totals WHERE driver_id = ?", (driver_id,)
+            ).fetchall()
+            recent = self._conn.execute(
+                "SELECT amount, type, timestamp, id FROM transactions WHERE driver_id = ? "
+                "UNION ALL SELECT amount, type, timestamp, id FROM archived_transactions WHERE driver_id = ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (driver_id, driver_id, DASHBOARD_RECENT),
+            ).fetchall()
+            dashboard = self._dashboards[driver_id] = dict(
+                driver,
+                counts={r['type']: r['count'] for r in counts},
+                recent=tuple({"amount": r['amount'] or 0.0, "type": r['type'], "timestamp": r['timestamp']}
+                             for r in recent),
+            )
+            return dashboard
+
+    def _patch_dashboards(self, balances, transactions):
+        """يضيف حركات جديدة إلى لوحات المندوبين المخزنة (لوحة جديدة لكل مندوب تغير، لا تعديل في مكانها)."""
+        for driver_id, balance in balances.items():
+            dashboard = self._dashboards.get(driver_id)
+            if dashboard is None:
+                continue
+            new = [t for t in reversed(transactions) if t['driver_id'] == driver_id]
+            counts = dict(dashboard['counts'])
+            for t in new:
+                counts[t['type']] = counts.get(t['type'], 0) + 1
+            # الترتيب كما في السجل: الأحدث توقيتاً أولاً، ثم الأحدث إضافة
+            recent = sorted([{c: t[c] for c in ("amount", "type", "timestamp")} for t in new] + list(dashboard['recent']),
+                            key=lambda t: t['timestamp'] or "", reverse=True)
+            self._dashboards[driver_id] = dict(
+                dashboard, balance=balance, counts=counts, recent=tuple(recent[:DASHBOARD_RECENT])
+            )
+
+    # --- الكتابة ---
+
+    def insert_driver(self, driver):
+        """يضيف مندوباً جديداً، ويرفع sqlite3.IntegrityError إذا كان الترقيم مكرراً."""
+        self.insert_drivers([driver])
+
+    def insert_drivers(self, drivers):
+        """يضيف عدة مندوبين في معاملة واحدة؛ إذا تكرر أي ترقيم يُرفع sqlite3.IntegrityError ولا يُضاف أحد."""
+        if not drivers:
+            return
+        with self._transaction():
+            # الصفوف المتوقعة في الورقة: بعد آخر صف معروف (تُصحح بعد الإلحاق الفعلي)
+            next_row = self._conn.execute("SELECT COALESCE(MAX(sheet_row), 1) + 1 FROM drivers").fetchone()[0]
+            self._conn.executemany(
+                f"INSERT INTO drivers ({', '.join(DRIVER_COLUMNS)}, sheet_row) "
+                f"VALUES ({', '.join('?' for _ in DRIVER_COLUMNS)}, ?)",
+                [tuple(_to_sql(d.get(c)) for c in DRIVER_COLUMNS) + (next_row + i,) for i, d in enumerate(drivers)],
+            )
+            new_rows = [{c: d.get(c) for c in DRIVER_COLUMNS} for d in drivers]
+            self._patch_frame("drivers", lambda df: schema.append_rows("drivers", df, new_rows))
+            self._bump("drivers", "profile")
+            self._note_write()
+
+    def update_driver(self, driver_id, fields):
+        """يعدل حقول مندوب موجود، ويعيد False إذا لم يوجد."""
+        return bool(self.update_drivers({driver_id: fields}))
+
+    def update_drivers(self, updates):
+        """يعدل حقول عدة مندوبين {driver_id: {العمود: القيمة}} في معاملة واحدة، ويعيد ترقيمات من وُجد منهم."""
+        if not updates:
+            return []
+        with self._transaction():
+            # الترقيمات تُمرر كنص JSON واحد (التفعيل الجماعي قد يتجاوز حد عدد المعاملات في SQLite)
+            existing = {r['driver_id'] for r in self._conn.execute(
+                "SELECT driver_id FROM drivers WHERE driver_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(updates), ensure_ascii=False),),
+            )}
+            updates = {d: fields for d, fields in updates.items() if d in existing}
+            # طلب واحد لكل مجموعة أعمدة (التفعيل الجماعي يعدل نفس العمود لكل المندوبين)
+            by_columns = {}
+            for driver_id, fields in updates.items():
+                by_columns.setdefault(tuple(fields), []).append(
+                    tuple(_to_sql(v) for v in fields.values()) + (driver_id,)
+                )
+            for columns, params in by_columns.items():
+                self._conn.executemany(
+                    f"UPDATE drivers SET {', '.join(f'{c} = ?' for c in columns)} WHERE driver_id = ?", params
+                )
+            if updates:
+                for driver_id in updates:
+                    self._dashboards.pop(driver_id, None)
+                self._patch_frame("drivers", lambda df: _with_driver_fields(df, updates))
+                self._bump("profile")
+                self._note_write()
+            self._bump("drivers")
+        return list(updates)
+
+    def apply_balance_change(self, driver_id, amount, trans_type, timestamp):
+        """يعدل رصيد المندوب ويسجل الحركة في معاملة واحدة.
+
+        يعيد (الرصيد الجديد، صف الحركة المضاف، applied) أو (None, None, not_found) إذا لم يوجد المندوب.
+        """
+        return self.apply_balance_changes([(driver_id, amount, trans_type, False, False)], timestamp)[0]
+
+    def apply_balance_changes(self, changes, timestamp):
+        """يطبق قائمة حركات [(driver_id، المبلغ، النوع، يتطلب رصيداً كافياً، يتطلب حساباً مفعلاً)]
+        بالترتيب في معاملة واحدة.
+
+        يعيد لكل حركة (الرصيد بعدها، صف الحركة، applied)، أو (الرصيد الحالي، None، rejected) إذا
+        رُفضت لعدم كفاية الرصيد، أو (الرصيد الحالي، None، inactive) إذا رُفضت لأن الحساب معطل،
+        أو (None, None, not_found) إذا لم يوجد المندوب. الرصيد والحالة يُقرآن لحظة التطبيق.
+        """
+        [(results, _)] = self.apply_operations([(None, changes)], timestamp)
+        return results
+
+    def apply_operations(self, operations, timestamp):
+        """يطبق عمليات [(مفتاح العملية، الحركات)] في معاملة واحدة، ويسجل كل عملية في دفتر اليومية.
+
+        المعاملة تُكتب على القرص قبل أن تعود، فالعملية المؤكدة لا تضيع إذا توقف التطبيق قبل نسخها
+        إلى Sheets. العملية التي سبق تطبيق مفتاحها (ضغطة مكررة أو إعادة إرسال) لا تُطبق مرة أخرى
+        وتُعاد نتائجها المحفوظة. يعيد لكل عملية (نتائج حركاتها، رقمها في الدفتر أو None إذا لم
+        تُضف حركات جديدة).
+        """
+        with self._transaction():
+            done = self._journal_results([key for key, _ in operations if key])
+            new = {}  # {موضع العملية: الحركات} للعمليات التي تُطبق الآن
+            for i, (key, changes) in enumerate(operations):
+                if key not in done:
+                    new[i] = list(changes)
+                    if key:
+                        done[key] = None  # المفتاح نفسه مرة أخرى في نفس الدفعة
+            applied = self._apply_changes([c for changes in new.values() for c in changes], timestamp)
+
+            out = []
+            offset = 0
+            for i, (key, _) in enumerate(operations):
+                if i not in new:
+                    metrics.inc("journal_duplicates_total")
+                    out.append((done[key], None))
+                    continue
+                results = applied[offset:offset + len(new[i])]
+                offset += len(new[i])
+                rows = [transaction for _, transaction, _ in results if transaction]
+                cur = self._conn.execute(
+                    "INSERT INTO journal (op_key, created_at, results, rows, sent, synced, owner) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, timestamp, json.dumps(results, ensure_ascii=False), json.dumps(rows, ensure_ascii=False),
+                     int(not rows), int(not rows), self.owner),
+                )
+                if key:
+                    done[key] = results
+                out.append((results, cur.lastrowid if rows else None))
+        return out
+
+    def _apply_changes(self, changes, timestamp):
+        """جسم apply_balance_changes داخل معاملة وقفل المستدعي."""
+        results = []
+        if not changes:
+            return results
+        ids = list(dict.fromkeys(change[0] for change in changes))
+        rows = self._conn.execute(
+            f"SELECT driver_id, name, balance, is_active FROM drivers WHERE driver_id IN ({', '.join('?' for _ in ids)})",
+            ids,
+        ).fetchall()
+        names = {r['driver_id']: r['name'] for r in rows}
+        active = {r['driver_id']: bool(r['is_active']) for r in rows}
+        # الحساب بأعداد صحيحة (أجزاء المئة) حتى لا تتراكم أخطاء الكسور العشرية في الأرصدة
+        balances = {r['driver_id']: schema.to_minor(r['balance'] or 0.0) for r in rows}
+        transactions = []
+        aggregates = {}
+        for driver_id, amount, trans_type, require_funds, require_active in changes:
+            if driver_id not in balances:
+                results.append((None, None, "not_found"))
+                continue
+            amount_minor = schema.to_minor(amount)
+            if require_active and not active[driver_id]:
+                results.append((schema.from_minor(balances[driver_id]), None, "inactive"))
+                continue
+            if require_funds and balances[driver_id] + amount_minor < 0:
+                results.append((schema.from_minor(balances[driver_id]), None, "rejected"))
+                continue
+            balances[driver_id] += amount_minor
+            amount = schema.from_minor(amount_minor)
+            transaction = {
+                "driver_name": f"{names[driver_id]} (ID:{driver_id})",
+                "amount": amount,
+                "type": trans_type,
+                "timestamp": timestamp,
+                "driver_id": driver_id,
+            }
+            transactions.append(transaction)
+            total, count = aggregates.get((driver_id, trans_type), (0, 0))
+            aggregates[(driver_id, trans_type)] = (total + amount_minor, count + 1)
+            results.append((schema.from_minor(balances[driver_id]), transaction, "applied"))
+        if not transactions:
+            return results
+
+        changed = {t["driver_id"]: schema.from_minor(balances[t["driver_id"]]) for t in transactions}
+        self._conn.executemany(
+            "UPDATE drivers SET balance = ? WHERE driver_id = ?",
+            [(balance, driver_id) for driver_id, balance in changed.items()],
+        )
+        self._conn.executemany(
+            f"INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)})",
+            [tuple(t[c] for c in TRANSACTION_COLUMNS) for t in transactions],
+        )
+        for (driver_id, trans_type), (total, count) in aggregates.items():
+            self._add_to_aggregates(driver_id, trans_type, schema.from_minor(total), count)
+            self._add_to_rollups(timestamp, driver_id, trans_type, schema.from_minor(total), count)
+        self._patch_frame("drivers", lambda df: _with_driver_balances(df, changed))
+        self._patch_frame("transactions", lambda df: schema.append_rows("transactions", df, transactions))
+        self._patch_dashboards(changed, transactions)
+        self._bump("drivers", "transactions")
+        self._note_write()
+        return results
+
+    # --- دفتر اليومية (العمليات التي لم تُنسخ بعد إلى Sheets) ---
+
+    def _journal_results(self, keys):
+        """{المفتاح: نتائج العملية} للمفاتيح المسجلة سابقاً في الدفتر."""
+        if not keys:
+            return {}
+        rows = self._conn.execute(
+            f"SELECT op_key, results FROM journal WHERE op_key IN ({', '.join('?' for _ in keys)})", keys
+        ).fetchall()
+        return {r['op_key']: [_journal_result(result) for result in json.loads(r['results'])] for r in rows}
+
+    def pending_journal(self):
+        """العمليات التي لم تصل إلى Sheets بالترتيب: [{seq، sent، rows}].
+
+        sent تعني أن إرسالها بدأ قبل توقف سابق، فقد تكون وصلت دون أن يُسجل ذلك.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, sent, rows FROM journal WHERE synced = 0 ORDER BY seq"
+            ).fetchall()
+        return [{"seq": r['seq'], "sent": bool(r['sent']), "rows": json.loads(r['rows'])} for r in rows]
+
+    def adopt_journal(self):
+        """العمليات المعلقة التي تتولى هذه العملية نسخها الآن (بنفس شكل pending_journal).
+
+        خارج الملف المشترك: كل العمليات المعلقة. في الملف المشترك: عمليات من توقف قبل نسخها فقط
+        (بلا مالك حي)، وتُنقل ملكيتها إلى هذه العملية في نفس المعاملة حتى لا تتبناها عمليتان.
+        """
+        if not self.shared:
+            return self.pending_journal()
+        with self._transaction():
+            seqs = [r['seq'] for r in self._conn.execute(
+                "SELECT seq FROM journal WHERE synced = 0 AND (owner IS NULL OR owner != ? AND owner NOT IN "
+                "(SELECT owner FROM sync_backlog WHERE expires_at > ?)) ORDER BY seq",
+                (self.owner, time.time()),
+            )]
+            self._conn.executemany("UPDATE journal SET owner = ? WHERE seq = ?", [(self.owner, s) for s in seqs])
+            rows = self._conn.execute(
+                f"SELECT seq, sent, rows FROM journal WHERE seq IN ({', '.join('?' for _ in seqs)}) ORDER BY seq", seqs
+            ).fetchall()
+        return [{"seq": r['seq'], "sent": bool(r['sent']), "rows": json.loads(r['rows'])} for r in rows]
+
+    @property
+    def journal_pending(self):
+        """عدد العمليات المؤكدة محلياً التي لم تُنسخ إلى Sheets بعد."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM journal WHERE synced = 0").fetchone()[0]
+
+    def mark_journal_sent(self, seqs):
+        with self._transaction():
+            self._conn.executemany("UPDATE journal SET sent = 1 WHERE seq = ?", [(s,) for s in seqs])
+
+    def mark_journal_synced(self, seqs):
+        """يسجل وصول العمليات إلى Sheets، ويحذف ما تجاوز مدة الاحتفاظ من العمليات المنسوخة."""
+        cutoff = (datetime.now() - timedelta(days=JOURNAL_RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._transaction():
+            self._conn.executemany("UPDATE journal SET sent = 1, synced = 1 WHERE seq = ?", [(s,) for s in seqs])
+            self._conn.execute("DELETE FROM journal WHERE synced = 1 AND created_at < ?", (cutoff,))
+
+    def transaction_counts(self, timestamps):
+        """عدد الحركات المحلية لكل (driver_id، المبلغ، النوع، التوقيت) في هذه التوقيتات."""
+        timestamps = list(dict.fromkeys(timestamps))
+        if not timestamps:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT driver_id, amount, type, timestamp, COUNT(*) AS n FROM transactions "
+                f"WHERE timestamp IN ({', '.join('?' for _ in timestamps)}) GROUP BY driver_id, amount, type, timestamp",
+                timestamps,
+            ).fetchall()
+        return {(r['driver_id'], schema.to_minor(r['amount']), r['type'], r['timestamp']): r['n'] for r in rows}
+
+    # --- التنسيق بين العمليات (الملف المشترك) ---
+
+    @property
+    def writes(self):
+        """عدد كتابات هذه العملية التي تحتاج نسخاً إلى Sheets (يزداد مع كل كتابة)."""
+        return self._writes
+
+    def _note_write(self):
+        """يسجل كتابة تنتظر نسخها إلى Sheets ضمن معاملتها (ليعرف قائد التحديث أن عليه الانتظار)."""
+        self._writes += 1
+        if self.shared:
+            self._conn.execute(
+                "INSERT INTO sync_backlog (owner, written, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (owner) DO UPDATE SET written = excluded.written, expires_at = excluded.expires_at",
+                (self.owner, self._writes, time.time() + WRITER_TTL),
+            )
+
+    def report_mirror(self, mirrored=None):
+        """يسجل نشاط ناسخ هذه العملية: بداية دفعة أو نهايتها، و mirrored آخر كتابة وصلت إلى Sheets.
+
+        كل تسجيل يغيّر عداد reports، فيعرف القائد أن ناسخاً عمل أثناء قراءته من Sheets.
+        """
+        if not self.shared:
+            return
+        with self._transaction():
+            self._conn.execute(
+                "INSERT INTO sync_backlog (owner, mirrored, reports, expires_at) VALUES (?, COALESCE(?, 0), 1, ?) "
+                "ON CONFLICT (owner) DO UPDATE SET mirrored = MAX(mirrored, COALESCE(excluded.mirrored, 0)), "
+                "reports = reports + 1, expires_at = excluded.expires_at",
+                (self.owner, mirrored, time.time() + WRITER_TTL),
+            )
+
+    def foreign_backlog(self):
+        """حالة نسخ العمليات الأخرى الحية {المالك: (الكتابات، المنسوخ منها، عدد التسجيلات)}."""
+        if not self.shared:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT owner, written, mirrored, reports FROM sync_backlog WHERE owner != ? AND expires_at > ?",
+                (self.owner, time.time()),
+            ).fetchall()
+        return {r['owner']: (r['written'], r['mirrored'], r['reports']) for r in rows}
+
+    def acquire_lease(self, name, ttl):
+        """يحجز دوراً لعملية واحدة (أو يجدده) لمدة ttl ثانية، ويعيد True إذا كان لهذه العملية.
+
+        الحجز الذي انتهت مدته (عملية متوقفة) تأخذه أول عملية تطلبه. خارج الملف المشترك: دائماً True.
+        """
+        if not self.shared:
+            return True
+        now = time.time()
+        with self._transaction():
+            self._conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, self.owner, now + ttl, now),
+            )
+            holder = self._conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()['owner']
+        return holder == self.owner
+
+    def lease_holder(self, name):
+        """مالك الحجز الساري، أو None."""
+        if not self.shared:
+            return self.owner
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+            ).fetchone()
+        return row['owner'] if row else None
+
+    # --- المجاميع المحفوظة ---
+
+    def _add_to_aggregates(self, driver_id, trans_type, amount, count=1):
+        """يضيف حركة (أو مجموعة حركات) إلى المجاميع ضمن نفس معاملة الكتابة."""
+        self._conn.execute(
+            "INSERT INTO ledger_totals (type, total, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (type) DO UPDATE SET total = ROUND(total + excluded.total, 2), count = count + excluded.count",
+            (trans_type, amount, count),
+        )
+        if driver_id is not None:
+            self._conn.execute(
+                "INSERT INTO driver_totals (driver_id, type, total, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (driver_id, type) DO UPDATE SET "
+                "total = ROUND(total + excluded.total, 2), count = count + excluded.count",
+                (driver_id, trans_type, amount, count),
+            )
+
+    def _rebuild_aggregates(self):
+        self._dashboards.clear()
+        self._conn.execute("DELETE FROM ledger_totals")
+        self._conn.execute("DELETE FROM driver_totals")
+        # الفترات المؤرشفة من ملخصاتها، والفترات الحالية من السجل
+        self._conn.execute(
+            "INSERT INTO ledger_totals (type, total, count) "
+            "SELECT type, ROUND(SUM(total), 2), SUM(count) FROM ("
+            " SELECT NULLIF(type, '') AS type, total, count FROM period_summaries"
+            " UNION ALL SELECT type, COALESCE(amount, 0), 1 FROM transactions"
+            ") GROUP BY type"
+        )
+        self._conn.execute(
+            "INSERT INTO driver_totals (driver_id, type, total, count) "
+            "SELECT driver_id, type, ROUND(SUM(total), 2), SUM(count) FROM ("
+            " SELECT driver_id, NULLIF(type, '') AS type, total, count FROM period_summaries WHERE driver_id != ''"
+            " UNION ALL SELECT driver_id, type, COALESCE(amount, 0), 1 FROM transactions WHERE driver_id IS NOT NULL"
+            ") GROUP BY driver_id, type"
+        )
+        self._set_meta('aggregates_built', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self._rebuild_rollups()
+
+    def rebuild_aggregates(self):
+        """يعيد حساب كل المجاميع من سجل الحركات بالكامل (عند الطلب)."""
+        with self._transaction():
+            self._rebuild_aggregates()
+
+    # --- التجميع الزمني (لكل ساعة، ولكل مندوب ويوم) ---
+
+    def _add_to_rollups(self, timestamp, driver_id, trans_type, amount, count=1):
+        """يضيف حركات إلى جدولي التجميع الزمني ضمن نفس معاملة الكتابة."""
+        if not timestamp or len(timestamp) < 13:
+            return
+        self._conn.execute(
+            "INSERT INTO hourly_rollups (hour, type, total, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (hour, type) DO UPDATE SET total = ROUND(total + excluded.total, 2), count = count + excluded.count",
+            (timestamp[:13], trans_type or '', amount, count),
+        )
+        if driver_id is not None:
+            self._conn.execute(
+                "INSERT INTO daily_driver_rollups (day, driver_id, type, total, count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, driver_id, type) DO UPDATE SET "
+                "total = ROUND(total + excluded.total, 2), count = count + excluded.count",
+                (timestamp[:10], driver_id, trans_type or '', amount, count),
+            )
+
+    def _rebuild_rollups(self):
+        """يعيد بناء التجميع الزمني من السجل الحالي والأرشيف المحمّل محلياً (الملخصات لا تكفي لتوزيعه زمنياً)."""
+        ledger = (
+            "SELECT timestamp, driver_id, type, amount FROM transactions"
+            " UNION ALL SELECT timestamp, driver_id, type, amount FROM archived_transactions"
+        )
+        self._conn.execute("DELETE FROM hourly_rollups")
+        self._conn.execute("DELETE FROM daily_driver_rollups")
+        self._conn.execute(
+            "INSERT INTO hourly_rollups (hour, type, total, count) "
+            "SELECT substr(timestamp, 1, 13), COALESCE(type, ''), ROUND(SUM(COALESCE(amount, 0)), 2), COUNT(*) "
+            f"FROM ({ledger}) WHERE length(timestamp) >= 13 GROUP BY 1, 2"
+        )
+        self._conn.execute(
+            "INSERT INTO daily_driver_rollups (day, driver_id, type, total, count) "
+            "SELECT substr(timestamp, 1, 10), driver_id, COALESCE(type, ''), ROUND(SUM(COALESCE(amount, 0)), 2), COUNT(*) "
+            f"FROM ({ledger}) WHERE length(timestamp) >= 13 AND driver_id IS NOT NULL GROUP BY 1, 2, 3"
+        )
+        self._set_meta('rollups_built', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    def hourly_rollups(self, start=None, end=None):
+        """مجموع وعدد الحركات لكل ساعة ونوع عملية ضمن الفترة: hour (YYYY-MM-DD HH)، type، total، count."""
+        conditions, params = _range_filter("hour", start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            return pd.read_sql_query(
+                f"SELECT hour, type, total, count FROM hourly_rollups {where} ORDER BY hour", self._conn, params=params
+            )
+
+    def driver_rollups(self, start=None, end=None):
+        """مجموع وعدد الحركات وعدد أيام النشاط لكل مندوب ونوع عملية ضمن الفترة."""
+        conditions, params = _range_filter("day", start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT driver_id, type, ROUND(SUM(total), 2) AS total, SUM(count) AS count, COUNT(DISTINCT day) AS days "
+                f"FROM daily_driver_rollups {where} GROUP BY driver_id, type",
+                self._conn, params=params,
+            )
+
+    # --- مطابقة الأرصدة مع السجل ---
+
+    def latest_balance_snapshot(self):
+        """آخر لقطة أرصدة محفوظة {id، created_at، last_transaction_id} أو None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created_at, last_transaction_id FROM balance_snapshots ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        return dict(row) if row else None
+
+    def reconcile_balances(self, use_snapshot=True):
+        """يقارن رصيد كل مندوب بمجموع حركاته في السجل في تمريرة واحدة.
+
+        مع use_snapshot يبدأ من آخر لقطة ويعيد فقط الحركات التي بعدها، وإلا يمر بالسجل كله.
+        يعيد (جدول الفروقات، ملخص). جدول الفروقات: driver_id، name، balance، ledger_balance،
+        difference، status (mismatch لفرق في الرصيد، unknown_driver لحركات مندوب غير موجود).
+        """
+        with self._transaction():
+            snapshot = self.latest_balance_snapshot() if use_snapshot else None
+            last_id = self._last_transaction_id()
+            ledger, replayed = self._ledger_balances(snapshot)
+            drivers = pd.read_sql_query("SELECT driver_id, name, balance FROM drivers", self._conn)
+            unattributed = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM transactions WHERE driver_id IS NULL)"
+                " + (SELECT COALESCE(SUM(count), 0) FROM period_summaries WHERE driver_id = '')"
+            ).fetchone()[0]
+            if replayed >= SNAPSHOT_EVERY:
+                self._save_balance_snapshot(ledger, last_id)
+
+        report = drivers.merge(ledger, on="driver_id", how="outer", indicator=True)
+        report["balance"] = report["balance"].fillna(0.0)
+        report["ledger_balance"] = report["ledger_balance"].fillna(0.0)
+        report["difference"] = report["balance"] - report["ledger_balance"]
+        report["status"] = "ok"
+        report.loc[report["difference"].abs() > RECONCILE_TOLERANCE, "status"] = "mismatch"
+        report.loc[report["_merge"] == "right_only", "status"] = "unknown_driver"
+        mismatches = report.loc[report["status"] != "ok",
+                                ["driver_id", "name", "balance", "ledger_balance", "difference", "status"]]
+
+        summary = {
+            "mode": "snapshot" if snapshot else "full",
+            "snapshot_id": snapshot["id"] if snapshot else None,
+            "snapshot_at": snapshot["created_at"] if snapshot else None,
+            "replayed": replayed,
+            "drivers": len(drivers),
+            "mismatches": int((report["status"] == "mismatch").sum()),
+            "unknown_drivers": int((report["status"] == "unknown_driver").sum()),
+            "unattributed_transactions": unattributed,
+            "total_difference": float(mismatches["difference"].sum()),
+        }
+        return mismatches.sort_values("difference", key=abs, ascending=False).reset_index(drop=True), summary
+
+    def take_balance_snapshot(self):
+        """يحفظ لقطة بأرصدة السجل الحالية (بناءً على آخر لقطة)، ويعيد رقمها."""
+        with self._transaction():
+            last_id = self._last_transaction_id()
+            ledger, _ = self._ledger_balances(self.latest_balance_snapshot())
+            return self._save_balance_snapshot(ledger, last_id)
+
+    def maybe_take_balance_snapshot(self):
+        """يحفظ لقطة جديدة إذا أُضيفت SNAPSHOT_EVERY حركة أو أكثر منذ آخر لقطة."""
+        snapshot = self.latest_balance_snapshot()
+        since = snapshot["last_transaction_id"] if snapshot else 0
+        if self._last_transaction_id() - since >= SNAPSHOT_EVERY:
+            self.take_balance_snapshot()
+
+    def _last_transaction_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+
+    def _ledger_balances(self, snapshot):
+        """رصيد كل مندوب حسب السجل وعدد الحركات التي أُعيدت لحسابه.
+
+        من اللقطة مضافاً إليها الحركات بعدها، أو من ملخصات الفترات المؤرشفة والسجل الحالي كله.
+        """
+        if snapshot is None:
+            ledger = pd.read_sql_query(
+                "SELECT driver_id, ROUND(SUM(amount), 2) AS ledger_balance, SUM(count) AS count FROM ("
+                " SELECT driver_id, total AS amount, count FROM period_summaries WHERE driver_id != ''"
+                " UNION ALL"
+                " SELECT driver_id, COALESCE(amount, 0), 1 FROM transactions WHERE driver_id IS NOT NULL"
+                ") GROUP BY driver_id",
+                self._conn,
+            )
+            replayed = self._conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+            return ledger, replayed
+        ledger = pd.read_sql_query(
+            "SELECT driver_id, ROUND(SUM(amount), 2) AS ledger_balance, SUM(count) AS count FROM ("
+            " SELECT driver_id, balance AS amount, count FROM snapshot_balances WHERE snapshot_id = ?"
+            " UNION ALL"
+            " SELECT driver_id, COALESCE(amount, 0), 1 FROM transactions WHERE id > ? AND driver_id IS NOT NULL"
+            ") GROUP BY driver_id",
+            self._conn,
+            params=(snapshot["id"], snapshot["last_transaction_id"]),
+        )
+        replayed = self._conn.execute(
+            "SELECT COUNT(*) FROM transactions WHERE id > ?", (snapshot["last_transaction_id"],)
+        ).fetchone()[0]
+        return ledger, replayed
+
+    def _save_balance_snapshot(self, ledger, last_transaction_id):
+        cur = self._conn.execute(
+            "INSERT INTO balance_snapshots (created_at, last_transaction_id) VALUES (?, ?)",
+            (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), last_transaction_id),
+        )
+        snapshot_id = cur.lastrowid
+        self._conn.executemany(
+            "INSERT INTO snapshot_balances (snapshot_id, driver_id, balance, count) VALUES (?, ?, ?, ?)",
+            [(snapshot_id, d, float(b), int(c))
+             for d, b, c in ledger[["driver_id", "ledger_balance", "count"]].itertuples(index=False, name=None)],
+        )
+        old = "SELECT id FROM balance_snapshots ORDER BY id DESC LIMIT -1 OFFSET ?"
+        self._conn.execute(f"DELETE FROM snapshot_balances WHERE snapshot_id IN ({old})", (SNAPSHOTS_KEPT,))
+        self._conn.execute(f"DELETE FROM balance_snapshots WHERE id IN ({old})", (SNAPSHOTS_KEPT,))
+        return snapshot_id
+
+    def _clear_balance_snapshots(self):
+        self._conn.execute("DELETE FROM snapshot_balances")
+        self._conn.execute("DELETE FROM balance_snapshots")
+
+    # --- تقسيم السجل حسب الفترة والأرشفة ---
+
+    def archivable_periods(self, keep=ARCHIVE_KEEP_PERIODS, now=None):
+        """الفترات المغلقة التي ما زالت لها حركات في الجدول الحالي {الفترة: عدد الحركات}.
+
+        تبقى الفترة الجارية و keep فترة قبلها دون أرشفة. القراءة تمر بفهرس التوقيت: حركات ما قبل
+        أول فترة مفتوحة فقط، معدودة لكل يوم داخل SQLite (لا تُحمّل الحركات نفسها).
+        """
+        cutoff = pd.Timestamp(now or datetime.now()).to_period(PARTITION_PERIOD) - keep
+        with self._lock:
+            days = pd.read_sql_query(
+                "SELECT substr(timestamp, 1, 10) AS day, COUNT(*) AS count FROM transactions "
+                "WHERE timestamp < ? GROUP BY day",
+                self._conn,
+                params=(cutoff.start_time.strftime("%Y-%m-%d"),),
+            )
+        days['period'] = period_of(days['day']).values
+        closed = days.dropna(subset=['period'])
+        return closed.groupby('period')['count'].sum().astype(int).sort_index().to_dict()
+
+    def archive_period(self, period):
+        """ينقل حركات فترة مغلقة من الجدول الحالي إلى الأرشيف ويضيفها إلى ملخص الفترة.
+
+        الفترة تُعلّم غير منسوخة حتى تُكتب أوراقها في Google Sheets (mark_archives_synced).
+        يعيد عدد الحركات المنقولة.
+        """
+        with self._transaction():
+            existing = self._conn.execute(
+                "SELECT loaded FROM archive_periods WHERE period = ?", (period,)
+            ).fetchone()
+            if existing is not None and not existing['loaded']:
+                # ورقة الأرشيف ستُعاد كتابتها كاملة من النسخة المحلية: يجب تحميلها أولاً
+                raise ValueError(f"أرشيف الفترة {period} غير محمّل محلياً.")
+
+            rows = pd.read_sql_query(
+                f"SELECT id, {', '.join(TRANSACTION_COLUMNS)} FROM transactions", self._conn
+            )
+            rows = rows[(period_of(rows['timestamp']) == period).values]
+            if rows.empty:
+                return 0
+            ids = [(int(i),) for i in rows['id']]
+            self._conn.executemany(
+                f"INSERT INTO archived_transactions ({', '.join(TRANSACTION_COLUMNS)}, period) "
+                f"SELECT {', '.join(TRANSACTION_COLUMNS)}, ? FROM transactions WHERE id = ?",
+                [(period, i) for (i,) in ids],
+            )
+            self._conn.executemany("DELETE FROM transactions WHERE id = ?", ids)
+
+            summary = rows.assign(
+                driver_id=rows['driver_id'].fillna(''), type=rows['type'].fillna(''), amount=rows['amount'].fillna(0.0)
+            ).groupby(['driver_id', 'type'])['amount'].agg(['sum', 'count']).reset_index()
+            self._conn.executemany(
+                "INSERT INTO period_summaries (period, driver_id, type, total, count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (period, driver_id, type) DO UPDATE SET "
+                "total = ROUND(total + excluded.total, 2), count = count + excluded.count",
+                [(period, d, t, float(total), int(count))
+                 for d, t, total, count in summary.itertuples(index=False, name=None)],
+            )
+            self._conn.execute(
+                "INSERT INTO archive_periods (period, rows, archived_at, synced, loaded) VALUES (?, ?, ?, 0, 1) "
+                "ON CONFLICT (period) DO UPDATE SET rows = rows + excluded.rows, "
+                "archived_at = excluded.archived_at, synced = 0",
+                (period, len(rows), datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
+            # المجاميع لا تتغير (الحركات انتقلت من السجل إلى الملخص)، لكن أرقام اللقطات لم تعد صالحة
+            self._clear_balance_snapshots()
+            self._bump("transactions")
+            self._note_write()
+        return len(rows)
+
+    def archive_periods(self, synced=None):
+        """جدول الفترات المؤرشفة: period، rows، archived_at، synced، loaded."""
+        query = "SELECT period, rows, archived_at, synced, loaded FROM archive_periods"
+        params = ()
+        if synced is not None:
+            query += " WHERE synced = ?"
+            params = (int(synced),)
+        with self._lock:
+            df = pd.read_sql_query(query + " ORDER BY period", self._conn, params=params)
+        return df.astype({'synced': bool, 'loaded': bool})
+
+    def mark_archives_synced(self, periods):
+        with self._transaction():
+            self._conn.executemany("UPDATE archive_periods SET synced = 1 WHERE period = ?", [(p,) for p in periods])
+
+    def archived_transactions(self, period):
+        """حركات فترة مؤرشفة بنفس أعمدة الورقة (لكتابة ورقة أرشيفها)."""
+        with self._lock:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM archived_transactions WHERE period = ? ORDER BY id",
+                self._conn,
+                params=(period,),
+            )
+        if df.empty:
+            return empty_sheet("transactions")
+        return df
+
+    def period_summaries(self):
+        with self._lock:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM period_summaries ORDER BY period, driver_id, type",
+                self._conn,
+            )
+
+    def replace_period_summaries(self, df):
+        """يستبدل ملخصات الفترات بمحتوى ورقة الملخص (عند التحميل)، مع إبقاء ما لم يُنسخ بعد."""
+        df = pd.DataFrame(columns=SUMMARY_COLUMNS) if df is None or df.empty else df
+        df = df.reindex(columns=SUMMARY_COLUMNS).dropna(subset=['period'])
+        df = df.assign(
+            period=df['period'].astype(str),
+            driver_id=df['driver_id'].fillna('').astype(str),
+            type=df['type'].fillna('').astype(str),
+            total=pd.to_numeric(df['total'], errors='coerce').fillna(0.0),
+            count=pd.to_numeric(df['count'], errors='coerce').fillna(0).astype(int),
+        )
+        with self._transaction():
+            pending = {r['period'] for r in self._conn.execute("SELECT period FROM archive_periods WHERE NOT synced")}
+            df = df[~df['period'].isin(pending)]
+            self._conn.execute(
+                f"DELETE FROM period_summaries WHERE period NOT IN ({', '.join('?' for _ in pending)})", list(pending)
+            )
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO period_summaries ({', '.join(SUMMARY_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                [tuple(_to_sql(v) for v in r) for r in df[SUMMARY_COLUMNS].itertuples(index=False, name=None)],
+            )
+            # الفترات المعروفة من الورقة؛ أرشيفها المحلي يبقى إن وُجد، وما حُذف من الورقة يُحذف محلياً
+            rows = df.groupby('period')['count'].sum()
+            stale = [(r['period'],) for r in self._conn.execute("SELECT period FROM archive_periods WHERE synced")
+                     if r['period'] not in rows.index]
+            self._conn.executemany("DELETE FROM archived_transactions WHERE period = ?", stale)
+            self._conn.executemany("DELETE FROM archive_periods WHERE period = ?", stale)
+            self._conn.executemany(
+                "INSERT INTO archive_periods (period, rows, synced, loaded) VALUES (?, ?, 1, 0) "
+                "ON CONFLICT (period) DO NOTHING",
+                [(p, int(n)) for p, n in rows.items()],
+            )
+            self._rebuild_aggregates()
+
+    def load_archived_period(self, period, df):
+        """يحمّل حركات فترة مؤرشفة من ورقة أرشيفها إلى المخزن المحلي (للسجل والتصدير)."""
+        df = normalize_sheet("transactions", df)
+        rows = [tuple(_to_sql(v) for v in r) + (period,)
+                for r in df[TRANSACTION_COLUMNS].itertuples(index=False, name=None)]
+        with self._transaction():
+            self._conn.execute("DELETE FROM archived_transactions WHERE period = ?", (period,))
+            self._conn.executemany(
+                f"INSERT INTO archived_transactions ({', '.join(TRANSACTION_COLUMNS)}, period) "
+                f"VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)}, ?)",
+                rows,
+            )
+            self._conn.execute(
+                "UPDATE archive_periods SET rows = ?, loaded = 1 WHERE period = ?", (len(rows), period)
+            )
+            # حركات الفترة أصبحت معروفة بتوقيتها، فتدخل في التجميع الزمني وآخر حركات المندوبين
+            self._rebuild_rollups()
+            self._dashboards.clear()
+        return len(rows)
+
+
+def sheet_header_of(df):
+    """يستخرج أسماء أعمدة الورقة الفعلية (بدون الأعمدة الفارغة)."""
+    if df is None:
+        return None
+    return [str(c) for c in df.columns if not str(c).startswith('Unnamed')] or None
+
+
+def _to_sql(value):
+    """يحول قيم pandas (NaN، أنواع numpy) إلى قيم يفهمها SQLite."""
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _journal_result(result):
+    """نتيجة حركة محفوظة في دفتر اليومية؛ السجلات الأقدم بلا حالة تُستنتج حالتها من الرصيد والحركة."""
+    if len(result) == 3:
+        return tuple(result)
+    balance, transaction = result
+    return balance, transaction, "applied" if transaction else "not_found" if balance is None else "rejected"
+
+
+def _range_filter(column, start, end):
+    """شروط فترة (بالأيام، شاملة للطرفين) على عمود نصي يبدأ بالتاريخ."""
+    conditions, params = [], []
+    if start:
+        conditions.append(f"{column} >= ?")
+        params.append(start.strftime("%Y-%m-%d"))
+    if end:
+        conditions.append(f"{column} < ?")
+        params.append((end + timedelta(days=1)).strftime("%Y-%m-%d"))
+    return conditions, params
+
+
+def _history_filter(driver_id, start, end):
+    """يبني شروط التصفية (المندوب والفترة) لاستعلامات السجل."""
+    conditions, params = [], []
+    if driver_id:
+        conditions.append("driver_id = ?")
+        params.append(driver_id)
+    if start:
+        conditions.append("timestamp >= ?")
+        params.append(start.strftime("%Y-%m-%d"))
+    if end:
+        conditions.append("timestamp < ?")
+        params.append((end + timedelta(days=1)).strftime("%Y-%m-%d"))
+    return conditions, params
+
+
+def _with_driver_fields(df, updates):
+    """نسخة من إطار المندوبين (المضغوط) بعد تعديل حقول عدة مندوبين {driver_id: {العمود: القيمة}}."""
+    df = df.copy()
+    typed = {driver_id: schema.typed_fields(fields) for driver_id, fields in updates.items()}
+    for col in dict.fromkeys(c for fields in typed.values() for c in fields):
+        values = {driver_id: fields[col] for driver_id, fields in typed.items() if col in fields}
+        mask = df['driver_id'].isin(list(values))
+        df.loc[mask, col] = df.loc[mask, 'driver_id'].map(values)
+    return df
+
+
+def _with_driver_balances(df, balances):
+    """نسخة من إطار المندوبين (المضغوط) بعد تعديل أرصدة عدة مندوبين {driver_id: الرصيد}."""
+    df = df.copy()
+    mask = df['driver_id'].isin(list(balances))
+    minor = {driver_id: schema.to_minor(balance) for driver_id, balance in balances.items()}
+    df.loc[mask, 'balance_minor'] = df.loc[mask, 'driver_id'].map(minor).astype("int64")
+    return df
+
+
+def _driver_dict(row):
+    driver = dict(row)
+    driver['is_active'] = bool(driver['is_active'])
+    driver['balance'] = float(driver['balance'] or 0.0)
+    return driver
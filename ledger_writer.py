@@ -0,0 +1,90 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات الكاتب ---
+MAX_BATCH = 500  # أقصى عدد طلبات تُدمج في معاملة وكتابة واحدة
+WRITE_TIMEOUT = 30.0  # ثواني انتظار الجلسة لنتيجة طلبها
+# -----------------------------
+
+
+class LedgerWriter:
+    """الكاتب الوحيد لكل تعديلات الأرصدة داخل العملية.
+
+    الجلسات لا تعدّل الأرصدة مباشرة، بل ترسل طلباتها إلى طابور يخدمه خيط واحد،
+    فتُطبق الطلبات بالترتيب على الرصيد الفعلي في المخزن (لا على نسخة قد تكون قديمة)
+    ولا تضيع تعديلات مسؤولَين يسجلان في نفس اللحظة. الطلبات التي تصل معاً تُدمج في
+    معاملة واحدة وكتابة واحدة إلى Google Sheets.
+
+    كل طلب يُسجل في دفتر اليومية المحلي ضمن نفس المعاملة، فيُرد على الجلسة بعد الكتابة على
+    القرص مباشرة، وتُنسخ العملية إلى Sheets في الخلفية (وتُستأنف بعد إعادة التشغيل).
+    """
+
+    def __init__(self, store, mirror, max_batch=MAX_BATCH):
+        self._store = store
+        self._mirror = mirror
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, changes, op_key=None):
+        """يرسل طلباً [(driver_id، المبلغ، النوع، يتطلب رصيداً كافياً، يتطلب حساباً مفعلاً)] ويعيد Future بنتائجه.
+
+        نتيجة كل حركة بنفس صيغة LedgerStore.apply_balance_changes. op_key مفتاح منع التكرار:
+        طلب ثانٍ بنفس المفتاح لا يُطبق ويُعاد له نفس نتائج الأول.
+        """
+        future = Future()
+        self._queue.put((list(changes), op_key, future))
+        return future
+
+    def apply(self, changes, timeout=WRITE_TIMEOUT, op_key=None):
+        """يرسل طلباً وينتظر نتائجه."""
+        return self.submit(changes, op_key).result(timeout)
+
+    def _run(self):
+        while True:
+            requests = [self._queue.get()]
+            while len(requests) < self._max_batch:
+                try:
+                    requests.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._apply(requests)
+
+    def _apply(self, requests):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        metrics.inc("writer_batches_total")
+        metrics.inc("writer_changes_total", sum(len(request_changes) for request_changes, _, _ in requests))
+        try:
+            with metrics.timer("writer_apply_seconds"):
+                outcomes = self._store.apply_operations(
+                    [(op_key, request_changes) for request_changes, op_key, _ in requests], timestamp
+                )
+        except Exception as e:
+            logger.exception("فشل تطبيق دفعة من تعديلات الأرصدة.")
+            for _, _, future in requests:
+                future.set_exception(e)
+            return
+
+        # كتابة واحدة مدمجة إلى Google Sheets لكل الطلبات الجديدة (المكررة سبق نسخها)
+        transactions = [t for results, seq in outcomes if seq is not None for _, t, _ in results if t]
+        if transactions:
+            self._mirror.append("transactions", transactions, journal=[seq for _, seq in outcomes if seq is not None])
+            for driver_id in dict.fromkeys(t["driver_id"] for t in transactions):
+                self._mirror.update_driver(driver_id, ["balance"])
+
+        for (_, _, future), (results, _) in zip(requests, outcomes):
+            future.set_result(results)
+
+        # لقطة أرصدة دورية لتسريع المطابقة (بعد الرد على الجلسات حتى لا تؤخرها)
+        try:
+            self._store.maybe_take_balance_snapshot()
+        except Exception:
+            logger.exception("فشل حفظ لقطة الأرصدة.")
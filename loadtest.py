@@ -0,0 +1,380 @@
+"""اختبار حمل لواجهة التطبيق: جلسات متزامنة تشغّل app.py عبر AppTest دون Google Sheets (اتصال بديل في الذاكرة).
+
+المندوبون يسجلون الدخول ثم يعرضون رصيدهم ويتصفحون سجلهم الكامل، والمسؤولون يبحثون عن مندوب ويسجلون
+توصيلة أو شحناً. في النهاية يُقارن رصيد كل مندوب (محلياً وفي Sheets) بمجموع العمليات التي أكدتها
+الواجهة، فتظهر أي تحديثات مفقودة.
+
+كل جلسة عملية مستقلة (AppTest يبدّل حالة Streamlit العامة، فلا يشغَّل منه اثنان في عملية واحدة)،
+وكل العمليات تتشارك ملف SQLite واحداً في الوضع المشترك (JAK_SHARED_CACHE) وبديل Sheets واحداً
+يخدمه SheetsManager، كعمال متعددين خلف موزع حمل. فالتشغيلات تجري بالتوازي فعلاً، والأزمنة
+المقيسة هي ما يراه المستخدم بحدود أنوية الجهاز (يُطبع عددها مع كل مرحلة).
+
+مثال (مرحلة لكل عدد من جلسات المندوبين):
+    python loadtest.py --drivers 10 25 50 --admins 4 --duration 60 --latency 0.2 --p95-target 1000
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+# قاعدة مؤقتة مستقلة عن ملف التطبيق، مشتركة بين عمليات الجلسات (يجب ضبطها قبل استيراد المخزن)،
+# وملف قياسات لكل عملية في مجلدها المؤقت حتى لا تتزاحم العمليات على ملف واحد
+_WORKDIR = tempfile.mkdtemp(prefix="jak-load-")
+os.environ["JAK_DB_PATH"] = os.path.join(_WORKDIR, "load.db")
+os.environ["JAK_SHARED_CACHE"] = "1"
+os.environ["JAK_METRICS_FILE"] = os.path.join(_WORKDIR, "metrics.prom")
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import data_access  # noqa: E402
+import sheets_sync  # noqa: E402
+from fake_sheets import RemoteGSheetsConnection, SheetsManager, synthetic_sheets  # noqa: E402
+from ledger_store import LedgerStore  # noqa: E402
+from sheets_client import SheetsClient  # noqa: E402
+
+# --- إعدادات اختبار الحمل ---
+DEFAULT_DRIVERS = [10]  # عدد جلسات المندوبين المتزامنة في كل مرحلة
+DEFAULT_ADMINS = 2  # عدد جلسات المسؤولين المتزامنة
+DEFAULT_DURATION = 30.0  # ثواني كل مرحلة
+DEFAULT_SIZE = 10000  # عدد صفوف سجل الحركات في البيانات المولّدة
+ROWS_PER_DRIVER = 20  # متوسط حركات كل مندوب في البيانات المولّدة
+THINK_TIME = 1.0  # متوسط الثواني بين عمليتين في الجلسة الواحدة (توزيع أُسّي)
+CHARGE_AMOUNT = 100.0  # مبلغ كل عملية شحن
+DELIVERY_SHARE = 0.75  # نسبة التوصيلات من عمليات المسؤول (والباقي شحن)
+HISTORY_SHARE = 0.3  # نسبة تصفح صفحات السجل من عمليات المندوب (والباقي عرض الرصيد)
+RUN_TIMEOUT = 60.0  # أقصى ثواني لتشغيل واحد للصفحة
+FLUSH_TIMEOUT = 120.0  # ثواني انتظار إفراغ طابور الكتابة إلى Sheets
+STARTUP_TIMEOUT = 300.0  # ثواني انتظار تجهيز كل عمليات الجلسات قبل بدء المرحلة
+# -----------------------------
+
+COLUMNS = ["الإجراء", "n", "متوسط ms", "p50 ms", "p95 ms", "p99 ms", "أقصى ms"]
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class LoadStats:
+    """أزمنة التشغيل لكل إجراء، ونتائج العمليات المالية كما أكدتها الواجهة (آمنة بين الخيوط).
+
+    كل عملية جلسة تجمع نتائجها في LoadStats خاص بها، ثم تُدمج في العملية الرئيسية بـ merge.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)  # {الإجراء: [ms]}
+        self.outcomes = Counter()  # {(العملية، النتيجة): العدد}
+        self.expected = Counter()  # {driver_id: مجموع المبالغ المؤكدة بأجزاء المئة}
+        self.errors = []  # أخطاء ظهرت في الصفحة أو أثناء التشغيل
+
+    def record(self, action, ms):
+        with self._lock:
+            self.samples[action].append(ms)
+
+    def outcome(self, operation, result, driver_id=None, amount=0.0):
+        with self._lock:
+            self.outcomes[(operation, result)] += 1
+            if result == "applied":
+                self.expected[driver_id] += round(amount * 100)
+
+    def error(self, text):
+        with self._lock:
+            self.errors.append(text)
+
+    def export(self):
+        """محتوى قابل للإرسال بين العمليات."""
+        with self._lock:
+            return dict(self.samples), Counter(self.outcomes), Counter(self.expected), list(self.errors)
+
+    def merge(self, exported):
+        samples, outcomes, expected, errors = exported
+        with self._lock:
+            for action, values in samples.items():
+                self.samples[action].extend(values)
+            self.outcomes.update(outcomes)
+            self.expected.update(expected)
+            self.errors.extend(errors)
+
+    @property
+    def reruns(self):
+        with self._lock:
+            return sum(len(v) for v in self.samples.values())
+
+    def rows(self):
+        with self._lock:
+            items = sorted(self.samples.items())
+        all_samples = [ms for _, samples in items for ms in samples]
+        rows = []
+        for action, samples in items + [("الكل", all_samples)]:
+            if samples:
+                rows.append([action, len(samples), statistics.fmean(samples), _percentile(samples, 0.5),
+                             _percentile(samples, 0.95), _percentile(samples, 0.99), max(samples)])
+        return rows
+
+
+def _timed_run(at, stats, action):
+    """تشغيل واحد للصفحة مع قياس زمنه، وتسجيل أي خطأ ظهر فيها."""
+    t0 = time.perf_counter()
+    at.run(timeout=RUN_TIMEOUT)
+    stats.record(action, (time.perf_counter() - t0) * 1000)
+    if at.exception:
+        stats.error(f"{action}: {at.exception[0].value}")
+
+
+def _new_app():
+    return AppTest.from_file("app.py", default_timeout=RUN_TIMEOUT)
+
+
+def driver_session(driver_id, rng, stats, deadline):
+    """مندوب يسجل الدخول ثم يعرض رصيده (لوحته) أو يتصفح صفحات سجله الكامل حتى نهاية المرحلة."""
+    at = _new_app()
+    _timed_run(at, stats, "مندوب: فتح الصفحة")
+    # كتابة الترقيم تعيد تشغيل الصفحة قبل الضغط على الزر، كما في المتصفح
+    next(t for t in at.text_input if t.label.startswith("أدخل ترقيمك")).input(driver_id)
+    _timed_run(at, stats, "مندوب: إدخال الترقيم")
+    next(b for b in at.button if b.label == "تسجيل الدخول").click()
+    _timed_run(at, stats, "مندوب: تسجيل الدخول")
+    if not at.metric:
+        stats.error(f"تعذر دخول المندوب {driver_id}")
+        return
+    while time.monotonic() < deadline:
+        time.sleep(rng.expovariate(1 / THINK_TIME))
+        if rng.random() < HISTORY_SHARE and any(t.key == "my_history_full" for t in at.toggle):
+            if at.toggle(key="my_history_full").value:
+                at.number_input(key="my_history_page").set_value(rng.randint(1, 3))
+                _timed_run(at, stats, "مندوب: صفحة السجل")
+            else:
+                at.toggle(key="my_history_full").set_value(True)
+                _timed_run(at, stats, "مندوب: السجل الكامل")
+        else:
+            _timed_run(at, stats, "مندوب: عرض الرصيد")
+
+
+def admin_session(driver_ids, rng, stats, deadline):
+    """مسؤول يبحث عن مندوب ثم يسجل له توصيلة أو شحناً، حتى نهاية المرحلة."""
+    at = _new_app()
+    at.session_state['admin_mode'] = True
+    _timed_run(at, stats, "مسؤول: فتح الصفحة")
+    while time.monotonic() < deadline:
+        time.sleep(rng.expovariate(1 / THINK_TIME))
+        driver_id = rng.choice(driver_ids)
+        at.text_input(key="search_op_input").input(driver_id)
+        at.button(key="search_op_btn").click()
+        _timed_run(at, stats, "مسؤول: بحث")
+        if "deduct_button" not in [b.key for b in at.button]:
+            stats.error(f"لم يُحدَّد {driver_id}: {[e.value for e in at.error]} {[i.value for i in at.info]}")
+            continue
+        if rng.random() < DELIVERY_SHARE:
+            operation, amount = "توصيلة", -data_access.DEDUCTION_AMOUNT
+            at.button(key="deduct_button").click()
+        else:
+            operation, amount = "شحن", CHARGE_AMOUNT
+            at.number_input(key="charge_amount").set_value(CHARGE_AMOUNT)
+            at.button(key="charge_button").click()
+        _timed_run(at, stats, f"مسؤول: {operation}")
+        # نتيجة العملية كما تعرضها الواجهة (رسالة النجاح أو الرفض)
+        if any(("تم تسجيل التوصيلة" in s.value or "تم الشحن" in s.value) for s in at.success):
+            stats.outcome(operation, "applied", driver_id, amount)
+        elif at.error:
+            stats.outcome(operation, "rejected")
+        else:
+            stats.outcome(operation, "unknown")
+
+
+def _quiet_streamlit():
+    """تحذيرات Streamlit عن تشغيل الصفحة خارج الخادم غير مهمة هنا.
+
+    AppTest يعيد مستوى المسجلات ومخرجاتها مع كل تشغيل، فيُستخدم مرشح على المسجل نفسه.
+    """
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).addFilter(lambda record: record.levelno >= logging.ERROR)
+
+
+def _reset_resources(db_path, conn):
+    """مخزن وكاتب جديدان، متصلان بالملف المشترك والاتصال البديل."""
+    for resource in (data_access.get_refresher, data_access.get_writer, data_access.get_mirror,
+                     data_access.get_store, data_access.get_client, data_access.build_driver_index,
+                     data_access.build_driver_search):
+        resource.clear()
+    data_access.DB_PATH = db_path
+    data_access.get_connection = lambda: conn
+
+
+def _session_process(session, args, db_path, sheets, barrier, duration, results):
+    """جسم عملية الجلسة: موارد التطبيق كعامل مستقل، ثم الجلسة بعد إشارة البدء، ثم إرسال النتائج."""
+    _quiet_streamlit()
+    stats = LoadStats()
+    flushed, ended = False, time.time()
+    try:
+        _reset_resources(db_path, RemoteGSheetsConnection(sheets))
+        data_access.get_refresher()
+        barrier.wait()
+    except Exception as e:
+        barrier.abort()
+        stats.error(f"تجهيز {session.__name__}: {e!r}")
+    else:
+        try:
+            session(*args, stats, time.monotonic() + duration)
+        except Exception as e:
+            stats.error(f"{session.__name__}: {e!r}")
+        ended = time.time()
+        flushed = data_access.get_mirror().flush(FLUSH_TIMEOUT)
+    results.put((stats.export(), flushed, ended))
+
+
+def check_lost_updates(store, sheets, initial, stats, new_transactions):
+    """يقارن رصيد كل مندوب (محلياً وفي Sheets) برصيده الأول مضافاً إليه العمليات المؤكدة."""
+    local = {d: round(store.get_driver(d)['balance'] * 100) for d in initial}
+    sheet = sheets.frame("drivers").set_index("driver_id")['balance'].astype(float)
+    expected = {d: initial[d] + stats.expected[d] for d in initial}
+    applied = sum(n for (_, result), n in stats.outcomes.items() if result == "applied")
+    return {
+        "الأرصدة المحلية المختلفة": sum(local[d] != expected[d] for d in initial),
+        "أرصدة Sheets المختلفة": sum(round(sheet.get(d, 0.0) * 100) != expected[d] for d in initial),
+        "حركات مؤكدة": applied,
+        "حركات جديدة محلياً": new_transactions["local"],
+        "حركات جديدة في Sheets": new_transactions["sheet"],
+        "فروقات مطابقة السجل": store.reconcile_balances(use_snapshot=False)[1]['mismatches'],
+    }
+
+
+def run_stage(n_sessions, n_admins, duration, size, latency, seed):
+    n_drivers = max(10, size // ROWS_PER_DRIVER)
+    ctx = multiprocessing.get_context("spawn")
+    with SheetsManager(ctx=ctx) as manager:
+        sheets = manager.Sheets(synthetic_sheets(n_drivers, size, seed=seed), latency=latency)
+        db_path = os.path.join(_WORKDIR, f"load-{n_sessions}-{n_admins}.db")
+        # تحميل الملف المشترك مرة واحدة قبل بدء الجلسات، فلا يُحسب ضمن أزمنتها
+        store = LedgerStore(db_path, shared=True)
+        sheets_sync.hydrate(store, SheetsClient(RemoteGSheetsConnection(sheets), data_access.SPREADSHEET_NAME))
+
+        drivers = sheets.frame("drivers")
+        initial = {d: round(b * 100) for d, b in zip(drivers['driver_id'], drivers['balance'].astype(float))}
+        active = list(drivers.loc[drivers['is_active'].astype(bool), 'driver_id'])
+        local_before, sheet_before = len(store.read_sheet("transactions")), len(sheets.frame("transactions"))
+
+        rng = random.Random(seed)
+        sessions = ([(driver_session, (rng.choice(active), random.Random(rng.random())))
+                     for _ in range(n_sessions)]
+                    + [(admin_session, (active, random.Random(rng.random()))) for _ in range(n_admins)])
+        barrier = ctx.Barrier(len(sessions) + 1, timeout=STARTUP_TIMEOUT)
+        results = ctx.Queue()
+        processes = [ctx.Process(target=_session_process,
+                                 args=(session, args, db_path, sheets, barrier, duration, results))
+                     for session, args in sessions]
+        for process in processes:
+            process.start()
+
+        stats = LoadStats()
+        flushed, ended = True, []
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            stats.error("تعذر تجهيز كل عمليات الجلسات")
+        sheets.reset_stats()
+        started = time.time()
+        for process in processes:
+            try:
+                exported, process_flushed, process_ended = results.get(
+                    timeout=STARTUP_TIMEOUT + duration + RUN_TIMEOUT + FLUSH_TIMEOUT)
+            except queue.Empty:
+                stats.error("عملية جلسة لم ترسل نتائجها")
+                flushed = False
+                continue
+            stats.merge(exported)
+            flushed = flushed and process_flushed
+            ended.append(process_ended)
+        for process in processes:
+            process.join(RUN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        elapsed = max(max(ended, default=started) - started, 1e-9)
+        calls = sheets.stats_snapshot()
+
+        operations = sum(stats.outcomes.values())
+        summary = {
+            "المدة (ثانية)": elapsed,
+            "تشغيلات الصفحة/ثانية": stats.reruns / elapsed,
+            "عمليات مالية/ثانية": operations / elapsed,
+            "قراءات Sheets لكل عملية": calls["reads"] / max(operations, 1),
+            "كتابات Sheets لكل عملية": calls["writes"] / max(operations, 1),
+            "اكتمل النسخ إلى Sheets": flushed,
+            "نتائج العمليات": dict(stats.outcomes),
+            "أخطاء": len(stats.errors),
+        }
+        new_transactions = {
+            "local": len(store.read_sheet("transactions")) - local_before,
+            "sheet": len(sheets.frame("transactions")) - sheet_before,
+        }
+        summary.update(check_lost_updates(store, sheets, initial, stats, new_transactions))
+    return n_drivers, stats, summary
+
+
+def format_table(rows):
+    cells = [COLUMNS] + [[r[0], str(r[1])] + [f"{v:.1f}" for v in r[2:]] for r in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(COLUMNS))]
+    lines = ["  ".join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(row, widths)))
+             for row in cells]
+    lines.insert(1, "-" * len(lines[0]))
+    return "\n".join(lines)
+
+
+def format_summary(summary):
+    return "\n".join(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}"
+                     for key, value in summary.items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="اختبار حمل لجلسات التطبيق المتزامنة باتصال Sheets بديل في الذاكرة.")
+    parser.add_argument("--drivers", type=int, nargs="+", default=DEFAULT_DRIVERS,
+                        help="عدد جلسات المندوبين المتزامنة (مرحلة لكل قيمة)")
+    parser.add_argument("--admins", type=int, default=DEFAULT_ADMINS, help="عدد جلسات المسؤولين المتزامنة")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="ثواني كل مرحلة")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE, help="حجم سجل الحركات")
+    parser.add_argument("--latency", type=float, default=0.0, help="تأخير كل طلب Sheets بالثواني")
+    parser.add_argument("--p95-target", type=float, help="هدف p95 بالملي ثانية لتحديد أقصى عدد جلسات مقبول")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ملف تُحفظ فيه النتائج إضافة إلى الطباعة")
+    args = parser.parse_args(argv)
+
+    _quiet_streamlit()
+
+    report = []
+    capacity = None
+    for n_sessions in args.drivers:
+        n_drivers, stats, summary = run_stage(n_sessions, args.admins, args.duration, args.size, args.latency, args.seed)
+        report.append(f"== {n_sessions} جلسة مندوب، {args.admins} مسؤول، {args.size} حركة، {n_drivers} مندوب، "
+                      f"تأخير {args.latency * 1000:.0f}ms، {os.cpu_count()} نواة ==")
+        report.append(format_table(stats.rows()))
+        report.append(format_summary(summary))
+        report.extend(f"  خطأ: {e}" for e in stats.errors[:10])
+        report.append("")
+        print("\n".join(report[-(4 + min(len(stats.errors), 10)):]), flush=True)
+        p95 = stats.rows()[-1][4]
+        if args.p95_target is not None and p95 <= args.p95_target:
+            capacity = n_sessions + args.admins
+
+    if args.p95_target is not None:
+        line = (f"أقصى عدد جلسات متزامنة ضمن p95 ≤ {args.p95_target:.0f}ms: {capacity}" if capacity
+                else f"لم تحقق أي مرحلة p95 ≤ {args.p95_target:.0f}ms")
+        report.append(line)
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("\n".join(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
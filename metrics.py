@@ -0,0 +1,193 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 🆕 عدادات وأزمنة المسارات الساخنة (قراءات وكتابات Sheets، الذاكرة المؤقتة، العمليات، إعادة تشغيل الصفحات)
+
+# --- إعدادات القياس ---
+METRICS_FILE = os.environ.get("JAK_METRICS_FILE", "metrics.prom")  # ملف بصيغة Prometheus النصية (فارغ لتعطيله)
+WRITE_INTERVAL = 15.0  # أقل عدد ثواني بين كتابتين للملف
+METRIC_PREFIX = "jak_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # حدود الأزمنة بالثواني
+RECENT_SAMPLES = 500  # عدد القياسات الأخيرة المحفوظة لحساب p50/p95 في صفحة التشخيص
+# -----------------------------
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+
+class MetricsRegistry:
+    """سجل العدادات والأزمنة للعملية كلها (مشترك بين الجلسات والخيوط)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}  # {(الاسم، التسميات): القيمة}
+            self._histograms = {}  # {(الاسم، التسميات): _Histogram}
+            self._started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """يقيس زمن الكتلة؛ التسمية status تكون error إذا رُفع استثناء."""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, status=status, **labels)
+
+    def timed(self, name, **labels):
+        """مُزخرف يقيس زمن كل استدعاء للدالة."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # --- العرض والتصدير ---
+
+    def render(self):
+        """النص بصيغة Prometheus (text exposition format)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.buckets), h.count, h.sum)) for key, h in self._histograms.items())
+            started = self._started
+
+        lines = [
+            f"# TYPE {METRIC_PREFIX}metrics_start_time_seconds gauge",
+            f"{METRIC_PREFIX}metrics_start_time_seconds {started:.3f}",
+        ]
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                last_name = name
+            lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, count, total) in histograms:
+            if name != last_name:
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                last_name = name
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {bucket_count}")
+            lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path=None):
+        """يكتب النص في الملف دفعة واحدة (ملف مؤقت ثم استبدال) حتى لا يقرأ الجامع ملفاً ناقصاً."""
+        path = path or METRICS_FILE
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+        self._last_write = time.monotonic()
+
+    def maybe_write_file(self):
+        """يكتب الملف إذا مضى WRITE_INTERVAL منذ آخر كتابة."""
+        if METRICS_FILE and time.monotonic() - self._last_write >= WRITE_INTERVAL:
+            try:
+                self.write_file()
+            except OSError:
+                logger.exception("تعذرت كتابة ملف القياسات %s.", METRICS_FILE)
+                self._last_write = time.monotonic()
+
+    def timings_frame(self):
+        """جدول الأزمنة للعرض: العدد والمتوسط و p50/p95 (من آخر القياسات) بالملي ثانية."""
+        with self._lock:
+            items = [(key, h.count, h.sum, sorted(h.recent)) for key, h in self._histograms.items()]
+        rows = []
+        for (name, labels), count, total, recent in sorted(items):
+            rows.append({
+                "metric": name,
+                "labels": _format_labels(labels).strip("{}"),
+                "count": count,
+                "mean_ms": total / count * 1000 if count else 0.0,
+                "p50_ms": _quantile(recent, 0.5) * 1000,
+                "p95_ms": _quantile(recent, 0.95) * 1000,
+                "total_s": total,
+            })
+        return pd.DataFrame(rows, columns=["metric", "labels", "count", "mean_ms", "p50_ms", "p95_ms", "total_s"])
+
+    def counters_frame(self):
+        with self._lock:
+            items = sorted(self._counters.items())
+        rows = [{"metric": name, "labels": _format_labels(labels).strip("{}"), "value": value}
+                for (name, labels), value in items]
+        return pd.DataFrame(rows, columns=["metric", "labels", "value"])
+
+    def counter_value(self, name, **labels):
+        """مجموع قيم العداد لكل السلاسل التي تطابق التسميات المعطاة."""
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(v for (n, lbls), v in self._counters.items() if n == name and wanted <= set(lbls))
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _quantile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+# السجل المشترك للعملية ودوال مختصرة له
+REGISTRY = MetricsRegistry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+timed = REGISTRY.timed
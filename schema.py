@@ -0,0 +1,105 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# 🆕 الأنواع المضغوطة لإطارات البيانات المخزنة في الذاكرة (تُطبق مرة واحدة عند التحميل)
+
+# --- إعدادات الأنواع ---
+MINOR_UNITS = 100  # المبالغ تُحفظ كأعداد صحيحة بأجزاء المئة من الأوقية
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # صيغة التوقيت في ورقة transactions
+TRANSACTION_TYPES = ["شحن رصيد", "خصم توصيلة"]  # أنواع العمليات المعروفة (تُضاف إليها أي أنواع أخرى في الورقة)
+# -----------------------------
+
+# أعمدة الإطارات المضغوطة: المبالغ بأسماء جديدة حتى لا تُخلط بالقيم العشرية
+TYPED_COLUMNS = {
+    "drivers": ['driver_id', 'name', 'bike_plate', 'whatsapp', 'notes', 'is_active', 'balance_minor'],
+    "transactions": ['driver_name', 'amount_minor', 'type', 'timestamp', 'driver_id'],
+}
+MONEY_COLUMNS = {"balance": "balance_minor", "amount": "amount_minor"}
+CATEGORY_COLUMNS = {"transactions": ['driver_name', 'type', 'driver_id']}
+STRING_COLUMNS = {"drivers": ['driver_id', 'name', 'bike_plate', 'whatsapp', 'notes']}
+
+
+def to_minor(value):
+    """يحول مبلغاً بالأوقية إلى عدد صحيح بأجزاء المئة (مع تقريب النصف للأعلى)."""
+    if value is None or value != value:
+        return 0
+    return int(Decimal(str(value)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(value):
+    """يحول أجزاء المئة إلى أوقية (رقم أو Series)."""
+    if isinstance(value, pd.Series):
+        return value.astype("float64") / MINOR_UNITS
+    return value / MINOR_UNITS
+
+
+def series_to_minor(values):
+    """النسخة الموجهة من to_minor لعمود كامل."""
+    numbers = pd.to_numeric(values, errors='coerce').fillna(0.0).astype("float64")
+    return pd.Series(np.round(numbers.to_numpy() * MINOR_UNITS), index=numbers.index).astype("int64")
+
+
+def typed(sheet_name, df):
+    """يحول إطار ورقة (بأنواعه الخام من المخزن) إلى الأنواع المضغوطة."""
+    df = df.rename(columns=MONEY_COLUMNS)
+    out = pd.DataFrame(index=df.index)
+    for col in TYPED_COLUMNS[sheet_name]:
+        values = df[col] if col in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if col in MONEY_COLUMNS.values():
+            out[col] = series_to_minor(values)
+        elif col == 'timestamp':
+            out[col] = parse_timestamps(values)
+        elif col == 'is_active':
+            out[col] = values.astype("boolean")
+        elif col == 'type':
+            out[col] = pd.Categorical(values, categories=_type_categories(values))
+        elif col in CATEGORY_COLUMNS.get(sheet_name, []):
+            out[col] = values.astype("category")
+        else:
+            out[col] = values.astype("string")
+    return out
+
+
+def typed_fields(fields):
+    """يحول حقول تعديل مندوب {العمود: القيمة} إلى أسماء وقيم الإطار المضغوط."""
+    out = {}
+    for col, value in fields.items():
+        if col in MONEY_COLUMNS:
+            out[MONEY_COLUMNS[col]] = to_minor(value)
+        elif col == 'is_active':
+            out[col] = bool(value)
+        else:
+            out[col] = pd.NA if value is None or value != value else str(value)
+    return out
+
+
+def append_rows(sheet_name, df, rows):
+    """يلحق صفوفاً خاماً (قواميس أو DataFrame) بإطار مضغوط دون فقد الأنواع الفئوية."""
+    new = typed(sheet_name, pd.DataFrame(rows))
+    if df.empty:
+        return new.reset_index(drop=True)
+    combined = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            combined[col] = union_categoricals([df[col], new[col]], ignore_order=True)
+        else:
+            combined[col] = pd.concat([df[col], new[col]], ignore_index=True)
+    return pd.DataFrame(combined)
+
+
+def parse_timestamps(values):
+    """يحول نصوص التوقيت إلى datetime64 مرة واحدة (الصيغ الأخرى تُقرأ ببطء، وغير الصالح NaT)."""
+    values = pd.Series(values, dtype=object)
+    parsed = pd.to_datetime(values, format=TIMESTAMP_FORMAT, errors='coerce')
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], format='mixed', errors='coerce')
+    return parsed
+
+
+def _type_categories(values):
+    extra = sorted(set(values.dropna().astype(str)) - set(TRANSACTION_TYPES))
+    return TRANSACTION_TYPES + extra
@@ -0,0 +1,266 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import rowcol_to_a1
+from pandas.io.parsers import TextParser
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 🆕 طبقة طلبات Google Sheets: كل القراءات والكتابات تمر من هنا لتُدمج القراءات المتطابقة،
+# وتُقرأ عدة أوراق في طلب واحد، ويُعاد الطلب بتأخير متزايد عند تجاوز الحصة (429)
+
+# --- إعدادات الطلبات ---
+READ_QUOTA_PER_MINUTE = int(os.environ.get("JAK_SHEETS_READ_QUOTA", "60"))  # حصة القراءة لكل مستخدم في الدقيقة
+WRITE_QUOTA_PER_MINUTE = int(os.environ.get("JAK_SHEETS_WRITE_QUOTA", "60"))  # حصة الكتابة لكل مستخدم في الدقيقة
+QUOTA_WINDOW = 60.0  # ثواني نافذة الحصة
+MAX_RETRIES = 5  # محاولات إضافية بعد خطأ الحصة قبل إظهار الخطأ
+BACKOFF_BASE = 1.0  # ثواني انتظار أول إعادة (تتضاعف مع كل محاولة)
+BACKOFF_MAX = 32.0  # أقصى انتظار بين محاولتين
+VALUE_INPUT_OPTION = "USER_ENTERED"  # نفس طريقة إدخال القيم التي يستخدمها conn.update
+# -----------------------------
+
+
+class SheetsQuotaError(Exception):
+    """تجاوز حصة طلبات Google Sheets رغم إعادة المحاولة."""
+
+    def __init__(self, op):
+        super().__init__(f"تم تجاوز حصة طلبات Google Sheets ({op})، يرجى المحاولة بعد دقيقة.")
+        self.op = op
+
+
+class SheetsClient:
+    """يلف GSheetsConnection لملف واحد.
+
+    قراءتان متطابقتان في نفس الوقت (من جلسات أو خيوط مختلفة) تنتظران طلباً واحداً، وتُحسب
+    الطلبات المرسلة في آخر دقيقة: إذا نفدت الحصة ينتظر الطلب التالي بدلاً من أن يُرفض.
+    """
+
+    def __init__(self, conn, spreadsheet, read_quota=READ_QUOTA_PER_MINUTE, write_quota=WRITE_QUOTA_PER_MINUTE):
+        self.conn = conn
+        self.spreadsheet = spreadsheet
+        self._quota = {"read": read_quota, "write": write_quota}
+        self._sent = {"read": deque(), "write": deque()}  # أوقات الطلبات داخل النافذة
+        self._lock = threading.Lock()
+        self._inflight = {}  # {مفتاح القراءة: _Call}
+        self._opened = None  # كائن الملف في gspread (يُفتح مرة واحدة)
+        self._worksheets = {}  # {اسم الورقة: كائن gspread}
+
+    # --- القراءة ---
+
+    def read(self, sheet_name):
+        """يقرأ ورقة كاملة دون المرور بذاكرة الاتصال المؤقتة."""
+        return self._coalesce(("read", sheet_name), lambda: self._read(sheet_name))
+
+    def read_many(self, sheet_names):
+        """يقرأ عدة أوراق في طلب واحد ويعيد {الاسم: DataFrame}."""
+        names = tuple(sheet_names)
+        return self._coalesce(("read_many", names), lambda: self._read_many(names))
+
+    def _read(self, sheet_name):
+        df = self._call("read", "read", sheet_name,
+                        lambda: self.conn.read(spreadsheet=self.spreadsheet, worksheet=sheet_name, ttl=0))
+        metrics.inc("sheets_rows_total", len(df), op="read", sheet=sheet_name)
+        return df
+
+    def _read_many(self, names):
+        opened = self._open()
+        if opened is None or not hasattr(opened, "values_batch_get"):
+            # اتصال لا يدعم القراءة المجمعة: ورقة ورقة
+            return {name: self._read(name) for name in names}
+        try:
+            response = self._call("read", "batch_read", ",".join(names), lambda: opened.values_batch_get(
+                [_quote_title(name) for name in names],
+                params={"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"},
+            ))
+        except APIError as e:
+            if _status_of(e) == 400:
+                # ورقة غير موجودة في الطلب: تُقرأ منفردة ليظهر اسمها في الخطأ
+                return {name: self._read(name) for name in names}
+            raise
+        frames = {}
+        for name, value_range in zip(names, response.get("valueRanges", [])):
+            frames[name] = _values_frame(value_range.get("values", []))
+            metrics.inc("sheets_rows_total", len(frames[name]), op="read", sheet=name)
+        return frames
+
+    def _coalesce(self, key, func):
+        """يجمع الطلبات المتطابقة الجارية في طلب واحد، ويعيد للجميع نفس النتيجة أو نفس الخطأ."""
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+        if not leader:
+            metrics.inc("sheets_coalesced_total", op=key[0])
+            return call.wait()
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+        return call.result
+
+    # --- الكتابة ---
+
+    def write(self, sheet_name, df, create=False):
+        """يعيد كتابة ورقة كاملة (وينشئها أولاً إذا لم توجد و create=True)."""
+        rewrite = lambda: self.conn.update(spreadsheet=self.spreadsheet, worksheet=sheet_name, data=df)  # noqa: E731
+        try:
+            self._call("write", "rewrite", sheet_name, rewrite)
+        except WorksheetNotFound:
+            if not create:
+                raise
+            self.create(sheet_name, len(df) + 1, len(df.columns))
+            self._call("write", "rewrite", sheet_name, rewrite)
+        metrics.inc("sheets_rows_total", len(df), op="rewrite", sheet=sheet_name)
+
+    def create(self, sheet_name, rows, cols):
+        """ينشئ ورقة جديدة في الملف (conn.create في المكتبة لا يقبل اسم الملف صراحة)."""
+        opened = self._open()
+        self._call("write", "create", sheet_name,
+                   lambda: opened.add_worksheet(title=sheet_name, rows=max(rows, 1), cols=max(cols, 1)))
+
+    def worksheet(self, sheet_name):
+        """كائن gspread للورقة (محفوظ بعد أول طلب)، أو None إذا كان الاتصال لا يدعم الكتابة الجزئية."""
+        select = getattr(self.conn.client, "_select_worksheet", None)
+        if select is None:
+            return None
+        worksheet = self._worksheets.get(sheet_name)
+        if worksheet is None:
+            opened = self._open()
+            worksheet = self._call("read", "open", sheet_name,
+                                   lambda: select(spreadsheet=opened, worksheet=sheet_name))
+            self._worksheets[sheet_name] = worksheet
+        return worksheet
+
+    def append_rows(self, sheet_name, rows):
+        """يلحق صفوفاً بنهاية الورقة، ويعيد استجابة الطلب."""
+        worksheet = self.worksheet(sheet_name)
+        response = self._call("write", "append", sheet_name, lambda: self._forget_on_error(
+            sheet_name, worksheet.append_rows, rows, value_input_option=VALUE_INPUT_OPTION))
+        metrics.inc("sheets_rows_total", len(rows), op="append", sheet=sheet_name)
+        return response
+
+    def update_cells(self, sheet_name, cells):
+        """يحدّث خلايا محددة [(الصف، العمود، القيمة)] في طلب واحد."""
+        worksheet = self.worksheet(sheet_name)
+        self._call("write", "update_cells", sheet_name, lambda: self._forget_on_error(
+            sheet_name, worksheet.batch_update,
+            [{"range": rowcol_to_a1(row, col), "values": [[value]]} for row, col, value in cells],
+            value_input_option=VALUE_INPUT_OPTION,
+        ))
+        metrics.inc("sheets_cells_total", len(cells), op="update_cells", sheet=sheet_name)
+
+    def _forget_on_error(self, sheet_name, func, *args, **kwargs):
+        # الورقة قد تكون حُذفت أو أُعيد إنشاؤها: يُطلب كائنها من جديد في المحاولة التالية
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            self._worksheets.pop(sheet_name, None)
+            raise
+
+    def _open(self):
+        if self._opened is None:
+            open_spreadsheet = getattr(self.conn.client, "_open_spreadsheet", None)
+            if open_spreadsheet is None:
+                return None
+            self._opened = self._call("read", "open", "", lambda: open_spreadsheet(spreadsheet=self.spreadsheet))
+        return self._opened
+
+    # --- الحصة وإعادة المحاولة ---
+
+    def remaining(self, kind):
+        """عدد الطلبات المتبقية من حصة الدقيقة الحالية (read أو write)."""
+        with self._lock:
+            self._expire(kind, time.monotonic())
+            return max(0, self._quota[kind] - len(self._sent[kind]))
+
+    @property
+    def budget(self):
+        """ملخص الحصة للعرض: {النوع: (المتبقي، الحصة)}."""
+        return {kind: (self.remaining(kind), quota) for kind, quota in self._quota.items()}
+
+    def _acquire(self, kind):
+        """يحجز طلباً من الحصة، وينتظر خروج أقدم طلب من النافذة إذا نفدت."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(kind, now)
+                sent = self._sent[kind]
+                if len(sent) < self._quota[kind]:
+                    sent.append(now)
+                    return
+                wait = sent[0] + QUOTA_WINDOW - now
+            metrics.inc("sheets_throttled_total", kind=kind)
+            time.sleep(max(wait, 0.05))
+
+    def _expire(self, kind, now):
+        sent = self._sent[kind]
+        while sent and sent[0] <= now - QUOTA_WINDOW:
+            sent.popleft()
+
+    def _call(self, kind, op, sheet_name, func):
+        """ينفذ طلباً واحداً مع قياس زمنه، ويعيده بتأخير متزايد عشوائي عند خطأ الحصة."""
+        for attempt in range(MAX_RETRIES + 1):
+            self._acquire(kind)
+            try:
+                with metrics.timer("sheets_request_seconds", op=op, sheet=sheet_name):
+                    return func()
+            except APIError as e:
+                if _status_of(e) != 429:
+                    raise
+                if attempt == MAX_RETRIES:
+                    raise SheetsQuotaError(op) from e
+                # نصف المدة ثابت والنصف عشوائي حتى لا تعود كل الطلبات المرفوضة معاً
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                metrics.inc("sheets_retries_total", op=op)
+                logger.warning("تجاوز حصة Google Sheets (%s)، إعادة المحاولة بعد %.1f ثانية.", op, delay)
+                time.sleep(delay)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _status_of(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "code", None)
+
+
+def _quote_title(title):
+    return "'{}'".format(title.replace("'", "''"))
+
+
+def _values_frame(values):
+    """يحول قيم ورقة (صفوف غير متساوية الطول، الأول للعناوين) إلى DataFrame كما يفعل conn.read."""
+    if not values:
+        return pd.DataFrame()
+    width = max(len(row) for row in values)
+    rect = [list(row) + [""] * (width - len(row)) for row in values]
+    # الصفوف الفارغة تُحذف مع إبقاء موضعها في الفهرس (رقم الصف في الورقة = الفهرس + 2)
+    df = TextParser(rect).read().dropna(how="all", axis=0)
+    # أعمدة بلا عنوان ولا قيم
+    empty = [c for c in df.columns if str(c).startswith("Unnamed") and df[c].isna().all()]
+    return df.drop(columns=empty)
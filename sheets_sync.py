@@ -0,0 +1,498 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from gspread.exceptions import WorksheetNotFound
+
+import metrics
+import schema
+from ledger_store import SHEET_COLUMNS, SUMMARY_SHEET, archive_sheet_name, normalize_sheet, sheet_header_of
+
+logger = logging.getLogger(__name__)
+
+# --- إعدادات المزامنة ---
+RETRY_DELAY = 5.0  # ثواني الانتظار قبل إعادة محاولة كتابة فاشلة
+REFRESH_MIN_BUDGET = 10  # لا يبدأ التحديث الدوري إذا بقي من حصة القراءة أقل من هذا (تُترك للعمليات)
+REFRESH_INTERVAL = float(os.environ.get("JAK_REFRESH_INTERVAL", "60"))  # ثواني بين قراءتين دوريتين للأوراق (0 لتعطيلها)
+# في الملف المشترك (JAK_SHARED_CACHE) عملية واحدة فقط تقرأ من Google Sheets: قائد بحجز يتجدد مع كل دورة
+LEADER_LEASE = "sheets-refresh"  # اسم الحجز في جدول leases
+LEADER_LEASE_TTL = max(3 * REFRESH_INTERVAL, 30.0)  # ثواني بعد آخر تجديد تأخذ بعدها عملية أخرى القيادة
+HYDRATE_WAIT = 60.0  # ثواني انتظار تحميل القائد الأول قبل أن تحمّل العملية بنفسها
+# -----------------------------
+
+
+def hydrate(store, client):
+    """يحمّل الورقتين من Google Sheets إلى المخزن المحلي.
+
+    إذا فشل التحميل وكان الملف المحلي نسخة سابقة صالحة، يستمر العمل منها؛
+    وإلا يُرفع الخطأ ليعرضه التطبيق. إذا كان في دفتر اليومية عمليات لم تصل إلى Sheets
+    (توقف قبل نسخها) تبقى النسخة المحلية الأحدث، وتُكمل SheetsMirror نسخها.
+    """
+    if store.journal_pending:
+        logger.warning("توجد عمليات محلية لم تُنسخ إلى Google Sheets، سيتم العمل من النسخة المحلية حتى تُنسخ.")
+        return False
+    if store.shared:
+        # الملف المشترك يُحمّل مرة واحدة لكل العمليات، وبعدها يحدّثه القائد في دورته (SheetsRefresher)
+        if store.hydrated:
+            return False
+        if not store.acquire_lease(LEADER_LEASE, LEADER_LEASE_TTL) and _wait_hydrated(store):
+            return False
+    try:
+        frames = client.read_many(SHEET_COLUMNS)
+        summaries = read_period_summaries(client)
+    except Exception:
+        if store.hydrated:
+            logger.exception("تعذر تحميل Google Sheets، سيتم العمل من النسخة المحلية.")
+            return False
+        raise
+    # الملخصات أولاً: مجاميع السجل تُبنى منها ومن الورقة الحالية
+    store.replace_period_summaries(summaries)
+    for name, df in frames.items():
+        store.replace_sheet(name, df)
+    if store.duplicate_driver_ids:
+        logger.warning("ترقيم مكرر في ورقة drivers، اعتُمد أول صف لكل منها: %s", ", ".join(store.duplicate_driver_ids))
+    store.mark_hydrated()
+    return True
+
+
+def _wait_hydrated(store, timeout=HYDRATE_WAIT):
+    """ينتظر أن تُكمل عملية أخرى التحميل الأول للملف المشترك، ويعيد False إذا لم تكمله في المهلة."""
+    deadline = time.monotonic() + timeout
+    while not store.hydrated:
+        if time.monotonic() > deadline:
+            logger.warning("لم يكتمل التحميل الأول من عملية أخرى، سيتم التحميل من هذه العملية.")
+            return False
+        time.sleep(0.2)
+    return True
+
+
+def read_period_summaries(client):
+    """يقرأ ورقة ملخص الفترات المؤرشفة، أو None إذا لم تُنشأ بعد (لا أرشيف)."""
+    try:
+        return client.read(SUMMARY_SHEET)
+    except WorksheetNotFound:
+        return None
+
+
+def load_archive(store, client, period):
+    """يحمّل حركات فترة مؤرشفة من ورقتها إلى المخزن المحلي، ويعيد عددها."""
+    return store.load_archived_period(period, client.read(archive_sheet_name(period)))
+
+
+def schedule_migrations(store, mirror):
+    """يطلب إعادة كتابة كل ورقة تنقصها أعمدة جديدة (مثل driver_id في سجل الحركات).
+
+    تحدث إعادة الكتابة مرة واحدة فقط، لأن العناوين المحفوظة تتحدث بعدها.
+    """
+    for name, columns in SHEET_COLUMNS.items():
+        header = store.sheet_header(name)
+        if header and any(c not in header for c in columns):
+            mirror.push(name)
+    # أرشفة لم تكتمل كتابة أوراقها قبل إيقاف التطبيق
+    for period in store.archive_periods(synced=False)['period']:
+        mirror.archive(period)
+
+
+class SheetsMirror:
+    """ينسخ تعديلات المخزن المحلي إلى Google Sheets في الخلفية.
+
+    الحركات الجديدة تُلحق بنهاية الورقة، وتعديلات المندوبين تُكتب في خلاياهم فقط،
+    فتبقى تكلفة كل عملية ثابتة مهما كبر السجل. العمليات المتراكمة تُدمج في طلب واحد
+    لكل ورقة، وتُعاد كتابة الورقة كاملة فقط عند الحاجة (ورقة بلا عناوين أو اتصال لا
+    يدعم الكتابة الجزئية).
+
+    الحركات القادمة من دفتر اليومية تُعلّم فيه بعد وصولها، وعند التشغيل يُعاد إلى الطابور
+    ما لم يصل منها قبل التوقف السابق (دون تكرار ما وصل فعلاً).
+
+    في الملف المشترك كل عملية تنسخ كتاباتها، وتسجل تقدمها في المخزن ليعرفه قائد التحديث.
+    """
+
+    def __init__(self, store, client):
+        self._store = store
+        self._client = client
+        self._rewrites = set()
+        self._archives = set()
+        self._appends = {name: [] for name in SHEET_COLUMNS}
+        self._driver_updates = {}
+        self._journal = set()  # أرقام عمليات دفتر اليومية التي تنتظر في الطابور
+        self._orphans = []  # عمليات دفتر تبنتها هذه العملية ولم تدخل الطابور بعد
+        self._adopt_lock = threading.Lock()
+        self._received = 0  # store.writes عند آخر طلب (الكتابات التي وصلت طلباتها إلى الطابور)
+        self._busy = True  # حتى تنتهي استعادة عمليات الدفتر
+        self._sequence = 0  # عدد الطلبات المستلمة منذ التشغيل
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="sheets-mirror", daemon=True)
+        self._thread.start()
+
+    # --- واجهة الإرسال (لا تنتظر انتهاء الكتابة) ---
+
+    def push(self, sheet_name):
+        """يطلب إعادة كتابة ورقة كاملة من المخزن المحلي."""
+        with self._cond:
+            self._rewrites.add(sheet_name)
+            self._received = self._store.writes
+            self._sequence += 1
+            self._cond.notify()
+
+    def archive(self, period):
+        """يطلب كتابة ورقة أرشيف فترة وورقة الملخص، ثم إعادة كتابة الورقة الحالية بدون الفترة."""
+        with self._cond:
+            self._archives.add(period)
+            self._received = self._store.writes
+            self._sequence += 1
+            self._cond.notify()
+
+    def append(self, sheet_name, rows, journal=None):
+        """يطلب إلحاق صفوف جديدة (قواميس بأسماء الأعمدة) بنهاية الورقة.
+
+        journal: أرقام عمليات دفتر اليومية التي تحملها الصفوف (تُعلّم بعد وصولها).
+        """
+        with self._cond:
+            self._appends[sheet_name].extend(rows)
+            self._journal.update(journal or ())
+            self._received = self._store.writes
+            self._sequence += 1
+            self._cond.notify()
+
+    def update_driver(self, driver_id, columns=None):
+        """يطلب كتابة خلايا مندوب واحد (كل الأعمدة إذا لم تُحدد) بقيمها الحالية في المخزن."""
+        with self._cond:
+            pending = self._driver_updates.setdefault(driver_id, set())
+            pending.update(columns or SHEET_COLUMNS["drivers"])
+            self._received = self._store.writes
+            self._sequence += 1
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """ينتظر حتى تُكتب كل التعديلات المعلقة، ويعيد True عند النجاح."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._has_pending() or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    @property
+    def pending(self):
+        """ملخص العمليات التي لم تُكتب بعد (للعرض)."""
+        with self._cond:
+            return {
+                "rewrites": sorted(self._rewrites),
+                "archives": sorted(self._archives),
+                "appends": {name: len(rows) for name, rows in self._appends.items() if rows},
+                "driver_updates": len(self._driver_updates),
+                "journal": len(self._journal),
+            }
+
+    @property
+    def idle(self):
+        """لا شيء في الطابور ولا كتابة جارية (كل التعديلات المحلية وصلت إلى Sheets)."""
+        with self._cond:
+            return not (self._has_pending() or self._busy)
+
+    @property
+    def sequence(self):
+        """رقم يزداد مع كل طلب جديد (لمعرفة هل وصلت تعديلات خلال فترة ما)."""
+        with self._cond:
+            return self._sequence
+
+    def _has_pending(self):
+        return bool(self._rewrites or self._archives or self._driver_updates or self._journal
+                    or any(self._appends.values()))
+
+    # --- خيط الكتابة ---
+
+    def _run(self):
+        self._recover()
+        while True:
+            with self._cond:
+                while not self._has_pending():
+                    self._cond.wait()
+                rewrites, self._rewrites = self._rewrites, set()
+                archives, self._archives = self._archives, set()
+                appends, self._appends = self._appends, {name: [] for name in SHEET_COLUMNS}
+                driver_updates, self._driver_updates = self._driver_updates, {}
+                journal, self._journal = self._journal, set()
+                received = self._received
+                self._busy = True
+            try:
+                self._store.report_mirror()
+                if journal:
+                    # بعد هذه اللحظة قد تصل الحركات دون أن نعرف (توقف أثناء الطلب): تُفحص عند الاستعادة
+                    self._store.mark_journal_sent(journal)
+                ok = self._write(rewrites, appends, driver_updates, archives)
+                if ok and journal:
+                    self._store.mark_journal_synced(journal)
+            except Exception:
+                logger.exception("خطأ غير متوقع في نسخ التعديلات إلى Google Sheets.")
+                ok = False
+            if not ok:
+                # إعادة العمليات الفاشلة إلى مقدمة الطابور
+                with self._cond:
+                    self._journal |= journal
+                    self._rewrites |= rewrites
+                    self._archives |= archives
+                    for name, rows in appends.items():
+                        self._appends[name][:0] = rows
+                    for driver_id, columns in driver_updates.items():
+                        self._driver_updates.setdefault(driver_id, set()).update(columns)
+            with self._cond:
+                self._busy = False
+                done = ok and not self._has_pending()
+                self._cond.notify_all()
+            try:
+                self._store.report_mirror(received if done else None)
+            except Exception:
+                logger.exception("تعذر تسجيل تقدم النسخ في الملف المشترك.")
+            if not ok:
+                time.sleep(RETRY_DELAY)
+
+    def _recover(self):
+        """يعيد إلى الطابور عند التشغيل عمليات دفتر اليومية التي لم تصل إلى Sheets قبل التوقف السابق.
+
+        يعيد المحاولة حتى ينجح (لا يُستبدل المخزن من Sheets طوال ذلك لأن الناسخ مشغول).
+        """
+        while True:
+            try:
+                self.adopt()
+                break
+            except Exception:
+                logger.exception("تعذر فحص العمليات المعلقة في Google Sheets، ستتم إعادة المحاولة.")
+                time.sleep(RETRY_DELAY)
+        with self._cond:
+            self._busy = False
+            self._cond.notify_all()
+
+    def adopt(self):
+        """يعيد إلى الطابور عمليات الدفتر المعلقة التي تتولاها هذه العملية (store.adopt_journal).
+
+        ما وصل منها فعلاً إلى Sheets قبل التوقف لا يُرسل مرة أخرى.
+        """
+        with self._adopt_lock:
+            known = {e["seq"] for e in self._orphans}
+            self._orphans += [e for e in self._store.adopt_journal() if e["seq"] not in known]
+            entries = self._orphans
+            if not entries:
+                return
+            landed = self._landed([e for e in entries if e["sent"]], entries)
+            with self._cond:
+                rows = [row for e in entries if e["seq"] not in landed for row in e["rows"]]
+                self._appends["transactions"][:0] = rows
+                for driver_id in dict.fromkeys(row["driver_id"] for e in entries for row in e["rows"]):
+                    # الرصيد قيمة مطلقة: كتابته مرة أخرى لا تضر
+                    self._driver_updates.setdefault(driver_id, set()).add("balance")
+                self._journal.update(e["seq"] for e in entries)
+                self._sequence += 1
+                self._cond.notify()
+            self._orphans = []
+        metrics.inc("journal_replayed_total", len(entries) - len(landed))
+        logger.warning("استعادة %d عملية لم تُنسخ إلى Google Sheets (%d منها وصلت سابقاً).",
+                       len(entries), len(landed))
+
+    def _landed(self, in_doubt, entries):
+        """أرقام العمليات التي بدأ إرسالها ووُجدت كل حركاتها في الورقة.
+
+        الحركة تُعرف بـ (المندوب، المبلغ، النوع، التوقيت)؛ ولأن حركات متطابقة قد تتكرر تُقارن الأعداد:
+        تُعد العملية واصلة إذا كان في الورقة من كل حركة ما لا يقل عن عددها محلياً (دون العمليات التي
+        لم يبدأ إرسالها).
+        """
+        if not in_doubt:
+            return set()
+        timestamps = {row["timestamp"] for e in in_doubt for row in e["rows"]}
+        sheet = normalize_sheet("transactions", self._client.read("transactions"))
+        sheet_times = schema.parse_timestamps(sheet["timestamp"]).dt.strftime(schema.TIMESTAMP_FORMAT)
+        sheet = sheet.assign(timestamp=sheet_times)[sheet_times.isin(timestamps)]
+        in_sheet = Counter(
+            (str(driver_id), schema.to_minor(amount), trans_type, timestamp)
+            for driver_id, amount, trans_type, timestamp in sheet[['driver_id', 'amount', 'type', 'timestamp']].itertuples(index=False, name=None)
+        )
+        expected = Counter(self._store.transaction_counts(timestamps))
+        expected.subtract(_row_keys(row for e in entries if not e["sent"] for row in e["rows"]))
+        return {
+            e["seq"] for e in in_doubt
+            if all(in_sheet[key] >= expected[key] for key in _row_keys(e["rows"]))
+        }
+
+    def _write(self, rewrites, appends, driver_updates, archives):
+        """ينفذ دفعة من العمليات، ويفرغ ما نجح منها من المدخلات. يعيد False عند الفشل."""
+        for sheet_name in list(appends):
+            if appends[sheet_name] and self._store.sheet_header(sheet_name) is None:
+                rewrites.add(sheet_name)
+        if driver_updates and self._store.sheet_header("drivers") is None:
+            rewrites.add("drivers")
+
+        try:
+            # الأرشيف والملخص يُكتبان قبل حذف حركات الفترة من الورقة الحالية
+            for period in sorted(archives):
+                self._client.write(archive_sheet_name(period), self._store.archived_transactions(period), create=True)
+            if archives:
+                self._client.write(SUMMARY_SHEET, self._store.period_summaries(), create=True)
+                rewrites.add("transactions")
+
+            for sheet_name in sorted(rewrites):
+                df = self._store.read_sheet(sheet_name)
+                self._client.write(sheet_name, df)
+                self._store.set_sheet_header(sheet_name, sheet_header_of(df))
+                if sheet_name == "drivers":
+                    self._store.reset_driver_sheet_rows()
+                # إعادة الكتابة تشمل كل ما سبقها من إلحاق وتعديل لهذه الورقة
+                appends[sheet_name] = []
+                if sheet_name == "drivers":
+                    driver_updates.clear()
+                rewrites.discard(sheet_name)
+            if archives:
+                self._store.mark_archives_synced(archives)
+                archives.clear()
+
+            # المندوبون الجدد أولاً حتى تُعرف صفوفهم قبل تعديل خلاياهم
+            for sheet_name in ("drivers", "transactions"):
+                rows = appends.get(sheet_name)
+                if not rows:
+                    continue
+                if self._client.worksheet(sheet_name) is None:
+                    rewrites.add(sheet_name)
+                    return self._write(rewrites, appends, driver_updates, archives)
+                header = self._store.sheet_header(sheet_name)
+                first_row = _first_appended_row(
+                    self._client.append_rows(sheet_name, [[_cell(row.get(c)) for c in header] for row in rows])
+                )
+                if sheet_name == "drivers" and first_row is not None:
+                    for offset, row in enumerate(rows):
+                        self._store.set_driver_sheet_row(row["driver_id"], first_row + offset)
+                appends[sheet_name] = []
+
+            if driver_updates:
+                if self._client.worksheet("drivers") is None:
+                    rewrites.add("drivers")
+                    return self._write(rewrites, appends, driver_updates, archives)
+                header = self._store.sheet_header("drivers")
+                cells = []
+                for driver_id, (sheet_row, driver) in self._store.driver_sheet_rows(driver_updates).items():
+                    if sheet_row is None:
+                        continue
+                    for col in driver_updates[driver_id]:
+                        if col in header:
+                            cells.append((sheet_row, header.index(col) + 1, _cell(driver[col])))
+                if cells:
+                    self._client.update_cells("drivers", cells)
+                driver_updates.clear()
+        except Exception:
+            logger.exception("فشل نسخ التعديلات إلى Google Sheets، ستتم إعادة المحاولة.")
+            return False
+        return True
+
+
+class SheetsRefresher:
+    """يعيد قراءة الورقتين من Google Sheets على فترات ثابتة في خيط واحد للعملية كلها.
+
+    الجلسات تقرأ دائماً من المخزن المحلي دون انتظار، والمحتوى الجديد يُستبدل فيه دفعة واحدة
+    (وفقط إذا تغير). لا يُستبدل شيء ما دامت تعديلات محلية لم تصل إلى Sheets بعد أو وصلت أثناء
+    القراءة، وإذا فشلت القراءة تبقى آخر نسخة ناجحة في الخدمة.
+
+    في الملف المشترك تقرأ العملية القائدة وحدها (الباقي يعيد follower)، وتنتظر أيضاً كتابات
+    العمليات الأخرى حتى تصل، وتتولى نسخ العمليات المعلقة لعملية توقفت.
+    """
+
+    def __init__(self, store, client, mirror, interval=REFRESH_INTERVAL):
+        self._store = store
+        self._client = client
+        self._mirror = mirror
+        self.interval = interval
+        self.last_success = None  # وقت آخر قراءة ناجحة (time.time)
+        self.last_error = None  # (الوقت، رسالة الخطأ) لآخر دورة فاشلة (قراءة أو استبدال) بعد آخر نجاح
+        self._lock = threading.Lock()  # دورة واحدة في كل مرة (الخيط أو طلب يدوي)
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._run, name="sheets-refresher", daemon=True)
+            self._thread.start()
+
+    def refresh(self):
+        """دورة تحديث واحدة، وتعيد نتيجتها: swapped أو unchanged أو pending أو throttled أو conflict أو error
+        أو follower (عملية أخرى هي القائد)."""
+        with self._lock, metrics.timer("refresh_seconds"):
+            result = self._refresh()
+        metrics.inc("refresh_total", result=result)
+        return result
+
+    def _refresh(self):
+        if self._store.shared:
+            if not self._store.acquire_lease(LEADER_LEASE, max(3 * self.interval, LEADER_LEASE_TTL)):
+                return "follower"
+            self._mirror.adopt()
+        # الترتيب مهم: تقدم النسخ والنسخ ورقم الطابور أولاً، ثم التأكد من أن الطابور فارغ
+        backlog = self._store.foreign_backlog()
+        versions = {name: self._store.data_version(name) for name in SHEET_COLUMNS}
+        sequence = self._mirror.sequence
+        if not self._mirror.idle or any(written > mirrored for written, mirrored, _ in backlog.values()):
+            return "pending"
+        if self._client.remaining("read") < REFRESH_MIN_BUDGET:
+            return "throttled"
+        try:
+            frames = self._client.read_many(SHEET_COLUMNS)
+        except Exception as e:
+            logger.warning("تعذر تحديث البيانات من Google Sheets، تبقى النسخة الحالية في الخدمة: %s", e)
+            self.last_error = (time.time(), str(e))
+            return "error"
+        if self._mirror.sequence != sequence or not self._mirror.idle or self._store.foreign_backlog() != backlog:
+            return "conflict"
+        try:
+            changed = self._store.replace_sheets(frames, expected_versions=versions)
+        except Exception as e:
+            logger.exception("تعذر تطبيق البيانات المقروءة من Google Sheets، تبقى النسخة الحالية في الخدمة.")
+            self.last_error = (time.time(), str(e))
+            return "error"
+        if changed is None:
+            return "conflict"
+        # النجاح بعد تطبيق البيانات فقط: قراءة لم تُطبق لا تجعل المعروض حديثاً
+        self.last_success, self.last_error = time.time(), None
+        return "swapped" if changed else "unchanged"
+
+    @property
+    def status(self):
+        """ملخص الحالة للعرض."""
+        return {
+            "interval": self.interval, "last_success": self.last_success, "last_error": self.last_error,
+            "leader": self._store.lease_holder(LEADER_LEASE) == self._store.owner,
+        }
+
+    def _run(self):
+        # الملف المشترك لا يُعاد تحميله عند التشغيل، فتبدأ أول دورة فوراً
+        delay = 0 if self._store.shared else self.interval
+        while True:
+            time.sleep(delay)
+            delay = self.interval
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.exception("خطأ غير متوقع في التحديث الدوري من Google Sheets.")
+                self.last_error = (time.time(), str(e))
+
+
+def _first_appended_row(response):
+    """رقم أول صف أُضيف من استجابة append_rows (أو None إذا لم يُعرف)."""
+    updated_range = (response or {}).get("updates", {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
+
+
+def _row_keys(rows):
+    """مفاتيح مقارنة الحركات (قواميس بأعمدة الورقة) مع تكرارها."""
+    return Counter(
+        (str(row["driver_id"]), schema.to_minor(row["amount"]), row["type"], row["timestamp"]) for row in rows
+    )
+
+
+def _cell(value):
+    """يحول قيمة إلى شكل مقبول في خلية Google Sheets."""
+    if value is None:
+        return ""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return ""
+    return value
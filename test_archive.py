@@ -0,0 +1,68 @@
+"""أرشفة الفترات المغلقة: نقل الحركات إلى الأرشيف مع ملخص الفترة، وكتابة أوراقها، وتحميلها من جديد."""
+import pytest
+
+import sheets_sync
+from ledger_store import LedgerStore, archive_sheet_name
+
+# البيانات المشتركة (conftest): ثلاث حركات في 2025-01 وحركة في 2025-02
+NOW = "2025-04-15"
+
+
+def test_archivable_periods_keep_the_open_ones(store):
+    assert store.archivable_periods(now=NOW) == {"2025-01": 3, "2025-02": 1}
+    assert store.archivable_periods(now="2025-03-10") == {"2025-01": 3}
+    assert store.archivable_periods(keep=3, now=NOW) == {}
+
+
+def test_archive_period_moves_rows_and_keeps_totals(store):
+    totals = store.ledger_totals()
+    deliveries = store.deliveries_per_driver("خصم توصيلة")
+
+    assert store.archive_period("2025-01") == 3
+    assert len(store.read_sheet("transactions")) == 1
+    assert len(store.archived_transactions("2025-01")) == 3
+    assert store.ledger_totals() == totals
+    assert store.deliveries_per_driver("خصم توصيلة").equals(deliveries)
+    assert store.archivable_periods(now=NOW) == {"2025-02": 1}
+
+    summaries = store.period_summaries().set_index(["driver_id", "type"])
+    assert set(store.period_summaries()["period"]) == {"2025-01"}
+    assert summaries.loc[("J1", "شحن رصيد"), "total"] == 100.0
+    assert summaries["count"].sum() == 3
+    [archive] = store.archive_periods(synced=False).to_dict("records")
+    assert archive["period"] == "2025-01" and archive["rows"] == 3 and archive["loaded"]
+
+
+def test_archiving_twice_adds_late_rows_to_the_summary(store):
+    store.archive_period("2025-01")
+    store.apply_operations([(None, [("J2", 5.0, "شحن رصيد", False, False)])], "2025-01-20 08:00:00")
+    assert store.archive_period("2025-01") == 1
+    summaries = store.period_summaries().set_index(["driver_id", "type"])
+    assert summaries.loc[("J2", "شحن رصيد"), "total"] == 15.0
+    assert summaries.loc[("J2", "شحن رصيد"), "count"] == 2
+    assert store.archive_periods()["rows"].tolist() == [4]
+
+
+def test_archive_is_written_to_sheets_and_hydrates_back(store, client, conn, mirror, tmp_path):
+    totals = store.ledger_totals()
+    store.archive_period("2025-01")
+    mirror.archive("2025-01")
+    assert mirror.flush(10)
+
+    assert len(conn.frame(archive_sheet_name("2025-01"))) == 3
+    assert len(conn.frame("transactions")) == 1
+    assert conn.frame("period_summaries")["count"].astype(int).sum() == 3
+    assert store.archive_periods(synced=False).empty
+
+    fresh = LedgerStore(str(tmp_path / "fresh.db"))
+    sheets_sync.hydrate(fresh, client)
+    assert fresh.ledger_totals() == totals
+    [archive] = fresh.archive_periods().to_dict("records")
+    assert archive["period"] == "2025-01" and archive["synced"] and not archive["loaded"]
+    assert fresh.reconcile_balances(use_snapshot=False)[1]["mismatches"] == 0
+
+    # حركات متأخرة لفترة غير محملة محلياً لا تُؤرشف قبل تحميل ورقتها
+    with pytest.raises(ValueError):
+        fresh.archive_period("2025-01")
+    assert sheets_sync.load_archive(fresh, client, "2025-01") == 3
+    assert len(fresh.archived_transactions("2025-01")) == 3
@@ -0,0 +1,136 @@
+"""العمليات المجمعة: دفعات التوصيلات واستيراد المندوبين."""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from bulk_ops import (
+    REJECT_BAD_COUNT, REJECT_BAD_ID, REJECT_BAD_STATUS, REJECT_BALANCE, REJECT_DUPLICATE_IN_FILE, REJECT_EXISTS,
+    REJECT_INACTIVE, REJECT_MISSING_ID, REJECT_MISSING_NAME, REJECT_UNKNOWN, diff_driver_edits, parse_delivery_batch,
+    parse_driver_import, read_driver_file, settle_delivery_batch, validate_delivery_batch, validate_driver_import,
+)
+
+
+def _batch(rows):
+    return pd.DataFrame([{"line": i, "driver_id": d, "count": c} for i, (d, c) in enumerate(rows, 1)])
+
+
+def test_settle_reports_driver_disabled_after_validation(store, writer):
+    accepted, rejected = validate_delivery_batch(_batch([("J1", 2), ("J2", 0.5)]), store.frame("drivers"), 15.0)
+    assert list(accepted["driver_id"]) == ["J1"]
+    store.update_driver("J1", {"is_active": False})
+
+    changes = [("J1", -15.0, "خصم توصيلة", True, True)] * 2
+    accepted, rejected = settle_delivery_batch(accepted, rejected, writer.apply(changes), 15.0)
+    assert accepted.empty
+    late = rejected[rejected["line"].isna()]
+    assert list(late["driver_id"]) == ["J1"] and list(late["reason"]) == [REJECT_INACTIVE]
+
+
+def test_settle_reports_balance_spent_by_another_session(store, writer):
+    accepted, rejected = validate_delivery_batch(_batch([("J1", 5)]), store.frame("drivers"), 15.0)
+    writer.apply([("J1", -30.0, "شحن رصيد", False, False)])  # الرصيد 55 يكفي ثلاث توصيلات فقط
+
+    changes = [("J1", -15.0, "خصم توصيلة", True, True)] * 5
+    accepted, rejected = settle_delivery_batch(accepted, rejected, writer.apply(changes), 15.0)
+    assert list(accepted["count"]) == [3]
+    assert accepted.loc[0, "balance_after"] == 10.0
+    assert list(rejected["count"]) == [2] and list(rejected["reason"]) == [REJECT_BALANCE]
+
+
+IMPORT_CSV = (
+    "﻿الترقيم;الاسم;رقم اللوحة;الواتساب;الحالة\n"
+    "J20;مندوب جديد;1234AB20;0022212345678;مفعل\n"      # 2: مقبول
+    "J21;مندوب معطل;;;لا\n"                              # 3: مقبول (معطل)
+    ";بلا ترقيم;;;\n"                                   # 4: الترقيم فارغ
+    "J 22;;;;\n"                                        # 5: ترقيم غير صالح واسم فارغ
+    "J1;موجود;;;\n"                                     # 6: موجود مسبقاً
+    "J23;الأول;;;\n"                                    # 7: مكرر في الملف
+    "J23;الثاني;;;ربما\n"                               # 8: مكرر في الملف وقيمة تفعيل غير مفهومة
+    "J24;رقم بأصفار;;04567890;\n"                       # 9: مقبول (الأصفار الأولى تبقى)
+).encode("utf-8")
+
+
+@pytest.fixture
+def checked_import(store):
+    import_df = parse_driver_import(read_driver_file("drivers.csv", IMPORT_CSV))
+    return validate_driver_import(import_df, store.frame("drivers"))
+
+
+def test_import_file_columns_and_values():
+    import_df = parse_driver_import(read_driver_file("drivers.csv", IMPORT_CSV))
+    assert list(import_df.columns) == ["line", "driver_id", "name", "bike_plate", "whatsapp", "notes", "is_active"]
+    assert import_df["line"].tolist() == list(range(2, 10))
+    assert import_df.loc[7, "whatsapp"] == "04567890"
+    assert import_df["notes"].isna().all()
+
+
+def test_import_validation_reasons(checked_import):
+    accepted, rejected = checked_import
+    reasons = dict(zip(rejected["line"], rejected["reason"]))
+    assert reasons == {
+        4: REJECT_MISSING_ID,
+        5: f"{REJECT_BAD_ID}، {REJECT_MISSING_NAME}",
+        6: REJECT_EXISTS,
+        7: REJECT_DUPLICATE_IN_FILE,
+        8: f"{REJECT_DUPLICATE_IN_FILE}، {REJECT_BAD_STATUS}",
+    }
+
+
+def test_import_accepted_rows(checked_import):
+    accepted, _ = checked_import
+    assert accepted["driver_id"].tolist() == ["J20", "J21", "J24"]
+    assert accepted["is_active"].tolist() == [True, False, True]
+    assert (accepted["balance"] == 0.0).all()
+    assert "line" not in accepted.columns
+
+
+def test_imported_drivers_are_appended_to_the_sheet(store, mirror, conn, checked_import):
+    accepted, _ = checked_import
+    rows = accepted.to_dict("records")
+    store.insert_drivers(rows)
+    mirror.append("drivers", rows)
+    assert mirror.flush(10)
+
+    sheet = conn.frame("drivers")
+    assert sheet["driver_id"].tolist() == ["J1", "J2", "J3", "J20", "J21", "J24"]
+    assert store.driver_sheet_rows(["J24"])["J24"][0] == 7
+    assert store.get_driver("J21")["is_active"] is False
+
+
+def test_import_is_all_or_nothing(store, checked_import):
+    accepted, _ = checked_import
+    # أُضيف أحد الترقيمات من جلسة أخرى بعد التحقق
+    store.insert_drivers([dict(accepted.iloc[1])])
+    with pytest.raises(sqlite3.IntegrityError):
+        store.insert_drivers(accepted.to_dict("records"))
+    assert store.get_driver("J20") is None
+
+
+def test_bulk_edit_diff():
+    original = pd.DataFrame({
+        "driver_id": ["J1", "J2", "J3"], "name": ["أ", "ب", "ج"], "bike_plate": ["1", "2", None],
+        "whatsapp": ["11", "22", "33"], "notes": [None, "", "ملاحظة"], "is_active": [True, True, False],
+    })
+    edited = original.copy()
+    edited.loc[0, "name"] = " أحمد "
+    edited.loc[1, "notes"] = None  # فارغ قبل وبعد: ليس تعديلاً
+    edited.loc[2, ["name", "is_active"]] = ["", True]
+    updates, rejected = diff_driver_edits(original, edited)
+    assert updates == {"J1": {"name": "أحمد"}}
+    assert rejected.to_dict("records") == [{"driver_id": "J3", "reason": REJECT_MISSING_NAME}]
+
+
+def test_delivery_batch_validation(store):
+    batch = parse_delivery_batch("الترقيم,العدد\nJ1,2\nJ1 3\nJ2\nJ3\nJ9\nJ1;x\n")
+    assert batch["line"].tolist() == [2, 3, 4, 5, 6, 7]
+    accepted, rejected = validate_delivery_batch(batch, store.frame("drivers"), 15.0)
+    assert dict(zip(rejected["line"], rejected["reason"])) == {
+        4: REJECT_BALANCE, 5: REJECT_INACTIVE, 6: REJECT_UNKNOWN, 7: REJECT_BAD_COUNT,
+    }
+    # سطرا J1 يُجمعان قبل التحقق من الرصيد: 5 توصيلات × 15 من 85
+    assert accepted[["driver_id", "count", "amount", "balance_after"]].values.tolist() == [["J1", 5, -75.0, 10.0]]
+
+    batch = parse_delivery_batch("J1,4\nJ1,2\n")
+    accepted, rejected = validate_delivery_batch(batch, store.frame("drivers"), 15.0)
+    assert accepted.empty and rejected["reason"].tolist() == [REJECT_BALANCE] * 2
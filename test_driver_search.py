@@ -0,0 +1,78 @@
+"""ترتيب نتائج البحث المقترح عن المندوبين (DriverSearch)."""
+import pandas as pd
+import pytest
+
+from driver_index import DriverSearch, normalize_text, normalize_whatsapp
+
+DRIVERS = [
+    # driver_id، الاسم، اللوحة، الواتساب
+    ("J100", "سيدي محمد ولد أحمد", "5512AB01", "22245671234"),
+    ("J10", "فاطمة بنت الشيخ", "1299AB02", "36661200"),
+    ("J1", "أحمد سالم", "7788AB03", "44412"),
+    ("K7", "مُحَمَّد الأمين", "12AB9999", "27770000"),
+    ("J2", "عيشة منت أحمدو", "8800AB04", None),
+]
+
+
+@pytest.fixture
+def search():
+    df = pd.DataFrame(DRIVERS, columns=["driver_id", "name", "bike_plate", "whatsapp"])
+    return DriverSearch(df).search
+
+
+def test_id_prefix_shortest_first(search):
+    assert search("j1") == ["J1", "J10", "J100"]
+    assert search("J10") == ["J10", "J100"]
+
+
+def test_whatsapp_suffix_before_plate_prefix(search):
+    # J1: رقمه ينتهي بـ 12؛ J10 و K7: لوحتاهما تبدآن بـ 12
+    assert search("12") == ["J1", "J10", "K7"]
+    assert search("12ab") == ["K7"]
+
+
+def test_whatsapp_with_country_code_and_arabic_digits(search):
+    assert search("1234") == ["J100"]
+    assert search("0022245671234") == ["J100"]
+    assert search("٤٥٦٧١٢٣٤") == ["J100"]
+
+
+def test_name_word_prefix_shortest_first(search):
+    # "أحمد" كلمة كاملة في J100، وبداية "أحمدو" في J2، وبداية "أحمد سالم" في J1
+    assert search("أحمد") == ["J100", "J2", "J1"]
+    assert search("احمد") == search("أحمد")
+    assert search("ولد احمد") == ["J100"]
+
+
+def test_diacritics_and_letter_forms_ignored(search):
+    assert search("محمد الامين") == ["K7"]
+    assert search("فاطمه") == ["J10"]
+    assert search("عيشه منت") == ["J2"]
+
+
+def test_fuzzy_matches_come_after_prefix_matches(search):
+    assert search("فاطنة") == ["J10"]  # خطأ حرف واحد
+    # J100 يطابق بداية كلمة من الاسم، و K7 قريب منه فقط
+    assert search("محمد ولد") == ["J100", "K7"]
+
+
+def test_limit_and_no_match(search):
+    assert search("j", limit=2) == ["J1", "J2"]
+    assert search("j", limit=0) == []
+    assert search("") == []
+    assert search("x") == []
+
+
+def test_repeated_driver_id_indexed_once():
+    df = pd.DataFrame(DRIVERS + [("J1", "مكرر", "0000AB00", "11111111")],
+                      columns=["driver_id", "name", "bike_plate", "whatsapp"])
+    search = DriverSearch(df).search
+    assert search("j1") == ["J1", "J10", "J100"]
+    assert search("مكرر") == []
+
+
+def test_normalizers():
+    assert normalize_text("  مُحَمَّد_ولد  (أحمد) ") == "محمد ولد احمد"
+    assert normalize_whatsapp(22245671234.0) == "45671234"
+    assert normalize_whatsapp("+222 4567-1234") == "45671234"
+    assert normalize_whatsapp(None) == ""
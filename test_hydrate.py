@@ -0,0 +1,36 @@
+"""التحميل الأول من Google Sheets إلى المخزن المحلي."""
+import pandas as pd
+
+import sheets_sync
+from fake_sheets import FakeGSheetsConnection
+from ledger_store import DRIVER_COLUMNS, TRANSACTION_COLUMNS, LedgerStore
+from sheets_client import SheetsClient
+
+
+def _hydrated(tmp_path, drivers):
+    transactions = pd.DataFrame(columns=TRANSACTION_COLUMNS)
+    conn = FakeGSheetsConnection({"drivers": drivers, "transactions": transactions})
+    store = LedgerStore(str(tmp_path / "ledger.db"))
+    sheets_sync.hydrate(store, SheetsClient(conn, "test", read_quota=1000, write_quota=1000))
+    return store
+
+
+def test_repeated_driver_id_keeps_first_row(tmp_path):
+    drivers = pd.DataFrame([
+        ["J1", "الأول", "1111AB01", "22222222", "", True, 100.0],
+        ["J1", "المكرر", "2222AB02", "33333333", "", True, 200.0],
+        ["J2", "مندوب 2", "3333AB03", "44444444", "", True, 0.0],
+    ], columns=DRIVER_COLUMNS)
+    store = _hydrated(tmp_path, drivers)
+
+    assert store.hydrated
+    assert store.get_driver("J1")['name'] == "الأول"
+    assert store.get_driver("J1")['balance'] == 100.0
+    assert store.driver_sheet_rows(["J1"])["J1"][0] == 2
+    assert len(store.read_sheet("drivers")) == 2
+    assert store.duplicate_driver_ids == ["J1"]
+
+
+def test_no_duplicates_reported_for_clean_sheet(tmp_path):
+    drivers = pd.DataFrame([["J1", "مندوب 1", "1111AB01", "22222222", "", True, 0.0]], columns=DRIVER_COLUMNS)
+    assert _hydrated(tmp_path, drivers).duplicate_driver_ids == []
@@ -0,0 +1,89 @@
+"""دفتر اليومية: منع تكرار العمليات بمفتاحها، واستعادة ما لم يصل إلى Sheets بعد إعادة التشغيل."""
+from datetime import datetime
+
+import sheets_sync
+from ledger_store import LedgerStore
+
+# توقيت حديث: العمليات المنسوخة الأقدم من مدة الاحتفاظ تُحذف من الدفتر مع مفاتيحها
+TIMESTAMP = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _delivery(driver_id):
+    return (driver_id, -15.0, "خصم توصيلة", True, True)
+
+
+def _restart(store, client):
+    """مخزن وناسخ جديدان على نفس الملف، كما بعد إعادة تشغيل التطبيق."""
+    restarted = LedgerStore(store.db_path)
+    assert sheets_sync.hydrate(restarted, client) is False  # لا يُستبدل المحلي وفيه عمليات معلقة
+    return restarted, sheets_sync.SheetsMirror(restarted, client)
+
+
+def test_repeated_op_key_is_applied_once(store, writer, mirror, conn):
+    first = writer.apply([_delivery("J1")], op_key="click-1")
+    second = writer.apply([_delivery("J1")], op_key="click-1")
+    assert second == first
+    assert store.get_driver("J1")['balance'] == 70.0
+    assert len(store.read_driver_transactions("J1")) == 3
+
+    assert mirror.flush(10)
+    assert len(conn.frame("transactions")) == 5
+    assert store.journal_pending == 0
+
+
+def test_repeated_op_key_in_one_batch(store):
+    outcomes = store.apply_operations([("k", [_delivery("J1")]), ("k", [_delivery("J1")]), (None, [_delivery("J1")])],
+                                      TIMESTAMP)
+    assert [seq is not None for _, seq in outcomes] == [True, False, True]
+    assert outcomes[1][0] == outcomes[0][0]
+    assert store.get_driver("J1")['balance'] == 55.0
+
+
+def test_different_op_keys_are_separate_operations(store, writer):
+    writer.apply([_delivery("J1")], op_key="a")
+    writer.apply([_delivery("J1")], op_key="b")
+    assert store.get_driver("J1")['balance'] == 55.0
+
+
+def test_pending_operations_replayed_after_restart(store, client, conn):
+    store.apply_operations([("op-1", [_delivery("J1")]), ("op-2", [("J2", 40.0, "شحن رصيد", False, False)])],
+                           TIMESTAMP)
+    assert store.journal_pending == 2
+    assert len(conn.frame("transactions")) == 4  # لم يُنسخ شيء قبل التوقف
+
+    restarted, mirror = _restart(store, client)
+    assert restarted.get_driver("J2")['balance'] == 50.0
+    assert mirror.flush(10)
+    assert restarted.journal_pending == 0
+    sheet = conn.frame("transactions")
+    assert len(sheet) == 6
+    balances = conn.frame("drivers").set_index("driver_id")['balance'].astype(float)
+    assert balances["J1"] == 70.0 and balances["J2"] == 50.0
+
+    # المفتاح محفوظ بعد إعادة التشغيل: إعادة إرسال العملية لا تخصم مرة ثانية
+    [(results, seq)] = restarted.apply_operations([("op-1", [_delivery("J1")])], TIMESTAMP)
+    assert seq is None and results[0][2] == "applied"
+    assert restarted.get_driver("J1")['balance'] == 70.0
+
+
+def test_sent_operation_that_landed_is_not_appended_again(store, client, conn):
+    [(results, seq)] = store.apply_operations([("op-1", [_delivery("J1")])], TIMESTAMP)
+    # توقف بعد وصول الطلب إلى Sheets وقبل تسجيل وصوله
+    store.mark_journal_sent([seq])
+    conn.client._select_worksheet(worksheet="transactions").append_rows(
+        [[results[0][1][c] for c in ["driver_name", "amount", "type", "timestamp", "driver_id"]]])
+
+    restarted, mirror = _restart(store, client)
+    assert mirror.flush(10)
+    assert restarted.journal_pending == 0
+    assert len(conn.frame("transactions")) == 5
+
+
+def test_sent_operation_that_did_not_land_is_replayed(store, client, conn):
+    [(_, seq)] = store.apply_operations([("op-1", [_delivery("J1")])], TIMESTAMP)
+    store.mark_journal_sent([seq])
+
+    restarted, mirror = _restart(store, client)
+    assert mirror.flush(10)
+    assert len(conn.frame("transactions")) == 5
+    assert restarted.journal_pending == 0
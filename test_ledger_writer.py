@@ -0,0 +1,69 @@
+"""الكاتب الوحيد للأرصدة: رفض الخصم عند عدم كفاية الرصيد أو تعطيل الحساب، ونتائج update_balance."""
+import pytest
+
+import data_access
+
+
+def _delivery(driver_id, amount=-15.0):
+    return (driver_id, amount, "خصم توصيلة", True, True)
+
+
+def test_deduction_rejected_for_insufficient_funds(store, writer):
+    [(balance, transaction, status)] = writer.apply([_delivery("J2")])
+    assert (balance, transaction, status) == (10.0, None, "rejected")
+    assert store.get_driver("J2")['balance'] == 10.0
+    assert len(store.read_driver_transactions("J2")) == 1
+
+
+def test_deductions_checked_against_running_balance(store, writer):
+    results = writer.apply([_delivery("J1", -40.0)] * 3)
+    assert [status for _, _, status in results] == ["applied", "applied", "rejected"]
+    assert store.get_driver("J1")['balance'] == 5.0
+
+
+def test_charge_does_not_require_funds(writer):
+    [(balance, transaction, status)] = writer.apply([("J2", -20.0, "شحن رصيد", False, False)])
+    assert transaction is not None
+    assert (balance, status) == (-10.0, "applied")
+
+
+def test_unknown_driver(writer):
+    assert writer.apply([("J9", 100.0, "شحن رصيد", False, False)]) == [(None, None, "not_found")]
+
+
+def test_delivery_rejected_for_inactive_driver(store, writer):
+    assert writer.apply([_delivery("J3")]) == [(50.0, None, "inactive")]
+    assert store.get_driver("J3")['balance'] == 50.0
+
+
+def test_driver_disabled_after_selection(store, writer):
+    # المندوب حُدد وهو مفعل، ثم عُطل من جلسة أخرى قبل الضغط على الزر
+    store.update_driver("J1", {"is_active": False})
+    assert writer.apply([_delivery("J1")]) == [(85.0, None, "inactive")]
+    [(_, _, status)] = writer.apply([("J1", 20.0, "شحن رصيد", False, False)])
+    assert status == "applied"
+
+
+@pytest.fixture
+def update_balance(writer, monkeypatch):
+    monkeypatch.setattr(data_access, "get_writer", lambda: writer)
+    return data_access.update_balance
+
+
+def test_update_balance_results(update_balance):
+    assert update_balance("J1", -15.0, "خصم توصيلة") == ("applied", 70.0)
+    assert update_balance("J2", -15.0, "خصم توصيلة") == ("rejected", 10.0)
+    assert update_balance("J3", -15.0, "خصم توصيلة") == ("inactive", 50.0)
+    assert update_balance("J3", 15.0, "شحن رصيد") == ("applied", 65.0)
+    assert update_balance("J9", -15.0, "خصم توصيلة") == ("not_found", None)
+
+
+def test_journal_entry_without_status_replays(store):
+    # عملية سُجلت في الدفتر قبل إضافة الحالة إلى النتائج تُعاد نتائجها بحالة مستنتجة
+    store._conn.execute(
+        "INSERT INTO journal (op_key, created_at, results, rows, sent, synced, owner) VALUES (?, ?, ?, ?, 1, 1, ?)",
+        ("old-key", "2025-02-01 12:00:00", '[[10.0, null], [null, null]]', "[]", store.owner),
+    )
+    [(results, seq)] = store.apply_operations([("old-key", [_delivery("J2"), _delivery("J9")])], "2025-02-02 00:00:00")
+    assert seq is None
+    assert results == [(10.0, None, "rejected"), (None, None, "not_found")]
@@ -0,0 +1,68 @@
+"""مطابقة أرصدة المندوبين مع مجموع حركاتهم في السجل (كاملاً أو من آخر لقطة)."""
+from ledger_store import TRANSACTION_COLUMNS
+
+TIMESTAMP = "2025-03-01 09:00:00"
+
+
+def _insert_transaction(store, driver_id, amount):
+    """حركة تُضاف إلى السجل مباشرة دون تعديل الرصيد (كما لو عُدلت الورقة يدوياً)."""
+    with store._transaction():
+        store._conn.execute(
+            f"INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            ("يدوي", amount, "شحن رصيد", TIMESTAMP, driver_id),
+        )
+
+
+def test_consistent_ledger(store):
+    mismatches, summary = store.reconcile_balances()
+    assert mismatches.empty
+    assert summary["mode"] == "full" and summary["replayed"] == 4
+    assert summary["drivers"] == 3 and summary["mismatches"] == 0
+
+
+def test_balance_edited_without_transaction(store):
+    store.update_driver("J2", {"balance": 25.0})
+    mismatches, summary = store.reconcile_balances()
+    assert summary["mismatches"] == 1 and summary["total_difference"] == 15.0
+    [row] = mismatches.to_dict("records")
+    assert row["driver_id"] == "J2" and row["ledger_balance"] == 10.0 and row["status"] == "mismatch"
+
+
+def test_transactions_of_unknown_and_missing_drivers(store):
+    _insert_transaction(store, "J9", 30.0)
+    _insert_transaction(store, None, 5.0)
+    mismatches, summary = store.reconcile_balances()
+    assert summary["unknown_drivers"] == 1 and summary["mismatches"] == 0
+    assert summary["unattributed_transactions"] == 1
+    assert mismatches.to_dict("records")[0]["driver_id"] == "J9"
+
+
+def test_rounding_within_tolerance(store):
+    for _ in range(10):
+        store.apply_operations([(None, [("J1", 0.1, "شحن رصيد", False, False)])], TIMESTAMP)
+    assert store.get_driver("J1")['balance'] == 86.0
+    assert store.reconcile_balances()[1]["mismatches"] == 0
+
+
+def test_snapshot_replays_only_later_transactions(store):
+    store.take_balance_snapshot()
+    store.apply_operations([(None, [("J1", -15.0, "خصم توصيلة", True, True), ("J3", 20.0, "شحن رصيد", False, False)])],
+                           TIMESTAMP)
+    _, summary = store.reconcile_balances()
+    assert summary["mode"] == "snapshot" and summary["replayed"] == 2
+    assert summary["mismatches"] == 0
+
+    store.update_driver("J3", {"balance": 0.0})
+    from_snapshot, _ = store.reconcile_balances()
+    full, _ = store.reconcile_balances(use_snapshot=False)
+    assert from_snapshot.equals(full)
+    assert full.loc[0, "ledger_balance"] == 70.0
+
+
+def test_archiving_drops_snapshots_and_keeps_balances(store):
+    store.take_balance_snapshot()
+    store.archive_period("2025-01")
+    assert store.latest_balance_snapshot() is None
+    mismatches, summary = store.reconcile_balances()
+    assert summary["mode"] == "full" and summary["replayed"] == 1
+    assert mismatches.empty
@@ -0,0 +1,49 @@
+"""أرقام صفوف المندوبين في الورقة عندما تحتوي صفوفاً فارغة (الكتابة الجزئية تعتمد عليها)."""
+import pandas as pd
+
+import sheets_sync
+from fake_sheets import FakeGSheetsConnection
+from ledger_store import DRIVER_COLUMNS, TRANSACTION_COLUMNS, LedgerStore
+from ledger_writer import LedgerWriter
+from sheets_client import SheetsClient
+
+
+def _sheets_with_blank_row():
+    drivers = pd.DataFrame([
+        ["J1", "مندوب 1", "1111AB01", "22222222", "", True, 100.0],
+        [None] * len(DRIVER_COLUMNS),  # صف فارغ في الورقة (الصف 3)
+        ["J2", "مندوب 2", "2222AB02", "33333333", "", True, 200.0],
+    ], columns=DRIVER_COLUMNS)
+    transactions = pd.DataFrame([
+        ["مندوب 1 (ID:J1)", 100.0, "شحن رصيد", "2025-01-01 10:00:00", "J1"],
+        ["مندوب 2 (ID:J2)", 200.0, "شحن رصيد", "2025-01-01 11:00:00", "J2"],
+    ], columns=TRANSACTION_COLUMNS)
+    return {"drivers": drivers, "transactions": transactions}
+
+
+def _hydrated(tmp_path):
+    conn = FakeGSheetsConnection(_sheets_with_blank_row())
+    client = SheetsClient(conn, "test", read_quota=1000, write_quota=1000)
+    store = LedgerStore(str(tmp_path / "ledger.db"))
+    sheets_sync.hydrate(store, client)
+    return conn, client, store
+
+
+def test_sheet_rows_skip_blank_rows(tmp_path):
+    _, _, store = _hydrated(tmp_path)
+    rows = store.driver_sheet_rows(["J1", "J2"])
+    assert rows["J1"][0] == 2
+    assert rows["J2"][0] == 4
+
+
+def test_balance_update_writes_the_right_row(tmp_path):
+    conn, client, store = _hydrated(tmp_path)
+    mirror = sheets_sync.SheetsMirror(store, client)
+    writer = LedgerWriter(store, mirror)
+    writer.apply([("J2", 50.0, "شحن رصيد", False, False)])
+    assert mirror.flush(10)
+
+    drivers = conn.frame("drivers")
+    assert drivers.loc[0, "driver_id"] == "J1" and float(drivers.loc[0, "balance"]) == 100.0
+    assert drivers.iloc[1].isna().all()
+    assert drivers.loc[2, "driver_id"] == "J2" and float(drivers.loc[2, "balance"]) == 250.0
@@ -0,0 +1,38 @@
+"""حالة التحديث الدوري من Google Sheets (تُعرض في القائمة الجانبية)."""
+import sqlite3
+
+import pytest
+
+import sheets_sync
+from fake_sheets import FakeGSheetsConnection, synthetic_sheets
+from ledger_store import LedgerStore
+from sheets_client import SheetsClient
+
+
+@pytest.fixture
+def refresher(tmp_path):
+    conn = FakeGSheetsConnection(synthetic_sheets(10, 50))
+    client = SheetsClient(conn, "test", read_quota=1000, write_quota=1000)
+    store = LedgerStore(str(tmp_path / "ledger.db"))
+    sheets_sync.hydrate(store, client)
+    mirror = sheets_sync.SheetsMirror(store, client)
+    return store, sheets_sync.SheetsRefresher(store, client, mirror, interval=0)
+
+
+def test_successful_refresh_is_recorded(refresher):
+    _, refresher = refresher
+    assert refresher.refresh() == "unchanged"
+    assert refresher.last_success is not None
+    assert refresher.last_error is None
+
+
+def test_failed_replace_is_reported_as_error(refresher, monkeypatch):
+    store, refresher = refresher
+
+    def fail(*args, **kwargs):
+        raise sqlite3.IntegrityError("UNIQUE constraint failed: drivers.driver_id")
+
+    monkeypatch.setattr(store, "replace_sheets", fail)
+    assert refresher.refresh() == "error"
+    assert refresher.last_success is None
+    assert "UNIQUE" in refresher.last_error[1]